@@ -0,0 +1,68 @@
+import math
+
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+
+# size of the square grid cells, in degrees, that seller coordinates are bucketed into
+CELL_SIZE = 0.1
+COLUMNS = round(360 / CELL_SIZE)
+ROWS = round(180 / CELL_SIZE)
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def _row(latitude):
+    return min(int((latitude + 90) / CELL_SIZE), ROWS - 1)
+
+
+def _column(longitude):
+    return int(((longitude + 180) % 360) / CELL_SIZE) % COLUMNS
+
+
+def cell_for(latitude, longitude):
+    """
+    The grid cell id of a coordinate, numbered row by row from the south-west corner.
+    """
+    if latitude is None or longitude is None:
+        return None
+    return _row(latitude) * COLUMNS + _column(longitude)
+
+
+def cells_within(latitude, longitude, radius_km):
+    """
+    Ids of every grid cell that intersects the bounding box of a circle, so that a lookup on
+    the indexed cell column returns a superset of the points within the radius.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    if abs(latitude) + lat_delta >= 90:
+        # the circle takes in a pole, and with it every longitude
+        lng_delta = 180.0
+    else:
+        # widest at the points where the circle touches its meridians, as meridians converge
+        angle = radius_km / EARTH_RADIUS_KM
+        lng_delta = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(latitude))))
+
+    first_row, last_row = _row(max(latitude - lat_delta, -90)), _row(min(latitude + lat_delta, 90))
+    span = min(COLUMNS - 1, math.ceil(2 * lng_delta / CELL_SIZE) + 1)
+    first_column = _column(longitude - lng_delta)
+    columns = [(first_column + offset) % COLUMNS for offset in range(span + 1)]
+
+    return [row * COLUMNS + column for row in range(first_row, last_row + 1) for column in columns]
+
+
+def distance_km(latitude_field, longitude_field, latitude, longitude):
+    """
+    Database expression for the great-circle (haversine) distance between the coordinates held
+    in two fields and a fixed point.
+    """
+    lat1, lng1 = Radians(F(latitude_field)), Radians(F(longitude_field))
+    lat2 = Value(math.radians(latitude), output_field=FloatField())
+    lng2 = Value(math.radians(longitude), output_field=FloatField())
+
+    a = (
+        Power(Sin((lat1 - lat2) / 2), 2)
+        + Cos(lat1) * Cos(lat2) * Power(Sin((lng1 - lng2) / 2), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM, output_field=FloatField()) * ASin(Sqrt(a))
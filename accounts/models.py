@@ -2,10 +2,13 @@ from enum import Enum
 from uuid import uuid4
 
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from enumfields import EnumField
 from phonenumber_field.modelfields import PhoneNumberField
 
+from .geo import cell_for
+
 
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -39,6 +42,14 @@ class User(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(verbose_name='email address', max_length=150, unique=True)
     phone = PhoneNumberField(unique=True, region='KE', null=True, blank=True)
     location = models.CharField(max_length=255)
+    latitude = models.FloatField(
+        null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    longitude = models.FloatField(
+        null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
+    # grid cell of the coordinates, indexed for "near me" lookups (see accounts.geo)
+    geocell = models.BigIntegerField(null=True, blank=True, editable=False, db_index=True)
     role = EnumField(UserRole, default=UserRole.CONSUMER, max_length=64)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
@@ -54,6 +65,13 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     def __str__(self):
         return self.email
+
+    def save(self, *args, **kwargs):
+        self.geocell = cell_for(self.latitude, self.longitude)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"latitude", "longitude"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "geocell"}
+        super().save(*args, **kwargs)
     
     class Meta:
         ordering = ["-is_active", "created_at"]
@@ -6,6 +6,16 @@ from accounts.models import User, UserRole
 from core.serializers import EnumField
 
 
+def validate_coordinates(attrs, instance=None):
+    """
+    Latitude and longitude only make sense together, so both have to be set or cleared at once.
+    """
+    latitude = attrs.get("latitude", getattr(instance, "latitude", None))
+    longitude = attrs.get("longitude", getattr(instance, "longitude", None))
+    if (latitude is None) != (longitude is None):
+        raise serializers.ValidationError("Provide both latitude and longitude.")
+
+
 class UserSerializer(serializers.ModelSerializer):
     """
     Base serializer class for all users, for Retrieval (GET) endpoints
@@ -15,7 +25,10 @@ class UserSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ["id", "name", "email", "phone", "location", "role", "is_active", "is_staff", "created_at", "updated_at"]
+        fields = [
+            "id", "name", "email", "phone", "location", "latitude", "longitude", "role", "is_active", "is_staff",
+            "created_at", "updated_at",
+        ]
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -24,7 +37,11 @@ class UserCreateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ["name", "email", "phone", "location", "role", "password"]
+        fields = ["name", "email", "phone", "location", "latitude", "longitude", "role", "password"]
+
+    def validate(self, attrs):
+        validate_coordinates(attrs)
+        return attrs
 
     def validate_phone(self, value):
         phone_input = str(value)
@@ -74,7 +91,11 @@ class UserUpdateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ["name", "email", "phone", "location"]
+        fields = ["name", "email", "phone", "location", "latitude", "longitude"]
+
+    def validate(self, attrs):
+        validate_coordinates(attrs, self.instance)
+        return attrs
 
     def validate_phone(self, value):
         if not value:
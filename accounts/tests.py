@@ -1,3 +1,48 @@
-from django.test import TestCase
+import math
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .geo import COLUMNS, EARTH_RADIUS_KM, ROWS, cell_for, cells_within
+
+
+def destination(latitude, longitude, bearing, distance_km):
+    """
+    The coordinate reached from a point by going `distance_km` along a great circle.
+    """
+    lat, lng, bearing = math.radians(latitude), math.radians(longitude), math.radians(bearing)
+    angle = distance_km / EARTH_RADIUS_KM
+    lat2 = math.asin(math.sin(lat) * math.cos(angle) + math.cos(lat) * math.sin(angle) * math.cos(bearing))
+    lng2 = lng + math.atan2(
+        math.sin(bearing) * math.sin(angle) * math.cos(lat), math.cos(angle) - math.sin(lat) * math.sin(lat2)
+    )
+    return math.degrees(lat2), (math.degrees(lng2) + 540) % 360 - 180
+
+
+class CellsWithinTests(SimpleTestCase):
+    def assertCovers(self, latitude, longitude, radius_km):
+        cells = cells_within(latitude, longitude, radius_km)
+        self.assertEqual(len(cells), len(set(cells)))
+        self.assertTrue(all(0 <= cell < ROWS * COLUMNS for cell in cells))
+        cells = set(cells)
+        for bearing in range(0, 360, 10):
+            for distance in (radius_km / 2, radius_km * 0.999):
+                point = destination(latitude, longitude, bearing, distance)
+                self.assertIn(cell_for(*point), cells, f"{point} at {distance:.1f} km, bearing {bearing}")
+        return cells
+
+    def test_circle_is_covered(self):
+        cells = self.assertCovers(-1.2864, 36.8172, 25)
+        # and not much more than its bounding box
+        self.assertLess(len(cells), 100)
+        self.assertNotIn(cell_for(-1.2864, 37.5), cells)
+
+    def test_circle_across_the_antimeridian_wraps_around(self):
+        cells = self.assertCovers(-17.7134, 179.95, 50)
+        self.assertIn(cell_for(-17.7134, -179.95), cells)
+        self.assertNotIn(cell_for(-17.7134, 0), cells)
+
+    def test_circle_around_a_pole_covers_every_longitude(self):
+        for latitude in (89.95, -89.95):
+            with self.subTest(latitude=latitude):
+                cells = self.assertCovers(latitude, 10, 40)
+                self.assertTrue({cell_for(latitude, longitude) for longitude in range(-180, 180, 5)} <= cells)
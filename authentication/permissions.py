@@ -41,3 +41,12 @@ class IsFarmer(BasePermission):
     """
     def has_permission(self, request, view):
         return request.user.role == UserRole.FARMER
+
+
+class IsOrderParty(BasePermission):
+    """
+    Allow access to an order to its buyer, the sellers of its items and staff.
+    """
+    def has_object_permission(self, request, view, obj):
+        user = request.user
+        return obj.buyer_id == user.id or user.is_staff or obj.items.filter(seller=user).exists()
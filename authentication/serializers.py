@@ -31,6 +31,8 @@ class EmailPasswordTokenObtainSerializer(TokenObtainPairSerializer):
             "email": user.email,
             "phone": getattr(user.phone, "as_e164", None),
             "location": user.location,
+            "latitude": user.latitude,
+            "longitude": user.longitude,
             "role": user.role.value,
             "is_active": user.is_active,
             "is_staff": user.is_staff,
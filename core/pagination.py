@@ -0,0 +1,115 @@
+import base64
+import json
+from functools import reduce
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a stable, unique ordering such as ("-created_at", "-id").
+
+    Each page is fetched with a WHERE clause on the last row of the previous page instead of an
+    OFFSET, so the cost of a page stays the same no matter how deep into the list the client is.
+    The cursor handed to the client is an opaque base64 token of the ordering values.
+    """
+    ordering = ("-created_at", "-id")
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+
+    def __init__(self, ordering=None, page_size=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+        if page_size is not None:
+            self.page_size = page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.next_cursor = None
+        limit = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+
+        # fetch one extra row to know whether there is a next page without a COUNT query
+        results = list(queryset[:limit + 1])
+        if len(results) > limit:
+            results = results[:limit]
+            self.next_cursor = self.encode_cursor(results[-1])
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_position_filter(self, position):
+        """
+        Build the row-value comparison "(a, b, ...) after (x, y, ...)" as nested ORs, honouring
+        the direction of every ordering field.
+        """
+        conditions = []
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            equal = {f.lstrip("-"): position[f.lstrip("-")] for f in self.ordering[:index]}
+            conditions.append(Q(**equal, **{f"{name}__{lookup}": position[name]}))
+        return reduce(lambda left, right: left | right, conditions)
+
+    def encode_cursor(self, obj):
+        values = [str(getattr(obj, field.lstrip("-"))) for field in self.ordering]
+        raw = json.dumps(values, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    def decode_cursor(self, request, queryset):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            values = json.loads(raw)
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return {
+                field.lstrip("-"): self.get_output_field(queryset, field.lstrip("-")).to_python(value)
+                for field, value in zip(self.ordering, values)
+            }
+        except (ValueError, TypeError, DjangoValidationError):
+            raise NotFound("Invalid cursor")
+
+    @staticmethod
+    def get_output_field(queryset, name):
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
@@ -23,3 +23,16 @@ class EnumField(serializers.Field):
             "type": "string",
             "enum": [e.value for e in self.enum_class],
         }
+
+
+class DynamicFieldsMixin:
+    """
+    Serializer mixin taking an optional `fields` argument that limits the fields in the output
+    """
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
@@ -1,6 +1,7 @@
 import os
 
 from datetime import timedelta
+from decimal import Decimal
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -139,3 +140,51 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = '/media/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# in-process worker pool for work that should not hold up a request (see core.tasks)
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', '4'))
+
+BACKGROUND_TASKS_EAGER = os.getenv('BACKGROUND_TASKS_EAGER', 'false').lower() == 'true'
+
+# format of the resized product images, WEBP or JPEG
+PRODUCT_IMAGE_FORMAT = os.getenv('PRODUCT_IMAGE_FORMAT', 'WEBP').upper()
+
+# seconds after which the in-memory product suggestion index is rebuilt from the database
+PRODUCT_SUGGEST_REFRESH = int(os.getenv('PRODUCT_SUGGEST_REFRESH', '300'))
+
+# seconds for which the response to a request sent with an Idempotency-Key is replayed
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', '86400'))
+
+# seconds order events are left to settle before the sales rollups take them in, longer than
+# any transaction that records them
+SALES_ROLLUP_LAG = int(os.getenv('SALES_ROLLUP_LAG', '300'))
+
+# days after which completed and cancelled orders are moved to the archive tables
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv('ORDER_ARCHIVE_AFTER_DAYS', '180'))
+
+# queue new orders for the process_order_intake workers instead of creating them in the request
+ORDER_INTAKE_ASYNC = os.getenv('ORDER_INTAKE_ASYNC', 'false').lower() == 'true'
+
+# seconds after which an order intake claimed by a worker that went away is handed to another
+ORDER_INTAKE_CLAIM_TIMEOUT = int(os.getenv('ORDER_INTAKE_CLAIM_TIMEOUT', '300'))
+
+# claims after which an order intake that keeps crashing its worker is marked as failed
+ORDER_INTAKE_MAX_ATTEMPTS = int(os.getenv('ORDER_INTAKE_MAX_ATTEMPTS', '3'))
+
+# secret the card provider signs callback bodies with (hex HMAC-SHA256 in the X-Signature
+# header), card callbacks are refused while it is empty
+CARD_CALLBACK_SECRET = os.getenv('CARD_CALLBACK_SECRET', '')
+
+# secret last segment of the M-Pesa callback URL registered with Daraja, which cannot send
+# custom headers, M-Pesa callbacks are refused while it is empty
+MPESA_CALLBACK_TOKEN = os.getenv('MPESA_CALLBACK_TOKEN', '')
+
+# comma separated addresses M-Pesa callbacks are accepted from, any address when empty
+MPESA_CALLBACK_IPS = [ip.strip() for ip in os.getenv('MPESA_CALLBACK_IPS', '').split(',') if ip.strip()]
+
+# seconds seller ledger entries are left in the tail before the balance snapshots take them in,
+# longer than any transaction that writes them
+SELLER_BALANCE_LAG = int(os.getenv('SELLER_BALANCE_LAG', '300'))
+
+# smallest balance a payout run pays out to a seller
+SELLER_PAYOUT_MINIMUM = Decimal(os.getenv('SELLER_PAYOUT_MINIMUM', '100'))
@@ -0,0 +1,46 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix="background"
+            )
+    return _executor
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Run `func` on the process-wide worker pool once the current transaction commits, so the
+    request that scheduled it neither waits for it nor lets it see uncommitted rows.
+
+    Work is not persisted: callers keep enough state in the database to resume anything that
+    was lost with the process.
+    """
+    if settings.BACKGROUND_TASKS_EAGER:
+        transaction.on_commit(lambda: _run(func, *args, **kwargs))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_run, func, *args, **kwargs))
+
+
+def _run(func, *args, **kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception(f"Background task {func.__module__}.{func.__qualname__} failed")
+    finally:
+        if not settings.BACKGROUND_TASKS_EAGER:
+            # worker threads hold their own connections, release them between tasks
+            connections.close_all()
@@ -0,0 +1,27 @@
+"""
+Fixtures shared by the test suites of the apps.
+"""
+from decimal import Decimal
+
+from accounts.models import User
+from orders.models import Order
+from products.models import Product
+
+
+def create_user(email, role, location="Nakuru"):
+    return User.objects.create_user(email=email, password="secret-pass", name=email, location=location, role=role)
+
+
+def create_staff(email):
+    return User.objects.create_staff_user(email, "secret-pass", name="Staff", location="Nakuru")
+
+
+def create_product(seller, name, stock, **fields):
+    fields = {"category": "cereals", "description": name, **fields}
+    return Product.objects.create(
+        name=name, price=Decimal("100.00"), stock=Decimal(stock), image="products/test.png", seller=seller, **fields
+    )
+
+
+def create_order(buyer, total):
+    return Order.objects.create(buyer=buyer, total=Decimal(total))
@@ -8,6 +8,7 @@ urlpatterns = [
     path('api/auth/', include("authentication.urls")),
     path('api/notifications/', include("notifications.urls")),
     path('api/orders/', include("orders.urls")),
+    path('api/payments/', include("payments.urls")),
     path('api/products/', include("products.urls")),
 ]
 
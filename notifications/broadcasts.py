@@ -0,0 +1,100 @@
+import logging
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from core.tasks import run_in_background
+
+from .models import Broadcast, BroadcastStatus, Notification
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+# broadcasts that have not moved for this long were lost with the process sending them
+SWEEP_AFTER = timedelta(minutes=5)
+
+PENDING_STATUSES = (BroadcastStatus.QUEUED, BroadcastStatus.SENDING)
+
+
+def recipients(broadcast):
+    """
+    The active users matching every target of a broadcast.
+    """
+    users = User.objects.filter(is_active=True)
+    if broadcast.role is not None:
+        users = users.filter(role=broadcast.role)
+    if broadcast.location:
+        users = users.filter(location__iexact=broadcast.location)
+    if broadcast.user_ids:
+        users = users.filter(pk__in=broadcast.user_ids)
+    return users
+
+
+def start_broadcast(**fields):
+    """
+    Store a broadcast and schedule its fan-out once it commits.
+    """
+    with transaction.atomic():
+        broadcast = Broadcast.objects.create(**fields)
+        run_in_background(send_broadcast, broadcast.pk)
+    return broadcast
+
+
+def send_batch(broadcast_id, batch_size=BATCH_SIZE):
+    """
+    Notify the next `batch_size` recipients of a broadcast, in user id order after its cursor.
+    The notifications and the cursor are written in one transaction under the broadcast row
+    lock, so a fan-out picked up again by a sweep never notifies anyone twice.
+
+    Returns False once the broadcast is done.
+    """
+    with transaction.atomic():
+        broadcast = Broadcast.objects.select_for_update().filter(pk=broadcast_id, status__in=PENDING_STATUSES).first()
+        if broadcast is None:
+            return False
+
+        users = recipients(broadcast)
+        if broadcast.status == BroadcastStatus.QUEUED:
+            broadcast.recipients = users.count()
+        if broadcast.cursor is not None:
+            users = users.filter(pk__gt=broadcast.cursor)
+        user_ids = list(users.order_by("pk").values_list("pk", flat=True)[:batch_size])
+
+        Notification.objects.bulk_create(
+            [Notification(user_id=user_id, message=broadcast.message) for user_id in user_ids]
+        )
+        broadcast.sent += len(user_ids)
+        if user_ids:
+            broadcast.cursor = user_ids[-1]
+        broadcast.status = BroadcastStatus.SENDING if len(user_ids) == batch_size else BroadcastStatus.DONE
+        broadcast.save(update_fields=["recipients", "sent", "cursor", "status", "updated_at"])
+    return broadcast.status == BroadcastStatus.SENDING
+
+
+def send_broadcast(broadcast_id, batch_size=BATCH_SIZE):
+    """
+    Fan a broadcast out batch by batch until every recipient is notified.
+    """
+    while send_batch(broadcast_id, batch_size):
+        pass
+
+
+def sweep_broadcasts():
+    """
+    Finish the broadcasts whose fan-out stopped, e.g. because the process sending them went
+    away. Returns the number of broadcasts looked at.
+    """
+    broadcast_ids = list(
+        Broadcast.objects.filter(status__in=PENDING_STATUSES, updated_at__lt=timezone.now() - SWEEP_AFTER)
+        .order_by("created_at").values_list("id", flat=True)
+    )
+    for broadcast_id in broadcast_ids:
+        try:
+            send_broadcast(broadcast_id)
+        except Exception:
+            logger.exception(f"Broadcast {broadcast_id} could not be sent")
+    return len(broadcast_ids)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from notifications.broadcasts import sweep_broadcasts
+
+
+class Command(BaseCommand):
+    help = "Finish sending the broadcasts whose fan-out stopped"
+
+    def handle(self, *args, **options):
+        count = sweep_broadcasts()
+        self.stdout.write(self.style.SUCCESS(f"Sent {count} broadcasts"))
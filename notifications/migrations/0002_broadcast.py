@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:02
+
+import accounts.models
+import django.db.models.deletion
+import enumfields.fields
+import notifications.models
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('message', models.TextField()),
+                ('role', enumfields.fields.EnumField(blank=True, enum=accounts.models.UserRole, max_length=64, null=True)),
+                ('location', models.CharField(blank=True, max_length=255)),
+                ('user_ids', models.JSONField(blank=True, default=list)),
+                ('status', enumfields.fields.EnumField(default='queued', enum=notifications.models.BroadcastStatus, max_length=64)),
+                ('recipients', models.PositiveIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('cursor', models.UUIDField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='notificatio_status_778d08_idx')],
+            },
+        ),
+    ]
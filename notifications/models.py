@@ -7,6 +7,8 @@ from django.db import models
 from django.utils.timezone import now
 from enumfields import EnumField
 
+from accounts.models import UserRole
+
 User = get_user_model()
 
 
@@ -49,3 +51,39 @@ class Notification(models.Model):
             return f"{weeks} week{'s' if weeks > 1 else ''} ago"
         else:
             return self.created_at.strftime("%b %d, %Y")
+
+
+class BroadcastStatus(Enum):
+    QUEUED = "queued"
+    SENDING = "sending"
+    DONE = "done"
+
+
+class Broadcast(models.Model):
+    """
+    A notification sent to every user matching its targets, fanned out in batches by a
+    background worker (see notifications.broadcasts).
+    """
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid4)
+    message = models.TextField()
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    # targets, a user has to match all of the ones given
+    role = EnumField(UserRole, null=True, blank=True, max_length=64)
+    location = models.CharField(max_length=255, blank=True)
+    user_ids = models.JSONField(default=list, blank=True)
+    status = EnumField(BroadcastStatus, default=BroadcastStatus.QUEUED, max_length=64)
+    recipients = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    # last user notified, the fan-out resumes after it
+    cursor = models.UUIDField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "updated_at"]),
+        ]
+
+    def __str__(self):
+        return f"Broadcast {self.pk} - {self.status.value} ({self.sent}/{self.recipients})"
@@ -1,7 +1,11 @@
 from rest_framework import serializers
 
+from accounts.models import UserRole
 from core.serializers import EnumField
-from notifications.models import Notification, NotificationStatus
+from notifications.models import Broadcast, BroadcastStatus, Notification, NotificationStatus
+
+# explicit recipients a single broadcast may list
+MAX_USER_IDS = 10000
 
 
 class NotificationSerializer(serializers.ModelSerializer):
@@ -11,3 +15,26 @@ class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = ['id', 'message', 'user', 'status', 'created_at', 'get_humanized_time']
+
+
+class BroadcastSerializer(serializers.ModelSerializer):
+    role = EnumField(enum_class=UserRole, required=False, allow_null=True)
+    user_ids = serializers.ListField(
+        child=serializers.UUIDField(), required=False, max_length=MAX_USER_IDS
+    )
+    status = EnumField(enum_class=BroadcastStatus, read_only=True)
+
+    class Meta:
+        model = Broadcast
+        fields = [
+            'id', 'message', 'role', 'location', 'user_ids', 'status', 'recipients', 'sent', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['recipients', 'sent', 'created_at', 'updated_at']
+
+    def validate_user_ids(self, value):
+        return sorted({str(user_id) for user_id in value})
+
+    def validate(self, attrs):
+        if attrs.get('role') is None and not attrs.get('location') and not attrs.get('user_ids'):
+            raise serializers.ValidationError("Target the broadcast by `role`, `location` or `user_ids`")
+        return attrs
@@ -1,3 +1,93 @@
-from django.test import TestCase
+import threading
+from unittest import skipIf
 
-# Create your tests here.
+from django.db import connection, connections
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import UserRole
+from core.testing import create_staff, create_user
+
+from .broadcasts import SWEEP_AFTER, send_batch, send_broadcast, sweep_broadcasts
+from .models import Broadcast, BroadcastStatus, Notification
+
+
+def notified(broadcast):
+    """
+    How many notifications of `broadcast` each user got.
+    """
+    return dict(
+        Notification.objects.filter(message=broadcast.message).values("user_id")
+        .annotate(count=Count("id")).values_list("user_id", "count")
+    )
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class BroadcastTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(create_staff("staff@example.com"))
+        self.farmers = [create_user(f"farmer{index}@example.com", UserRole.FARMER) for index in range(5)]
+        create_user("eldoret@example.com", UserRole.FARMER, location="Eldoret")
+        create_user("buyer@example.com", UserRole.CONSUMER)
+
+    def test_broadcast_reaches_every_matching_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/notifications/broadcasts/", {"message": "Rain expected", "role": "farmer", "location": "nakuru"},
+                format="json",
+            )
+
+        self.assertEqual(response.status_code, 202, response.content)
+        progress = self.client.get(response.headers["Location"]).json()
+        self.assertEqual((progress["status"], progress["recipients"], progress["sent"]), ("done", 5, 5))
+        self.assertEqual(notified(Broadcast.objects.get()), {farmer.pk: 1 for farmer in self.farmers})
+
+    def test_interrupted_fan_out_resumes_after_its_cursor(self):
+        broadcast = Broadcast.objects.create(message="Rain expected", role=UserRole.FARMER, location="Nakuru")
+        # the process sending it goes away after the first batch
+        self.assertTrue(send_batch(broadcast.pk, batch_size=2))
+        self.assertEqual(sweep_broadcasts(), 0)
+        Broadcast.objects.update(updated_at=timezone.now() - SWEEP_AFTER * 2)
+
+        self.assertEqual(sweep_broadcasts(), 1)
+
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.status, broadcast.recipients, broadcast.sent), (BroadcastStatus.DONE, 5, 5))
+        self.assertEqual(notified(broadcast), {farmer.pk: 1 for farmer in self.farmers})
+        self.assertFalse(send_batch(broadcast.pk))
+
+
+@skipIf(connection.vendor == "sqlite", "SQLite serializes all writers, concurrency needs a real database")
+class ConcurrentBroadcastTests(TransactionTestCase):
+    USERS = 50
+    SENDERS = 4
+
+    def test_overlapping_fan_outs_notify_everyone_once(self):
+        users = [create_user(f"user{index}@example.com", UserRole.CONSUMER) for index in range(self.USERS)]
+        broadcast = Broadcast.objects.create(message="Market closed on Monday")
+        barrier = threading.Barrier(self.SENDERS)
+        errors = []
+
+        def send():
+            try:
+                barrier.wait()
+                # a sweep picking up a broadcast that is still being sent
+                send_broadcast(broadcast.pk, batch_size=7)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=send) for _ in range(self.SENDERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(notified(broadcast), {user.pk: 1 for user in users})
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.status, broadcast.sent), (BroadcastStatus.DONE, self.USERS))
@@ -4,5 +4,7 @@ from . import views
 
 urlpatterns = [
     path('', views.NotificationList.as_view()),
+    path('broadcasts/', views.BroadcastList.as_view()),
+    path('broadcasts/<uuid:pk>/', views.BroadcastDetail.as_view()),
     path('<uuid:pk>/', views.NotificationDetail.as_view()),
 ]
@@ -6,10 +6,11 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from authentication.permissions import IsOwner
+from authentication.permissions import IsOwner, IsStaff
 
-from .models import Notification, NotificationStatus
-from .serializers import NotificationSerializer
+from .broadcasts import start_broadcast
+from .models import Broadcast, Notification, NotificationStatus
+from .serializers import BroadcastSerializer, NotificationSerializer
 
 class NotificationList(APIView):
     """
@@ -86,3 +87,50 @@ class NotificationDetail(APIView):
         notification = self.get_object(pk)
         notification.delete()
         return Response({"detail": "Notification deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
+
+
+class BroadcastList(APIView):
+    """
+    Endpoint for staff to notify many users at once.
+    """
+
+    allowed_methods = ['POST']
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    def get_serializer_class(self):
+        return BroadcastSerializer
+
+    def post(self, request):
+        """
+        Queue a notification for every active user matching all of the given targets: `role`,
+        `location` and `user_ids`. The notifications are created in the background, follow the
+        progress at the returned Location.
+        """
+        serializer = self.get_serializer_class()(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        broadcast = start_broadcast(created_by=request.user, **serializer.validated_data)
+        response = Response(self.get_serializer_class()(broadcast).data, status=status.HTTP_202_ACCEPTED)
+        response.headers["Location"] = request.build_absolute_uri(f"{broadcast.pk}/")
+        return response
+
+
+class BroadcastDetail(APIView):
+    """
+    Endpoint to follow the progress of a broadcast.
+    """
+
+    allowed_methods = ['GET']
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    def get_serializer_class(self):
+        return BroadcastSerializer
+
+    def get(self, request, pk):
+        """
+        Get the status of a broadcast with the number of recipients notified so far
+        """
+        broadcast = get_object_or_404(Broadcast, pk=pk)
+        serializer = self.get_serializer_class()(broadcast)
+        return Response(serializer.data, status=status.HTTP_200_OK)
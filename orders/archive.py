@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import ARCHIVABLE_STATUSES, ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+BATCH_SIZE = 500
+
+# sent with the `order_ids` of a batch once their ArchivedOrder rows exist and before the orders
+# are deleted, so that apps with rows cascading from orders can move them along
+orders_archived = Signal()
+
+
+def archive_batch(cutoff, batch_size=BATCH_SIZE):
+    """
+    Move up to `batch_size` orders that were completed or cancelled before `cutoff`, with their
+    items, into the archive tables in one transaction. Returns the number of orders moved.
+    """
+    with transaction.atomic():
+        # skip orders locked by a concurrent run or a late update instead of waiting for them
+        order_ids = list(
+            Order.objects.select_for_update(skip_locked=True)
+            .filter(status__in=ARCHIVABLE_STATUSES, updated_at__lt=cutoff)
+            .order_by("updated_at").values_list("id", flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return 0
+
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(**order) for order in Order.objects.filter(pk__in=order_ids).values(
+                "id", "buyer_id", "status", "payment_status", "total", "amount_paid", "created_at", "updated_at"
+            )
+        ])
+        ArchivedOrderItem.objects.bulk_create([
+            ArchivedOrderItem(product_name=item.pop("product__name"), **item)
+            for item in OrderItem.objects.filter(order_id__in=order_ids).values(
+                "id", "order_id", "product_id", "product__name", "seller_id", "unit_price", "quantity"
+            )
+        ])
+        orders_archived.send(sender=Order, order_ids=order_ids)
+        Order.objects.filter(pk__in=order_ids).delete()
+    return len(order_ids)
+
+
+def archive_orders(older_than_days, batch_size=BATCH_SIZE):
+    """
+    Archive every order completed or cancelled more than `older_than_days` days ago, one batch
+    per transaction so that an interrupted run can simply be started again.
+    """
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    total = 0
+    while archived := archive_batch(cutoff, batch_size):
+        total += archived
+    return total
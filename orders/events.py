@@ -0,0 +1,96 @@
+import math
+
+from django.db.models import OuterRef, Subquery
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import OrderEvent, OrderEventKind
+
+# sent with the list of `events` once they are written
+order_events_recorded = Signal()
+
+
+def _record(kind, changes, at=None):
+    at = at or timezone.now()
+    events = [
+        OrderEvent(
+            order_id=order_id,
+            kind=kind,
+            from_status=previous.value if previous is not None else "",
+            to_status=current.value,
+            created_at=at,
+        )
+        for order_id, previous, current in changes
+    ]
+    if events:
+        OrderEvent.objects.bulk_create(events)
+        order_events_recorded.send(sender=OrderEvent, events=events)
+    return events
+
+
+def record_status_changes(changes, at=None):
+    """
+    Append an event for every `(order_id, previous status, new status)` change, previous being
+    None for new orders. Call it in the transaction that changes the orders.
+    """
+    return _record(OrderEventKind.STATUS, changes, at)
+
+
+def record_payment_changes(changes, at=None):
+    """
+    Append an event for every `(order_id, previous payment status, new payment status)` change.
+    """
+    return _record(OrderEventKind.PAYMENT, changes, at)
+
+
+def timeline(order):
+    """
+    The events of an order, oldest first. Nothing happens to an order before it is created, so
+    bounding the scan by its creation time lets PostgreSQL skip the older partitions.
+    """
+    return OrderEvent.objects.filter(order_id=order.pk, created_at__gte=order.created_at).order_by("created_at")
+
+
+def percentile(values, fraction):
+    """
+    Linear interpolation between the closest ranks of sorted `values`.
+    """
+    position = (len(values) - 1) * fraction
+    lower, upper = math.floor(position), math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def status_latency(status, since, until, percentiles=(0.5, 0.9, 0.99)):
+    """
+    How long orders that entered `status` between `since` and `until` stayed in it.
+
+    The entries are a range scan of the (kind, to_status, created_at) index, and the following
+    event of each order a lookup in the (order, created_at) one. Orders still in the status are
+    counted but left out of the durations.
+    """
+    left_at = OrderEvent.objects.filter(
+        kind=OrderEventKind.STATUS, order_id=OuterRef("order_id"), created_at__gt=OuterRef("created_at")
+    ).order_by("created_at").values("created_at")[:1]
+    entries = OrderEvent.objects.filter(
+        kind=OrderEventKind.STATUS, to_status=status.value, created_at__gte=since, created_at__lt=until
+    ).annotate(left_at=Subquery(left_at)).values_list("created_at", "left_at")
+
+    entered = 0
+    durations = []
+    for entered_at, exited_at in entries.iterator(chunk_size=5000):
+        entered += 1
+        if exited_at is not None:
+            durations.append((exited_at - entered_at).total_seconds())
+    durations.sort()
+
+    return {
+        "status": status.value,
+        "since": since,
+        "until": until,
+        "entered": entered,
+        "left": len(durations),
+        "seconds": {
+            f"p{round(fraction * 100)}": percentile(durations, fraction) if durations else None
+            for fraction in percentiles
+        },
+    }
@@ -0,0 +1,94 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(request):
+    """
+    Hash of what makes two requests the same: the endpoint and the parsed body.
+    """
+    body = json.dumps(request.data, sort_keys=True, separators=(",", ":"), cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+def idempotent(view_method):
+    """
+    Make a view method safe to retry by sending an `Idempotency-Key` header.
+
+    The key is claimed by inserting its row in the same transaction the view runs in, so a
+    concurrent duplicate waits on the unique index until the first request finishes and then
+    replays its response instead of running the view again. Successful responses are kept
+    for IDEMPOTENCY_KEY_TTL seconds. Errors are not: whether a request conflicts or runs short
+    of stock depends on the state it meets, so the claim is released and a retry runs the view
+    again. Server errors also roll back whatever the view wrote. Requests without the header or
+    an authenticated user are not affected.
+    """
+    @wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER, "").strip()
+        if not key or not request.user.is_authenticated:
+            return view_method(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"detail": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        request_fingerprint = fingerprint(request)
+        with transaction.atomic():
+            record, created = IdempotencyKey.objects.select_for_update().get_or_create(
+                user=request.user, key=key,
+                defaults={"fingerprint": request_fingerprint, "expires_at": expires_at},
+            )
+            if not created and record.expires_at > now:
+                return replay(record, request_fingerprint)
+
+            response = view_method(view, request, *args, **kwargs)
+            if response.status_code >= 500:
+                transaction.set_rollback(True)
+                return response
+            if not status.is_success(response.status_code):
+                record.delete()
+                return response
+
+            record.fingerprint = request_fingerprint
+            record.status_code = response.status_code
+            record.response = response.data
+            record.created_at = now
+            record.expires_at = expires_at
+            record.save()
+        return response
+
+    return wrapper
+
+
+def replay(record, request_fingerprint):
+    if record.fingerprint != request_fingerprint:
+        return Response(
+            {"detail": f"This {HEADER} was already used for a different request"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(record.response, status=record.status_code)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def purge_expired_keys():
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,135 @@
+import logging
+import signal
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import OrderIntake, OrderIntakeStatus
+from .serializers import OrderCreateSerializer
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+
+POLL_INTERVAL = 1.0
+
+
+def enqueue(buyer, payload):
+    """
+    Queue an already validated order for the intake workers and return its tracking row.
+    """
+    return OrderIntake.objects.create(buyer=buyer, payload=payload)
+
+
+def claim_batch(worker, batch_size=BATCH_SIZE):
+    """
+    Claim up to `batch_size` queued intakes, oldest first, for `worker`.
+
+    Workers lock rows with SKIP LOCKED so that they never wait on each other, and intakes
+    claimed longer than ORDER_INTAKE_CLAIM_TIMEOUT ago by a worker that died are taken over.
+    An intake already claimed ORDER_INTAKE_MAX_ATTEMPTS times is marked as failed instead, so
+    one that crashes its worker every time cannot take the whole pool down in turn.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.ORDER_INTAKE_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        intakes = list(
+            OrderIntake.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=OrderIntakeStatus.QUEUED) | Q(status=OrderIntakeStatus.PROCESSING, claimed_at__lt=stale))
+            .order_by("created_at").values_list("id", "attempts")[:batch_size]
+        )
+        intake_ids = [intake_id for intake_id, attempts in intakes if attempts < settings.ORDER_INTAKE_MAX_ATTEMPTS]
+        exhausted = OrderIntake.objects.filter(pk__in={intake_id for intake_id, _ in intakes} - set(intake_ids))
+        # keep the error of the last attempt if it got as far as recording one
+        exhausted.filter(errors__isnull=True).update(
+            errors={"detail": f"Order could not be processed in {settings.ORDER_INTAKE_MAX_ATTEMPTS} attempts."}
+        )
+        exhausted.update(status=OrderIntakeStatus.FAILED, claimed_by=None, updated_at=now)
+        OrderIntake.objects.filter(pk__in=intake_ids).update(
+            status=OrderIntakeStatus.PROCESSING, claimed_by=worker, claimed_at=now, attempts=F("attempts") + 1,
+            updated_at=now,
+        )
+    return intake_ids
+
+
+def process(intake_id, worker):
+    """
+    Create the order of a claimed intake. The order and the outcome of the intake are written
+    in one transaction that only commits while `worker` still holds the claim, so an intake
+    taken over after a timeout never produces two orders.
+    """
+    intake = OrderIntake.objects.select_related("buyer").get(pk=intake_id)
+    with transaction.atomic():
+        serializer = OrderCreateSerializer(data=intake.payload)
+        try:
+            serializer.is_valid(raise_exception=True)
+            order = serializer.save(buyer=intake.buyer)
+        except serializers.ValidationError as e:
+            outcome = {"status": OrderIntakeStatus.FAILED, "errors": e.detail}
+        else:
+            outcome = {"status": OrderIntakeStatus.DONE, "order": order, "errors": None}
+
+        finished = OrderIntake.objects.filter(
+            pk=intake_id, status=OrderIntakeStatus.PROCESSING, claimed_by=worker
+        ).update(claimed_by=None, updated_at=timezone.now(), **outcome)
+        if not finished:
+            transaction.set_rollback(True)
+
+
+def record_error(intake_id, worker, error):
+    """
+    Record the error a claimed intake raised. The intake stays claimed and is retried once the
+    claim times out, unless this was its last attempt, in which case it is marked as failed.
+    """
+    now = timezone.now()
+    intake = OrderIntake.objects.filter(pk=intake_id, status=OrderIntakeStatus.PROCESSING, claimed_by=worker)
+    errors = {"detail": f"Order could not be processed: {error}"}
+    intake.filter(attempts__gte=settings.ORDER_INTAKE_MAX_ATTEMPTS).update(
+        status=OrderIntakeStatus.FAILED, claimed_by=None, errors=errors, updated_at=now
+    )
+    intake.update(errors=errors, updated_at=now)
+
+
+def drain_batch(worker, batch_size=BATCH_SIZE):
+    """
+    Claim and process one batch. Returns the number of intakes claimed.
+    """
+    intake_ids = claim_batch(worker, batch_size)
+    for intake_id in intake_ids:
+        try:
+            process(intake_id, worker)
+        except Exception as e:
+            logger.exception(f"Order intake {intake_id} could not be processed")
+            record_error(intake_id, worker, e)
+    return len(intake_ids)
+
+
+def work(stop, batch_size=BATCH_SIZE, once=False):
+    """
+    Worker process loop: drain the queue, then poll it until `stop` is set.
+
+    Workers ignore SIGINT and SIGTERM, which a terminal or service manager may send to the
+    whole process group: the parent process sets `stop` on either, and a worker then exits
+    once it has processed the batch it holds.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    import django
+    django.setup()
+
+    worker = uuid4()
+    try:
+        while not stop.is_set():
+            if drain_batch(worker, batch_size):
+                continue
+            if once:
+                break
+            stop.wait(POLL_INTERVAL)
+    finally:
+        connections.close_all()
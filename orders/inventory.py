@@ -0,0 +1,84 @@
+from collections import defaultdict
+
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+from rest_framework import serializers
+
+from products import facets
+from products.models import Product
+
+from .models import OrderItem
+
+
+def _mark_stock_changes(product_ids, restocked):
+    """
+    Move the in-stock facet count of products that ran out of (or came back into) stock.
+    """
+    if product_ids:
+        delta = len(product_ids) if restocked else -len(product_ids)
+        facets.apply_deltas({(facets.IN_STOCK, "true"): delta, (facets.IN_STOCK, "false"): -delta})
+
+
+def _by_product(quantities):
+    """
+    The quantity of each product as a CASE, for updating all of them in one UPDATE.
+    """
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=Product._meta.get_field("stock"),
+    )
+
+
+def _lock_stock(product_ids):
+    return dict(
+        Product.objects.select_for_update().filter(pk__in=product_ids).order_by("pk").values_list("pk", "stock")
+    )
+
+
+def reserve_stock(items):
+    """
+    Take the ordered quantities out of stock. Must run inside the transaction that creates the order.
+
+    The products of the basket are locked with one SELECT ... FOR UPDATE in product id order, so
+    that checkouts only queue up behind others that want the same products and two baskets
+    sharing products cannot deadlock. Their stock is checked on the locked rows and taken out with
+    a single UPDATE, so a checkout costs the same number of queries whatever the basket size.
+    Raises a ValidationError listing every product that is short, which rolls back the whole order.
+    """
+    quantities = defaultdict(int)
+    for item in items:
+        quantities[item["product"].pk] += item["quantity"]
+
+    stock = _lock_stock(quantities)
+    short = [product_id for product_id, quantity in quantities.items() if stock.get(product_id, 0) < quantity]
+    if short:
+        names = Product.objects.filter(pk__in=short).order_by("name").values_list("name", flat=True)
+        raise serializers.ValidationError({"items": [f"Not enough stock for: {', '.join(names)}"]})
+
+    Product.objects.filter(pk__in=quantities).update(
+        stock=F("stock") - _by_product(quantities), updated_at=timezone.now()
+    )
+    _mark_stock_changes(
+        [product_id for product_id, quantity in quantities.items() if stock[product_id] <= quantity], restocked=False
+    )
+
+
+def release_stock(order_ids):
+    """
+    Put the quantities of cancelled orders back into stock, locking the products in the same
+    order as reserve_stock and updating them with one UPDATE.
+
+    Callers must make sure each order is released only once, e.g. by moving it to CANCELLED with a
+    conditional update in the same transaction.
+    """
+    quantities = dict(
+        OrderItem.objects.filter(order_id__in=order_ids).values("product_id")
+        .annotate(quantity=Sum("quantity")).values_list("product_id", "quantity")
+    )
+    if not quantities:
+        return
+    stock = _lock_stock(quantities)
+    Product.objects.filter(pk__in=quantities).update(
+        stock=F("stock") + _by_product(quantities), updated_at=timezone.now()
+    )
+    _mark_stock_changes([product_id for product_id in stock if stock[product_id] <= 0], restocked=True)
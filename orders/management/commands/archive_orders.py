@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from orders.archive import BATCH_SIZE, archive_orders
+
+
+class Command(BaseCommand):
+    help = "Move orders completed or cancelled a while ago out of the order tables into the archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days", type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS,
+            help="Archive orders that were completed or cancelled more than this many days ago"
+        )
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Number of orders moved per transaction")
+
+    def handle(self, *args, **options):
+        count = archive_orders(options["older_than_days"], options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Archived {count} orders"))
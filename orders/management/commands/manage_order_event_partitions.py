@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders import partitions
+
+
+class Command(BaseCommand):
+    help = "Create the upcoming monthly partitions of the order event log and detach the expired ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead", type=int, default=2, help="Number of months after the current one to create"
+        )
+        parser.add_argument(
+            "--retain-months", type=int, default=None,
+            help="Detach the partitions of months older than this many months (kept by default)"
+        )
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            self.stdout.write("The order event log is only partitioned on PostgreSQL, nothing to do")
+            return
+
+        now = timezone.now()
+        for name in partitions.ensure_partitions(now, options["months_ahead"]):
+            self.stdout.write(f"Created {name}")
+        if options["retain_months"] is not None:
+            for name in partitions.detach_partitions(partitions.month_start(now, -options["retain_months"])):
+                self.stdout.write(f"Detached {name}")
+        self.stdout.write(self.style.SUCCESS("Order event partitions are up to date"))
@@ -0,0 +1,38 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from orders.intake import BATCH_SIZE, work
+
+
+class Command(BaseCommand):
+    help = "Run a pool of worker processes that create the orders queued in asynchronous intake mode"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="Number of worker processes")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Number of orders claimed at a time")
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty instead of polling it")
+
+    def handle(self, *args, **options):
+        # the workers open their own connections
+        connections.close_all()
+        stop = multiprocessing.Event()
+
+        def shut_down(signum, frame):
+            # stop claiming, every worker exits once it has processed the batch it holds
+            stop.set()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, shut_down)
+        workers = [
+            multiprocessing.Process(target=work, args=(stop, options["batch_size"], options["once"]))
+            for _ in range(options["workers"])
+        ]
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS("Order intake workers stopped"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from orders.rollups import rebuild_rollups, refresh_rollups
+
+
+class Command(BaseCommand):
+    help = "Add the orders completed since the last run to the daily sales rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild", action="store_true", help="Drop the rollups and recompute them from every completed order"
+        )
+
+    def handle(self, *args, **options):
+        count = rebuild_rollups() if options["rebuild"] else refresh_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Added {count} completed orders to the sales rollups"))
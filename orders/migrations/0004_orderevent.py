@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:30
+
+import django.db.models.deletion
+import django.utils.timezone
+import enumfields.fields
+import orders.models
+import uuid
+from django.db import migrations, models
+
+from core.operations import PostgreSQLOnly
+
+# the model's table recreated as the parent of monthly partitions, PostgreSQL requires the
+# partition key to be part of the primary key
+PARTITIONED_TABLE = """
+DROP TABLE "orders_orderevent";
+CREATE TABLE "orders_orderevent" (
+    "id" uuid NOT NULL,
+    "kind" varchar(64) NOT NULL,
+    "from_status" varchar(64) NOT NULL,
+    "to_status" varchar(64) NOT NULL,
+    "created_at" timestamp with time zone NOT NULL,
+    "order_id" uuid NOT NULL,
+    PRIMARY KEY ("id", "created_at")
+) PARTITION BY RANGE ("created_at");
+CREATE TABLE "orders_orderevent_default" PARTITION OF "orders_orderevent" DEFAULT;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', enumfields.fields.EnumField(enum=orders.models.OrderEventKind, max_length=64)),
+                ('from_status', models.CharField(blank=True, max_length=64)),
+                ('to_status', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='events', to='orders.order')),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+        PostgreSQLOnly(
+            migrations.RunSQL(PARTITIONED_TABLE, reverse_sql=migrations.RunSQL.noop),
+        ),
+        migrations.AddIndex(
+            model_name='orderevent',
+            index=models.Index(fields=['order', 'created_at'], name='orders_orde_order_i_4c5f76_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderevent',
+            index=models.Index(fields=['kind', 'to_status', 'created_at'], name='orders_orde_kind_73dfad_idx'),
+        ),
+    ]
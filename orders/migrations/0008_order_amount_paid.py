@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:54
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_amount_paid(apps, schema_editor):
+    for order_model, payment_model in (('Order', 'Payment'), ('ArchivedOrder', 'ArchivedPayment')):
+        Order = apps.get_model('orders', order_model)
+        Payment = apps.get_model('payments', payment_model)
+        paid = Payment.objects.filter(order=OuterRef('pk')).values('order').annotate(paid=Sum('amount')).values('paid')
+        Order.objects.update(amount_paid=Coalesce(Subquery(paid), Value(Decimal('0.00'))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_orderintake'),
+        ('payments', '0004_paymentcallback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='amount_paid',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='amount_paid',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.RunPython(populate_amount_paid, migrations.RunPython.noop),
+    ]
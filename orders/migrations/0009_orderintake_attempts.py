@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_order_amount_paid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderintake',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
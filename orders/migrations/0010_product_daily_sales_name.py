@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_product_details(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductDailySales = apps.get_model('orders', 'ProductDailySales')
+    product = Product.objects.filter(pk=OuterRef('product_id'))
+    ProductDailySales.objects.update(
+        product_name=Subquery(product.values('name')), seller_id=Subquery(product.values('seller_id'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_orderintake_attempts'),
+        ('products', '0008_product_image_derivatives'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productdailysales',
+            name='product_name',
+            field=models.CharField(default='', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='productdailysales',
+            name='seller',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_daily_sales', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(populate_product_details, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='productdailysales',
+            name='product',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='products.product'),
+        ),
+    ]
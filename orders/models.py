@@ -3,8 +3,10 @@ from enum import Enum
 from uuid import uuid4
 
 from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
 from enumfields import EnumField
 
 from products.models import Product
@@ -21,6 +23,10 @@ class OrderStatus(Enum):
     CANCELLED = "cancelled"
 
 
+# orders that have not left the farm yet can still be cancelled
+CANCELLABLE_STATUSES = (OrderStatus.PENDING, OrderStatus.CONFIRMED, OrderStatus.PACKED)
+
+
 class PaymentStatus(Enum):
     PENDING = "pending"
     PARTIAL = "partial"
@@ -38,11 +44,19 @@ class Order(models.Model):
     status = EnumField(OrderStatus, default=OrderStatus.PENDING, max_length=64)
     payment_status = EnumField(PaymentStatus, default=PaymentStatus.PENDING, max_length=64)
     total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    # sum of the payments, maintained by payments.services
+    amount_paid = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["buyer", "-created_at", "-id"]),
+            models.Index(fields=["buyer", "status", "-created_at", "-id"]),
+            models.Index(fields=["status", "-created_at", "-id"]),
+            models.Index(fields=["status", "updated_at"]),
+        ]
 
     def __str__(self):
         return f"Order {self.id} - {self.buyer}"
@@ -59,9 +73,220 @@ class OrderItem(models.Model):
     unit_price = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(Decimal("0.00"))])
     quantity = models.DecimalField(max_digits=12, decimal_places=3, validators=[MinValueValidator(Decimal("0.001"))])
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["seller", "order"]),
+        ]
+
     @property
     def item_total(self):
         return self.unit_price * self.quantity
 
     def __str__(self):
         return f"{self.product} x {self.quantity}"
+
+
+# orders in these statuses no longer change and are moved to the archive tables after a while
+ARCHIVABLE_STATUSES = (OrderStatus.COMPLETED, OrderStatus.CANCELLED)
+
+
+class ArchivedOrder(models.Model):
+    """
+    A completed or cancelled order moved out of the Order table by orders.archive, with the
+    same id so that it is still found by the order detail endpoint.
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_orders")
+    status = EnumField(OrderStatus, max_length=64)
+    payment_status = EnumField(PaymentStatus, max_length=64)
+    total = models.DecimalField(max_digits=12, decimal_places=2)
+    amount_paid = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["buyer", "-created_at", "-id"]),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.id} - {self.buyer_id}"
+
+
+class ArchivedOrderItem(models.Model):
+    """
+    Line item of an archived order. The product name is kept with it so that archived orders
+    neither hold on to nor depend on their products.
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(
+        Product, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name="+"
+    )
+    product_name = models.CharField(max_length=255)
+    seller = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="archived_sold_items"
+    )
+    unit_price = models.DecimalField(max_digits=12, decimal_places=2)
+    quantity = models.DecimalField(max_digits=12, decimal_places=3)
+
+    @property
+    def item_total(self):
+        return self.unit_price * self.quantity
+
+    def __str__(self):
+        return f"{self.product_name} x {self.quantity}"
+
+
+class OrderEventKind(Enum):
+    STATUS = "status"
+    PAYMENT = "payment"
+
+
+class OrderEvent(models.Model):
+    """
+    Append-only log of the status and payment status changes of orders.
+
+    On PostgreSQL the table is partitioned by month of `created_at` (see the
+    manage_order_event_partitions command), so old months can be detached without touching the
+    rest of the log. Events outlive their order, hence the reference without a constraint.
+    """
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid4)
+    order = models.ForeignKey(
+        Order, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name="events"
+    )
+    kind = EnumField(OrderEventKind, max_length=64)
+    from_status = models.CharField(max_length=64, blank=True)
+    to_status = models.CharField(max_length=64)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["order", "created_at"]),
+            models.Index(fields=["kind", "to_status", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"Order {self.order_id} {self.kind.value} {self.from_status or '-'} -> {self.to_status}"
+
+
+class DailySales(models.Model):
+    """
+    Revenue, units and number of orders completed on one day, kept up to date by orders.rollups.
+    """
+    day = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    units = models.DecimalField(max_digits=14, decimal_places=3, default=Decimal("0.000"))
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+        ordering = ["day"]
+
+
+class SellerDailySales(DailySales):
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name="daily_sales")
+
+    class Meta(DailySales.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=["seller", "day"], name="unique_seller_daily_sales"),
+        ]
+
+
+class ProductDailySales(DailySales):
+    """
+    Daily sales of a product. The name and seller of the product are kept with them, as on
+    archived order items, so that the sales history of a deleted product stays readable.
+    """
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    product_name = models.CharField(max_length=255)
+    seller = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True, related_name="product_daily_sales"
+    )
+
+    class Meta(DailySales.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=["product", "day"], name="unique_product_daily_sales"),
+        ]
+
+
+class CategoryDailySales(DailySales):
+    category = models.CharField(max_length=64, blank=True)
+
+    class Meta(DailySales.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=["category", "day"], name="unique_category_daily_sales"),
+        ]
+
+
+class RollupMark(models.Model):
+    """
+    High-water mark of a rollup: the last order event, by (created_at, id), it has taken in.
+    """
+    name = models.CharField(max_length=64, unique=True)
+    event_at = models.DateTimeField(null=True, blank=True)
+    event_id = models.UUIDField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} up to {self.event_at}"
+
+
+class OrderIntakeStatus(Enum):
+    QUEUED = "queued"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class OrderIntake(models.Model):
+    """
+    An order placed in asynchronous intake mode, waiting in this table for a worker of the
+    process_order_intake command to create it (see orders.intake).
+    """
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid4)
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name="order_intakes")
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    status = EnumField(OrderIntakeStatus, default=OrderIntakeStatus.QUEUED, max_length=64)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    errors = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    claimed_by = models.UUIDField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"Order intake {self.id} - {self.status.value}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The stored outcome of a request sent with an `Idempotency-Key` header, replayed to retries
+    of the same request until it expires (see orders.idempotency).
+    """
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid4)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="idempotency_keys")
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "key"], name="unique_user_idempotency_key"),
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} - {self.user}"
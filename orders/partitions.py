@@ -0,0 +1,106 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+
+from .models import OrderEvent
+
+TABLE = OrderEvent._meta.db_table
+
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+
+def month_start(moment, offset=0):
+    """
+    The first instant (UTC) of the month `offset` months after the one `moment` falls in.
+    """
+    index = moment.year * 12 + moment.month - 1 + offset
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(start):
+    return f"{TABLE}_p{start:%Y_%m}"
+
+
+def is_partitioned():
+    return connection.vendor == "postgresql"
+
+
+def list_partitions():
+    """
+    The monthly partitions of the event log, oldest first.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s AND child.relname <> %s
+            ORDER BY child.relname
+            """,
+            [TABLE, DEFAULT_PARTITION],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def create_partition(start):
+    """
+    Create the partition of the month starting at `start`.
+
+    Events of that month that already landed in the default partition are moved into the new
+    one, which requires detaching the default partition for the duration of the transaction.
+    """
+    end = month_start(start, 1)
+    name = partition_name(start)
+    quote = connection.ops.quote_name
+    bounds = [start, end]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {quote(DEFAULT_PARTITION)} WHERE created_at >= %s AND created_at < %s)",
+            bounds,
+        )
+        if not cursor.fetchone()[0]:
+            cursor.execute(
+                f"CREATE TABLE {quote(name)} PARTITION OF {quote(TABLE)} FOR VALUES FROM (%s) TO (%s)", bounds
+            )
+            return name
+
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(DEFAULT_PARTITION)}")
+        cursor.execute(f"CREATE TABLE {quote(name)} PARTITION OF {quote(TABLE)} FOR VALUES FROM (%s) TO (%s)", bounds)
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {quote(DEFAULT_PARTITION)} WHERE created_at >= %s AND created_at < %s "
+            f"RETURNING *) INSERT INTO {quote(name)} SELECT * FROM moved",
+            bounds,
+        )
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(DEFAULT_PARTITION)} DEFAULT")
+    return name
+
+
+def ensure_partitions(now, months_ahead):
+    """
+    Create the missing partitions from the current month up to `months_ahead` months ahead.
+    """
+    existing = set(list_partitions())
+    created = []
+    for offset in range(months_ahead + 1):
+        start = month_start(now, offset)
+        if partition_name(start) not in existing:
+            created.append(create_partition(start))
+    return created
+
+
+def detach_partitions(before):
+    """
+    Detach the partitions of the months before `before`. The detached tables are left in place
+    to be exported or dropped, and their events no longer show up in timelines or latencies.
+    """
+    cutoff = partition_name(month_start(before))
+    quote = connection.ops.quote_name
+    detached = []
+    with connection.cursor() as cursor:
+        for name in list_partitions():
+            if name < cutoff:
+                cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(name)}")
+                detached.append(name)
+    return detached
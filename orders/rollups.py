@@ -0,0 +1,150 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, F, Q, Sum
+from django.utils import timezone
+
+from .models import (
+    ArchivedOrderItem, CategoryDailySales, OrderEvent, OrderEventKind, OrderItem, OrderStatus, ProductDailySales,
+    RollupMark, SellerDailySales,
+)
+
+MARK = "sales"
+
+BATCH_SIZE = 2000
+
+
+class Totals:
+    def __init__(self):
+        self.revenue = Decimal("0.00")
+        self.units = Decimal("0.000")
+        self.orders = set()
+
+    def add(self, order_id, revenue, units):
+        self.revenue += revenue
+        self.units += units
+        self.orders.add(order_id)
+
+
+def _apply(model, key_field, totals, details=None):
+    """
+    Add the batch totals, keyed by `(key, day)`, onto the stored rollup rows. `details` maps
+    keys to further fields, set on the rows of this batch.
+    """
+    if not totals:
+        return
+    details = details or {}
+    fields = {field for values in details.values() for field in values}
+    keys = {key for key, _ in totals}
+    days = {day for _, day in totals}
+    existing = {
+        (getattr(row, key_field), row.day): row
+        for row in model.objects.filter(**{f"{key_field}__in": keys, "day__in": days})
+    }
+
+    created = []
+    for (key, day), batch in totals.items():
+        row = existing.get((key, day))
+        if row is None:
+            row = model(**{key_field: key, "day": day})
+            created.append(row)
+        for field, value in details.get(key, {}).items():
+            setattr(row, field, value)
+        row.revenue += batch.revenue
+        row.units += batch.units
+        row.orders += len(batch.orders)
+
+    model.objects.bulk_create(created)
+    model.objects.bulk_update(
+        [row for row in existing.values()], ["revenue", "units", "orders", *fields], batch_size=BATCH_SIZE
+    )
+
+
+def _sold(model, order_ids, name):
+    return (
+        model.objects.filter(order_id__in=order_ids).order_by()
+        .values("order_id", "seller_id", "product_id", name=F(name), category=F("product__category"))
+        .annotate(
+            revenue=Sum(F("unit_price") * F("quantity"), output_field=DecimalField()),
+            units=Sum("quantity"),
+        )
+    )
+
+
+def _roll_up(events):
+    completed_on = {event.order_id: timezone.localdate(event.created_at) for event in events}
+    # orders archived since their completion are read from the archive, in the same statement
+    # so that a batch archived meanwhile is seen exactly once
+    lines = _sold(OrderItem, completed_on, "product__name").union(
+        _sold(ArchivedOrderItem, completed_on, "product_name"), all=True
+    )
+
+    sellers, products, categories = defaultdict(Totals), defaultdict(Totals), defaultdict(Totals)
+    product_details = {}
+    for line in lines:
+        product_details[line["product_id"]] = {"product_name": line["name"], "seller_id": line["seller_id"]}
+        day = completed_on[line["order_id"]]
+        revenue = Decimal(line["revenue"]).quantize(Decimal("0.01"))
+        for totals, key in (
+            (sellers, line["seller_id"]),
+            (products, line["product_id"]),
+            (categories, line["category"] or ""),
+        ):
+            if key is not None:
+                totals[key, day].add(line["order_id"], revenue, line["units"])
+
+    _apply(SellerDailySales, "seller_id", sellers)
+    _apply(ProductDailySales, "product_id", products, product_details)
+    _apply(CategoryDailySales, "category", categories)
+
+
+def refresh_rollups(batch_size=BATCH_SIZE):
+    """
+    Add the orders completed since the last run to the daily sales rollups.
+
+    Completions are read from the order event log in (created_at, id) order after the stored
+    high-water mark, in batches that each move the mark in the same transaction as the totals,
+    so an interrupted run resumes where it stopped without counting anything twice. Events
+    younger than SALES_ROLLUP_LAG are left for the next run, so that an event committed late
+    does not end up behind the mark.
+
+    Returns the number of completed orders taken in.
+    """
+    upto = timezone.now() - timedelta(seconds=settings.SALES_ROLLUP_LAG)
+    RollupMark.objects.get_or_create(name=MARK)
+    count = 0
+
+    while True:
+        with transaction.atomic():
+            # the lock keeps concurrent runs from taking in the same batch
+            mark = RollupMark.objects.select_for_update().get(name=MARK)
+            events = OrderEvent.objects.filter(
+                kind=OrderEventKind.STATUS, to_status=OrderStatus.COMPLETED.value, created_at__lte=upto
+            )
+            if mark.event_at is not None:
+                events = events.filter(
+                    Q(created_at__gt=mark.event_at) | Q(created_at=mark.event_at, id__gt=mark.event_id)
+                )
+            events = list(events.order_by("created_at", "id").only("id", "order_id", "created_at")[:batch_size])
+            if not events:
+                return count
+
+            _roll_up(events)
+            mark.event_at, mark.event_id = events[-1].created_at, events[-1].id
+            mark.save()
+            count += len(events)
+
+
+def rebuild_rollups():
+    """
+    Drop the rollups and take every completed order in again, archived ones included.
+    """
+    with transaction.atomic():
+        SellerDailySales.objects.all().delete()
+        ProductDailySales.objects.all().delete()
+        CategoryDailySales.objects.all().delete()
+        RollupMark.objects.filter(name=MARK).delete()
+    return refresh_rollups()
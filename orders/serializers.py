@@ -4,8 +4,15 @@ from django.db import transaction
 from rest_framework import serializers
 
 from core.serializers import EnumField
+from products.models import Product
 
-from .models import Order, OrderItem, OrderStatus, PaymentStatus
+from .events import record_status_changes
+from .inventory import reserve_stock
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, Order, OrderEvent, OrderEventKind, OrderIntake, OrderIntakeStatus, OrderItem,
+    OrderStatus, PaymentStatus,
+)
+from .transitions import MAX_ORDERS, TRANSITIONS
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -19,6 +26,9 @@ class OrderItemSerializer(serializers.ModelSerializer):
 
 
 class OrderItemCreateSerializer(serializers.ModelSerializer):
+    # products are looked up for the whole basket at once in OrderCreateSerializer.validate_items
+    product = serializers.UUIDField(source="product_id")
+
     class Meta:
         model = OrderItem
         fields = ["product", "unit_price", "quantity"]
@@ -34,43 +44,114 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = [
             "id", "buyer", "status", "payment_status",
-            "items", "total", "created_at", "updated_at"
+            "items", "total", "amount_paid", "created_at", "updated_at"
+        ]
+
+
+class ArchivedOrderItemSerializer(serializers.ModelSerializer):
+    product = serializers.ReadOnlyField(source="product_name")
+
+    class Meta:
+        model = ArchivedOrderItem
+        fields = [
+            "product", "unit_price", "quantity", "item_total"
         ]
 
+
+class ArchivedOrderSerializer(OrderSerializer):
+    items = ArchivedOrderItemSerializer(many=True)
+
+    class Meta(OrderSerializer.Meta):
+        model = ArchivedOrder
+
+
 class OrderCreateSerializer(serializers.ModelSerializer):
     items = OrderItemCreateSerializer(many=True)
 
     class Meta:
         model = Order
-        fields = ["items"]
+        fields = ["id", "items"]
 
     def validate_items(self, items):
         if len(items) == 0:
             raise serializers.ValidationError("Order must contain at least 1 item.")
+
+        products = Product.objects.only("id", "seller_id").in_bulk({item["product_id"] for item in items})
+        missing = sorted({str(item["product_id"]) for item in items if item["product_id"] not in products})
+        if missing:
+            raise serializers.ValidationError(f"Products not found: {', '.join(missing)}")
+
+        for item in items:
+            item["product"] = products[item.pop("product_id")]
         return items
 
     @transaction.atomic
     def create(self, validated_data):
         items_data = validated_data.pop("items")
-        order = Order.objects.create(buyer=self.context["request"].user, **validated_data)
-
-        total = Decimal("0.00")
+        reserve_stock(items_data)
 
-        for item in items_data:
-            product = item["product"]
+        total = sum((item["unit_price"] * item["quantity"] for item in items_data), Decimal("0.00"))
+        order = Order.objects.create(total=total, **validated_data)
 
-            item_total = item["unit_price"] * Decimal(item["quantity"])
-            total += item_total
-
-            OrderItem.objects.create(
+        OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
-                product=product,
-                seller=product.seller,
+                product=item["product"],
+                seller_id=item["product"].seller_id,
                 unit_price=item["unit_price"],
                 quantity=item["quantity"],
             )
-
-        order.total = total
-        order.save()
+            for item in items_data
+        ])
+        record_status_changes([(order.pk, None, order.status)], at=order.created_at)
 
         return order
+
+
+class OrderTransitionSerializer(serializers.Serializer):
+    orders = serializers.ListField(child=serializers.UUIDField(), min_length=1, max_length=MAX_ORDERS)
+    status = EnumField(enum_class=OrderStatus)
+
+    def validate_status(self, value):
+        if value not in TRANSITIONS:
+            options = ", ".join(target.value for target in TRANSITIONS)
+            raise serializers.ValidationError(f"Orders can only be moved to: {options}")
+        return value
+
+
+class OrderEventSerializer(serializers.ModelSerializer):
+    kind = EnumField(enum_class=OrderEventKind)
+
+    class Meta:
+        model = OrderEvent
+        fields = ["kind", "from_status", "to_status", "created_at"]
+
+
+class SalesSerializer(serializers.Serializer):
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2, source="total_revenue")
+    units = serializers.DecimalField(max_digits=14, decimal_places=3, source="total_units")
+    orders = serializers.IntegerField(source="total_orders")
+
+
+class DailySalesSerializer(serializers.Serializer):
+    day = serializers.DateField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    units = serializers.DecimalField(max_digits=14, decimal_places=3)
+    orders = serializers.IntegerField()
+
+
+class ProductSalesSerializer(SalesSerializer):
+    product = serializers.UUIDField(source="product_id")
+    name = serializers.CharField(source="product_name")
+
+
+class CategorySalesSerializer(SalesSerializer):
+    category = serializers.CharField()
+
+
+class OrderIntakeSerializer(serializers.ModelSerializer):
+    status = EnumField(enum_class=OrderIntakeStatus)
+
+    class Meta:
+        model = OrderIntake
+        fields = ["id", "status", "order", "errors", "created_at", "updated_at"]
@@ -1,3 +1,657 @@
-from django.test import TestCase
+import random
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
+from uuid import uuid4
 
-# Create your tests here.
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import UserRole
+from core.testing import create_product, create_staff, create_user
+from products.facets import get_facet_counts
+from products.models import Product
+
+from .archive import archive_orders
+from .intake import drain_batch, enqueue
+from .inventory import release_stock
+from .models import (
+    ArchivedOrder, CategoryDailySales, Order, OrderEvent, OrderEventKind, OrderIntake, OrderIntakeStatus, OrderItem,
+    OrderStatus, ProductDailySales, SellerDailySales,
+)
+from .rollups import rebuild_rollups, refresh_rollups
+from .transitions import bulk_transition
+
+
+def place_order(buyer, *lines, key=None):
+    client = APIClient()
+    client.force_authenticate(buyer)
+    items = [
+        {"product": str(product.pk), "unit_price": "100.00", "quantity": str(quantity)} for product, quantity in lines
+    ]
+    headers = {"Idempotency-Key": key} if key else {}
+    return client.post("/api/orders/", {"items": items}, format="json", headers=headers)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.farmer = create_user("farmer@example.com", UserRole.FARMER)
+        self.buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        self.maize = create_product(self.farmer, "Maize", "10")
+        self.beans = create_product(self.farmer, "Beans", "5")
+
+    def test_order_takes_items_out_of_stock(self):
+        response = place_order(self.buyer, (self.maize, 4), (self.beans, 1), (self.maize, 2))
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.maize.refresh_from_db()
+        self.beans.refresh_from_db()
+        self.assertEqual(self.maize.stock, Decimal("4"))
+        self.assertEqual(self.beans.stock, Decimal("4"))
+
+    def test_order_is_rejected_when_any_item_is_short(self):
+        response = place_order(self.buyer, (self.maize, 4), (self.beans, 6))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"items": ["Not enough stock for: Beans"]})
+        self.assertFalse(Order.objects.exists())
+        self.maize.refresh_from_db()
+        self.assertEqual(self.maize.stock, Decimal("10"))
+
+    def test_cancelling_releases_stock_once(self):
+        place_order(self.buyer, (self.maize, 10))
+        order_id = Order.objects.get().pk
+        staff = create_staff("staff@example.com")
+        client = APIClient()
+        client.force_authenticate(staff)
+
+        first = client.patch(f"/api/orders/{order_id}/", {"status": "cancelled"}, format="json")
+        second = client.patch(f"/api/orders/{order_id}/", {"status": "cancelled"}, format="json")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 400)
+        self.assertEqual(Order.objects.get(pk=order_id).status, OrderStatus.CANCELLED)
+        self.maize.refresh_from_db()
+        self.assertEqual(self.maize.stock, Decimal("10"))
+
+    def test_in_stock_facet_follows_sell_outs_and_releases(self):
+        place_order(self.buyer, (self.maize, 10), (self.beans, 1))
+        self.assertEqual(get_facet_counts()["in_stock"], {"true": 1, "false": 1})
+
+        release_stock([Order.objects.get().pk])
+        self.assertEqual(get_facet_counts()["in_stock"], {"true": 2})
+
+    def test_checkout_queries_do_not_grow_with_the_basket(self):
+        products = [create_product(self.farmer, f"Product {index}", "100") for index in range(50)]
+        for size in (1, 10, 50):
+            with self.subTest(size=size), self.assertNumQueries(9):
+                response = place_order(self.buyer, *[(product, 1) for product in products[:size]])
+            self.assertEqual(response.status_code, 201, response.content)
+
+
+class OrderPlacementTests(TestCase):
+    def setUp(self):
+        self.buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        self.farmers = [create_user(f"farmer{index}@example.com", UserRole.FARMER) for index in range(2)]
+        self.products = [create_product(self.farmers[index % 2], f"Product {index}", "100") for index in range(60)]
+
+    def test_order_is_written_once_with_its_total(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = place_order(self.buyer, *[(product, 2) for product in self.products])
+
+        self.assertEqual(response.status_code, 201, response.content)
+        order = Order.objects.get()
+        self.assertEqual(order.total, Decimal("12000.00"))
+        self.assertEqual(
+            sorted(order.items.values_list("product__name", "seller_id")),
+            sorted((product.name, product.seller_id) for product in self.products),
+        )
+        writes = [
+            query["sql"].split()[0] for query in queries
+            if query["sql"].startswith(('INSERT INTO "orders_order" ', 'UPDATE "orders_order" '))
+        ]
+        self.assertEqual(writes, ["INSERT"])
+
+    def test_unknown_products_are_reported_together(self):
+        missing = sorted([uuid4(), uuid4()], key=str)
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+        items = [{"product": str(product_id), "unit_price": "100.00", "quantity": "1"} for product_id in missing]
+
+        with self.assertNumQueries(1):
+            response = client.post("/api/orders/", {"items": items}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"items": [f"Products not found: {missing[0]}, {missing[1]}"]})
+
+
+class OrderListTests(TestCase):
+    def setUp(self):
+        self.farmer = create_user("farmer@example.com", UserRole.FARMER)
+        self.buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        self.maize = create_product(self.farmer, "Maize", "1000")
+        self.beans = create_product(self.farmer, "Beans", "1000")
+        self.rice = create_product(create_user("other@example.com", UserRole.FARMER), "Rice", "1000")
+
+    def list(self, user, query=""):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(f"/api/orders/{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def ids(self, user, query=""):
+        return [order["id"] for order in self.list(user, query)["results"]]
+
+    def test_farmers_see_each_order_with_their_products_once(self):
+        place_order(self.buyer, (self.maize, 1), (self.beans, 1))
+        place_order(self.buyer, (self.rice, 1))
+        both, rice = Order.objects.order_by("created_at")
+
+        self.assertEqual(self.ids(self.farmer), [str(both.pk)])
+        self.assertEqual(self.ids(self.buyer), [str(rice.pk), str(both.pk)])
+        self.assertEqual(self.ids(create_user("stranger@example.com", UserRole.CONSUMER)), [])
+
+    def test_status_and_date_filters(self):
+        for _ in range(3):
+            place_order(self.buyer, (self.maize, 1))
+        old, cancelled, new = Order.objects.order_by("created_at")
+        Order.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=10))
+        Order.objects.filter(pk=cancelled.pk).update(status=OrderStatus.CANCELLED)
+        week_ago = (timezone.now() - timedelta(days=7)).date().isoformat()
+
+        self.assertEqual(self.ids(self.buyer, "?status=cancelled"), [str(cancelled.pk)])
+        self.assertEqual(self.ids(self.buyer, f"?status=pending&created_after={week_ago}"), [str(new.pk)])
+        self.assertEqual(self.ids(self.buyer, f"?created_before={week_ago}"), [str(old.pk)])
+        self.assertEqual(len(self.ids(self.buyer, "?status=unknown&created_after=yesterday")), 3)
+
+    def test_pages_cover_every_order_once(self):
+        for _ in range(5):
+            place_order(self.buyer, (self.maize, 1))
+
+        ids, query = [], "?page_size=2"
+        while query is not None:
+            page = self.list(self.buyer, query)
+            ids += [order["id"] for order in page["results"]]
+            query = page["next"] and page["next"][page["next"].index("?"):]
+
+        newest_first = Order.objects.order_by("-created_at", "-id").values_list("pk", flat=True)
+        self.assertEqual(ids, [str(pk) for pk in newest_first])
+
+    def test_queries_do_not_grow_with_the_page(self):
+        client = APIClient()
+        client.force_authenticate(self.farmer)
+        place_order(self.buyer, (self.maize, 1), (self.beans, 1))
+        with self.assertNumQueries(2):
+            client.get("/api/orders/")
+
+        for index in range(10):
+            buyer = create_user(f"buyer{index}@example.com", UserRole.CONSUMER)
+            place_order(buyer, (self.maize, 1), (self.beans, 1), (self.rice, 1))
+        with self.assertNumQueries(2):
+            response = client.get("/api/orders/")
+        self.assertEqual(len(response.json()["results"]), 11)
+
+
+class OrderDetailValidatorTests(TestCase):
+    def setUp(self):
+        self.buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        self.maize = create_product(create_user("farmer@example.com", UserRole.FARMER), "Maize", "10")
+        place_order(self.buyer, (self.maize, 1))
+        self.url = f"/api/orders/{Order.objects.get().pk}/"
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def revalidate(self, response):
+        return self.client.get(
+            self.url,
+            HTTP_IF_NONE_MATCH=response.headers["ETag"], HTTP_IF_MODIFIED_SINCE=response.headers["Last-Modified"],
+        )
+
+    def test_unchanged_order_is_not_modified(self):
+        self.assertEqual(self.revalidate(self.client.get(self.url)).status_code, 304)
+
+    def test_product_change_invalidates_the_order(self):
+        response = self.client.get(self.url)
+        self.maize.name = "White maize"
+        self.maize.save()
+
+        response = self.revalidate(response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["items"][0]["product"], "White maize")
+
+
+@skipIf(connection.vendor == "sqlite", "SQLite serializes all writers, concurrency needs a real database")
+class ConcurrentCheckoutTests(TransactionTestCase):
+    BUYERS = 40
+
+    def setUp(self):
+        farmer = create_user("farmer@example.com", UserRole.FARMER)
+        self.buyers = [create_user(f"buyer{index}@example.com", UserRole.CONSUMER) for index in range(self.BUYERS)]
+        self.hot = create_product(farmer, "Flash sale maize", "50")
+        self.others = [create_product(farmer, f"Side product {index}", "1000") for index in range(3)]
+
+    def test_hot_product_is_never_oversold(self):
+        barrier = threading.Barrier(self.BUYERS)
+        statuses = []
+        errors = []
+
+        def checkout(buyer, seed):
+            try:
+                # every basket lists its products in a different order to provoke lock-order deadlocks
+                lines = [(self.hot, 2)] + [(product, 1) for product in self.others]
+                random.Random(seed).shuffle(lines)
+                barrier.wait()
+                statuses.append(place_order(buyer, *lines).status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout, args=(buyer, seed)) for seed, buyer in enumerate(self.buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(statuses.count(201), 25)
+        self.assertEqual(statuses.count(400), self.BUYERS - 25)
+        self.hot.refresh_from_db()
+        self.assertEqual(self.hot.stock, Decimal("0"))
+        self.assertEqual(Order.objects.count(), 25)
+        for product in self.others:
+            product.refresh_from_db()
+            self.assertEqual(product.stock, Decimal("975"))
+
+
+class IdempotentCheckoutTests(TestCase):
+    def setUp(self):
+        self.buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        self.maize = create_product(create_user("farmer@example.com", UserRole.FARMER), "Maize", "10")
+
+    def test_retry_replays_the_order(self):
+        first = place_order(self.buyer, (self.maize, 4), key="checkout-1")
+        second = place_order(self.buyer, (self.maize, 4), key="checkout-1")
+
+        self.assertEqual(first.status_code, 201, first.content)
+        self.assertEqual((second.status_code, second.json()), (201, first.json()))
+        self.assertEqual(second.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.count(), 1)
+        self.maize.refresh_from_db()
+        self.assertEqual(self.maize.stock, Decimal("6"))
+
+    def test_key_reused_for_another_request_is_refused(self):
+        place_order(self.buyer, (self.maize, 4), key="checkout-1")
+
+        self.assertEqual(place_order(self.buyer, (self.maize, 5), key="checkout-1").status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_stock_shortage_is_not_replayed(self):
+        self.assertEqual(place_order(self.buyer, (self.maize, 12), key="checkout-1").status_code, 400)
+        Product.objects.filter(pk=self.maize.pk).update(stock=Decimal("20"))
+
+        retry = place_order(self.buyer, (self.maize, 12), key="checkout-1")
+
+        self.assertEqual(retry.status_code, 201, retry.content)
+        self.assertNotIn("Idempotent-Replayed", retry.headers)
+
+    def test_missing_product_is_not_replayed(self):
+        # the product is listed while the first attempt is on its way
+        beans = Product(
+            name="Beans", category="legumes", price=Decimal("100.00"), stock=Decimal("5"),
+            description="Beans", image="products/test.png", seller=self.maize.seller,
+        )
+        self.assertEqual(place_order(self.buyer, (beans, 1), key="checkout-1").status_code, 400)
+        beans.save()
+
+        retry = place_order(self.buyer, (beans, 1), key="checkout-1")
+
+        self.assertEqual(retry.status_code, 201, retry.content)
+        self.assertEqual(Order.objects.get().items.get().product, beans)
+
+
+@skipIf(connection.vendor == "sqlite", "SQLite serializes all writers, concurrency needs a real database")
+class ConcurrentIdempotentCheckoutTests(TransactionTestCase):
+    RETRIES = 8
+
+    def test_concurrent_retries_create_one_order(self):
+        buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        maize = create_product(create_user("farmer@example.com", UserRole.FARMER), "Maize", "10")
+        barrier = threading.Barrier(self.RETRIES)
+        responses = []
+        errors = []
+
+        def retry():
+            try:
+                barrier.wait()
+                responses.append(place_order(buyer, (maize, 4), key="checkout-1"))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=retry) for _ in range(self.RETRIES)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual([response.status_code for response in responses], [201] * self.RETRIES)
+        self.assertEqual(len({response.json()["id"] for response in responses}), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        maize.refresh_from_db()
+        self.assertEqual(maize.stock, Decimal("6"))
+
+
+class BulkTransitionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(create_staff("staff@example.com"))
+        self.buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        self.maize = create_product(create_user("farmer@example.com", UserRole.FARMER), "Maize", "10")
+
+    def order(self, order_status):
+        place_order(self.buyer, (self.maize, 1))
+        order = Order.objects.latest("created_at")
+        Order.objects.filter(pk=order.pk).update(status=order_status)
+        return order.pk
+
+    def transition(self, order_ids, target):
+        return self.client.post(
+            "/api/orders/transitions/", {"orders": [str(order_id) for order_id in order_ids], "status": target},
+            format="json",
+        )
+
+    def test_conflicting_orders_are_reported_and_the_rest_updated(self):
+        confirmed, pending, missing = self.order(OrderStatus.CONFIRMED), self.order(OrderStatus.PENDING), uuid4()
+
+        response = self.transition([confirmed, pending, missing, confirmed], "packed")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"updated": [str(confirmed)], "conflicts": [
+            {"id": str(pending), "detail": "Order cannot be packed once pending."},
+            {"id": str(missing), "detail": "Order not found."},
+        ]})
+        self.assertEqual(Order.objects.get(pk=pending).status, OrderStatus.PENDING)
+        self.assertEqual(OrderEvent.objects.filter(order_id=confirmed, to_status=OrderStatus.PACKED.value).count(), 1)
+
+    def test_cancelling_twice_releases_stock_once(self):
+        packed, shipped = self.order(OrderStatus.PACKED), self.order(OrderStatus.SHIPPED)
+
+        first = self.transition([packed, shipped], "cancelled").json()
+        second = self.transition([packed], "cancelled").json()
+
+        self.assertEqual(first["updated"], [str(packed)])
+        self.assertEqual(first["conflicts"], [
+            {"id": str(shipped), "detail": "Order cannot be cancelled once shipped."}
+        ])
+        self.assertEqual(second["conflicts"], [
+            {"id": str(packed), "detail": "Order cannot be cancelled once cancelled."}
+        ])
+        self.maize.refresh_from_db()
+        self.assertEqual(self.maize.stock, Decimal("9"))
+
+    def test_status_that_staff_cannot_set_is_refused(self):
+        response = self.transition([self.order(OrderStatus.PENDING)], "confirmed")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("status", response.json())
+
+
+@skipIf(connection.vendor == "sqlite", "SQLite serializes all writers, concurrency needs a real database")
+class ConcurrentBulkTransitionTests(TransactionTestCase):
+    ORDERS = 20
+    BATCHES = 6
+
+    def test_overlapping_cancellations_release_stock_once(self):
+        buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        maize = create_product(create_user("farmer@example.com", UserRole.FARMER), "Maize", str(self.ORDERS))
+        for _ in range(self.ORDERS):
+            place_order(buyer, (maize, 1))
+        order_ids = list(Order.objects.values_list("pk", flat=True))
+        barrier = threading.Barrier(self.BATCHES)
+        updated = []
+        errors = []
+
+        def cancel(seed):
+            try:
+                # overlapping batches, each listing the orders in a different order
+                batch = random.Random(seed).sample(order_ids, self.ORDERS // 2 + seed)
+                barrier.wait()
+                updated.extend(bulk_transition(batch, OrderStatus.CANCELLED)[0])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=cancel, args=(seed,)) for seed in range(self.BATCHES)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(updated), len(set(updated)))
+        cancelled = Order.objects.filter(status=OrderStatus.CANCELLED).count()
+        self.assertEqual(cancelled, len(updated))
+        maize.refresh_from_db()
+        self.assertEqual(maize.stock, Decimal(cancelled))
+
+
+class OrderTimelineTests(TestCase):
+    def setUp(self):
+        self.farmer = create_user("farmer@example.com", UserRole.FARMER)
+        self.buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        place_order(self.buyer, (create_product(self.farmer, "Maize", "10"), 1))
+        self.order = Order.objects.get()
+
+    def get_timeline(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(f"/api/orders/{self.order.pk}/events/")
+
+    def test_parties_to_the_order_see_its_timeline(self):
+        for user in (self.buyer, self.farmer, create_staff("staff@example.com")):
+            response = self.get_timeline(user)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([event["to_status"] for event in response.json()], ["pending"])
+
+    def test_other_users_do_not(self):
+        self.assertEqual(self.get_timeline(create_user("other@example.com", UserRole.CONSUMER)).status_code, 403)
+        self.assertEqual(self.get_timeline(create_user("rival@example.com", UserRole.FARMER)).status_code, 403)
+
+
+@skipIf(connection.vendor == "sqlite", "SQLite serializes all writers, concurrency needs a real database")
+class ConcurrentStatusUpdateTests(TransactionTestCase):
+    REQUESTS = 8
+
+    def setUp(self):
+        farmer = create_user("farmer@example.com", UserRole.FARMER)
+        buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        place_order(buyer, (create_product(farmer, "Maize", "10"), 1))
+        self.order = Order.objects.get()
+        Order.objects.filter(pk=self.order.pk).update(status=OrderStatus.SHIPPED)
+        self.staff = create_staff("staff@example.com")
+
+    def test_order_is_completed_once(self):
+        barrier = threading.Barrier(self.REQUESTS)
+        statuses = []
+        errors = []
+
+        def complete():
+            try:
+                client = APIClient()
+                client.force_authenticate(self.staff)
+                barrier.wait()
+                statuses.append(client.patch(f"/api/orders/{self.order.pk}/", {}, format="json").status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=complete) for _ in range(self.REQUESTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(statuses, [200] * self.REQUESTS)
+        self.assertEqual(Order.objects.get().status, OrderStatus.COMPLETED)
+        completed = OrderEvent.objects.filter(kind=OrderEventKind.STATUS, to_status=OrderStatus.COMPLETED.value)
+        self.assertEqual(completed.count(), 1)
+
+
+@override_settings(ORDER_INTAKE_MAX_ATTEMPTS=2, ORDER_INTAKE_CLAIM_TIMEOUT=60)
+class OrderIntakeRetryTests(TestCase):
+    def setUp(self):
+        farmer = create_user("farmer@example.com", UserRole.FARMER)
+        self.maize = create_product(farmer, "Maize", "10")
+        payload = {"items": [{"product": str(self.maize.pk), "unit_price": "100.00", "quantity": "2"}]}
+        self.intake = enqueue(create_user("buyer@example.com", UserRole.CONSUMER), payload)
+
+    def expire_claim(self):
+        OrderIntake.objects.update(claimed_at=timezone.now() - timedelta(minutes=5))
+
+    def test_intake_that_keeps_raising_fails_after_the_last_attempt(self):
+        failing = mock.patch("orders.intake.process", side_effect=RuntimeError("database went away"))
+        with failing, self.assertLogs("orders.intake", "ERROR"):
+            drain_batch(uuid4())
+            self.intake.refresh_from_db()
+            self.assertEqual(self.intake.status, OrderIntakeStatus.PROCESSING)
+
+            self.expire_claim()
+            drain_batch(uuid4())
+
+        self.intake.refresh_from_db()
+        self.assertEqual(self.intake.status, OrderIntakeStatus.FAILED)
+        self.assertEqual(self.intake.attempts, 2)
+        self.assertEqual(self.intake.errors, {"detail": "Order could not be processed: database went away"})
+        self.assertEqual(drain_batch(uuid4()), 0)
+
+    def test_intake_whose_workers_died_fails_after_the_last_attempt(self):
+        OrderIntake.objects.update(status=OrderIntakeStatus.PROCESSING, attempts=2)
+        self.expire_claim()
+
+        self.assertEqual(drain_batch(uuid4()), 0)
+
+        self.intake.refresh_from_db()
+        self.assertEqual(self.intake.status, OrderIntakeStatus.FAILED)
+        self.assertIn("2 attempts", self.intake.errors["detail"])
+        self.assertFalse(Order.objects.exists())
+
+    def test_retry_that_succeeds_clears_the_error(self):
+        failing = mock.patch("orders.intake.process", side_effect=RuntimeError("database went away"))
+        with failing, self.assertLogs("orders.intake", "ERROR"):
+            drain_batch(uuid4())
+        self.expire_claim()
+        drain_batch(uuid4())
+
+        self.intake.refresh_from_db()
+        self.assertEqual(self.intake.status, OrderIntakeStatus.DONE)
+        self.assertIsNone(self.intake.errors)
+        self.assertEqual(self.intake.order.items.get().quantity, 2)
+
+
+@override_settings(SALES_ROLLUP_LAG=0)
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.farmer = create_user("farmer@example.com", UserRole.FARMER)
+        self.maize = create_product(self.farmer, "Maize", "10")
+        place_order(create_user("buyer@example.com", UserRole.CONSUMER), (self.maize, 3))
+        order = Order.objects.get()
+        Order.objects.update(status=OrderStatus.SHIPPED)
+        bulk_transition([order.pk], OrderStatus.COMPLETED)
+        refresh_rollups()
+
+    def test_sales_of_a_deleted_product_are_kept(self):
+        # once its orders are archived nothing holds on to the product
+        Order.objects.all().delete()
+        product_id = self.maize.pk
+        self.maize.delete()
+
+        client = APIClient()
+        client.force_authenticate(self.farmer)
+        response = client.get("/api/orders/sales/")
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()["products"], [{
+            "revenue": "300.00", "units": "3.000", "orders": 1, "product": str(product_id), "name": "Maize",
+        }])
+        self.assertEqual(ProductDailySales.objects.get().seller, self.farmer)
+
+
+@override_settings(SALES_ROLLUP_LAG=0)
+class OrderArchiveTests(TestCase):
+    def setUp(self):
+        self.farmer = create_user("farmer@example.com", UserRole.FARMER)
+        self.buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        self.maize = create_product(self.farmer, "Maize", "10")
+        self.beans = create_product(self.farmer, "Beans", "10")
+        place_order(self.buyer, (self.maize, 3), (self.beans, 1))
+        self.order = Order.objects.get()
+        Order.objects.update(status=OrderStatus.SHIPPED)
+        bulk_transition([self.order.pk], OrderStatus.COMPLETED)
+        Order.objects.update(updated_at=timezone.now() - timedelta(days=60))
+        # recent and still open orders stay where they are
+        place_order(self.buyer, (self.maize, 1))
+
+    def assertSales(self, revenue, units, orders):
+        self.assertEqual(
+            list(SellerDailySales.objects.values_list("seller_id", "revenue", "units", "orders")),
+            [(self.farmer.pk, Decimal(revenue), Decimal(units), orders)],
+        )
+        self.assertEqual(
+            dict(ProductDailySales.objects.values_list("product_name", "revenue")),
+            {"Maize": Decimal("300.00"), "Beans": Decimal("100.00")},
+        )
+
+    def test_old_orders_are_moved_with_their_items(self):
+        self.assertEqual(archive_orders(30), 1)
+        self.assertEqual(archive_orders(30), 0)
+
+        self.assertEqual(list(Order.objects.values_list("status", flat=True)), [OrderStatus.PENDING])
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual((archived.pk, archived.status, archived.total), (self.order.pk, OrderStatus.COMPLETED, 400))
+        self.assertEqual(
+            sorted(archived.items.values_list("product_name", "product_id", "seller_id", "quantity")),
+            [
+                ("Beans", self.beans.pk, self.farmer.pk, Decimal("1")),
+                ("Maize", self.maize.pk, self.farmer.pk, Decimal("3")),
+            ],
+        )
+        self.assertFalse(OrderItem.objects.filter(order_id=self.order.pk).exists())
+
+    def test_archived_order_details_are_still_served(self):
+        archive_orders(30)
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+
+        response = client.get(f"/api/orders/{self.order.pk}/")
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()["status"], "completed")
+        self.assertEqual(sorted(item["product"] for item in response.json()["items"]), ["Beans", "Maize"])
+
+    def test_rebuild_keeps_archived_sales(self):
+        refresh_rollups()
+        archive_orders(30)
+
+        rebuild_rollups()
+
+        self.assertSales("400.00", "4.000", 1)
+
+    def test_completion_archived_before_it_is_rolled_up_is_counted(self):
+        # the rollup runs behind, the archive job does not wait for it
+        archive_orders(30)
+
+        self.assertEqual(refresh_rollups(), 1)
+
+        self.assertSales("400.00", "4.000", 1)
+        self.assertEqual(CategoryDailySales.objects.get().revenue, Decimal("400.00"))
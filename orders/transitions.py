@@ -0,0 +1,57 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .events import record_status_changes
+from .inventory import release_stock
+from .models import CANCELLABLE_STATUSES, Order, OrderStatus
+
+# the statuses staff can move orders to, each with the statuses it can be reached from
+TRANSITIONS = {
+    OrderStatus.PACKED: (OrderStatus.CONFIRMED,),
+    OrderStatus.SHIPPED: (OrderStatus.PACKED,),
+    OrderStatus.COMPLETED: (OrderStatus.SHIPPED,),
+    OrderStatus.CANCELLED: CANCELLABLE_STATUSES,
+}
+
+MAX_ORDERS = 1000
+
+
+def bulk_transition(order_ids, target):
+    """
+    Move many orders to `target` with one UPDATE per source status instead of a fetch and save
+    per order. Orders that do not exist or cannot reach `target` from their current status are
+    reported back instead of failing the batch.
+
+    Returns the ids of the updated orders and a list of conflicts.
+    """
+    allowed = TRANSITIONS[target]
+    order_ids = list(dict.fromkeys(order_ids))
+    conflicts = []
+    groups = defaultdict(list)
+
+    with transaction.atomic():
+        # lock in id order so that overlapping batches cannot deadlock, the updates below then
+        # apply to exactly the statuses read here
+        current = dict(
+            Order.objects.select_for_update().filter(pk__in=order_ids).order_by("pk").values_list("id", "status")
+        )
+        for order_id in order_ids:
+            source = current.get(order_id)
+            if source is None:
+                conflicts.append({"id": order_id, "detail": "Order not found."})
+            elif source not in allowed:
+                conflicts.append({"id": order_id, "detail": f"Order cannot be {target.value} once {source.value}."})
+            else:
+                groups[source].append(order_id)
+
+        now = timezone.now()
+        for source, ids in groups.items():
+            Order.objects.filter(pk__in=ids, status=source).update(status=target, updated_at=now)
+            record_status_changes([(order_id, source, target) for order_id in ids], at=now)
+        if target == OrderStatus.CANCELLED and groups:
+            release_stock([order_id for ids in groups.values() for order_id in ids])
+
+    updated = set(order_id for ids in groups.values() for order_id in ids)
+    return [order_id for order_id in order_ids if order_id in updated], conflicts
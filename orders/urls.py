@@ -5,5 +5,11 @@ from . import views
 urlpatterns = [
     # common
     path('', views.OrderList.as_view()),
+    path('intake/<uuid:pk>/', views.OrderIntakeDetail.as_view()),
+    path('latency/', views.OrderLatency.as_view()),
+    path('sales/', views.SellerSales.as_view()),
+    path('sales/categories/', views.CategorySales.as_view()),
+    path('transitions/', views.OrderTransition.as_view()),
     path('<uuid:pk>/', views.OrderDetail.as_view()),
+    path('<uuid:pk>/events/', views.OrderTimeline.as_view()),
 ]
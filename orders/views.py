@@ -1,14 +1,81 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Sum
+from django.db.models.functions import Coalesce
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_date, parse_datetime
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from accounts.models import UserRole
-from authentication.permissions import IsStaff
+from authentication.permissions import IsFarmer, IsOrderParty, IsStaff
+from core.conditional import conditional_response, make_etag, set_validators
+from core.pagination import KeysetPagination
+
+from .events import record_status_changes, status_latency, timeline
+from .idempotency import HEADER as IDEMPOTENCY_HEADER, idempotent
+from .intake import enqueue
+from .inventory import release_stock
+from .models import (
+    ArchivedOrder, CANCELLABLE_STATUSES, CategoryDailySales, Order, OrderIntake, OrderItem, OrderStatus,
+    ProductDailySales, SellerDailySales,
+)
+from .serializers import (
+    ArchivedOrderSerializer, CategorySalesSerializer, DailySalesSerializer, OrderEventSerializer, OrderSerializer,
+    OrderCreateSerializer, OrderIntakeSerializer, OrderTransitionSerializer, ProductSalesSerializer, SalesSerializer,
+)
+from .transitions import bulk_transition
+
+# window of the latency report when no start is given
+DEFAULT_LATENCY_DAYS = 30
+
+# window of the sales dashboards when no start is given, and the longest one allowed
+DEFAULT_SALES_DAYS = 30
 
-from .models import Order, OrderStatus
-from .serializers import OrderSerializer, OrderCreateSerializer
+MAX_SALES_DAYS = 366
+
+TOP_PRODUCTS = 10
+
+
+def with_details(orders):
+    """
+    Load everything OrderSerializer reads in a fixed number of queries, whatever the page size.
+    """
+    items = OrderItem.objects.select_related("product").only(
+        "order_id", "unit_price", "quantity", "product__name", "product__updated_at"
+    )
+    return orders.select_related("buyer").prefetch_related(Prefetch("items", queryset=items))
+
+
+def with_archived_details(orders):
+    return orders.select_related("buyer").prefetch_related("items")
+
+
+def parse_moment(value):
+    """
+    Parse an ISO 8601 date or datetime query parameter, dates standing for midnight.
+    """
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = datetime.combine(day, time.min) if day is not None else None
+    except ValueError:
+        return None
+    if moment is not None and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
 
 
 class OrderList(APIView):
@@ -18,35 +85,174 @@ class OrderList(APIView):
 
     allowed_methods = ['GET', 'POST']
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return OrderCreateSerializer
         return OrderSerializer
 
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="status",
+                type=OpenApiTypes.STR,
+                required=False,
+                description=f"Filter orders by status. Options: {', '.join([choice.value for choice in OrderStatus])}"
+            ),
+            OpenApiParameter(
+                name="created_after",
+                type=OpenApiTypes.DATETIME,
+                required=False,
+                description="Only include orders placed at or after this date or datetime"
+            ),
+            OpenApiParameter(
+                name="created_before",
+                type=OpenApiTypes.DATETIME,
+                required=False,
+                description="Only include orders placed before this date or datetime"
+            ),
+            OpenApiParameter(
+                name="cursor",
+                type=OpenApiTypes.STR,
+                required=False,
+                description="Opaque cursor taken from the `next` link of the previous page"
+            ),
+            OpenApiParameter(
+                name="page_size",
+                type=OpenApiTypes.INT,
+                required=False,
+                description=f"Number of orders per page (max {KeysetPagination.max_page_size})"
+            ),
+        ]
+    )
     def get(self, request):
         """
-        Get the Order list
+        Get a page of the Order list, newest first
         """
-        orders = []
         if request.user.role == UserRole.FARMER:
-            orders = Order.objects.filter(items__seller=request.user).distinct()
+            # EXISTS keeps one row per order without the DISTINCT over the items join
+            sold = OrderItem.objects.filter(order=OuterRef("pk"), seller=request.user)
+            orders = Order.objects.filter(Exists(sold))
         else:
-            orders = request.user.orders.all()
-        serializer = self.get_serializer_class()(orders, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+            orders = Order.objects.filter(buyer=request.user)
+        orders = self.filter_queryset(orders)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(with_details(orders), request, view=self)
+
+        # the version of exactly what is returned: the page rows, their buyers and products
+        etag = make_etag("orders", request.user.pk, request.get_full_path(), *[
+            (order.pk, order.updated_at, order.buyer.updated_at, *[
+                item.product.updated_at for item in order.items.all() if item.product is not None
+            ])
+            for order in page
+        ])
+        not_modified = conditional_response(request, etag)
+        if not_modified is not None:
+            patch_vary_headers(not_modified, ["Authorization"])
+            return not_modified
+
+        serializer = self.get_serializer_class()(page, many=True)
+        response = paginator.get_paginated_response(serializer.data)
+        patch_vary_headers(response, ["Authorization"])
+        return set_validators(response, etag)
+
+    def filter_queryset(self, orders):
+        params = self.request.query_params
+
+        order_status = params.get('status', None)
+        if order_status is not None and order_status in [choice.value for choice in OrderStatus]:
+            orders = orders.filter(status=OrderStatus(order_status))
+
+        # Filter by date range if provided, ignoring values that are not dates
+        for param, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+            moment = parse_moment(params.get(param, ''))
+            if moment is not None:
+                orders = orders.filter(**{lookup: moment})
 
+        return orders
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name=IDEMPOTENCY_HEADER,
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.HEADER,
+                required=False,
+                description="Unique value per checkout, retries with the same value replay the first response"
+            ),
+        ]
+    )
+    @idempotent
     def post(self, request):
         """
-        Create a new Order
+        Create a new Order.
+
+        In asynchronous intake mode the order is queued instead and a 202 response carries the
+        id to follow it with at `/api/orders/intake/<id>/`.
         """
         serializer = self.get_serializer_class()(data=request.data, context={"request": request})
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if settings.ORDER_INTAKE_ASYNC:
+            intake = enqueue(request.user, request.data)
+            response = Response(OrderIntakeSerializer(intake).data, status=status.HTTP_202_ACCEPTED)
+            response.headers["Location"] = request.build_absolute_uri(f"intake/{intake.pk}/")
+            return response
+
+        serializer.save(buyer=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
     
 
+class OrderIntakeDetail(APIView):
+    """
+    Endpoint to follow an order placed in asynchronous intake mode.
+    """
+
+    allowed_methods = ['GET']
+    permission_classes = [IsAuthenticated]
+
+    def get_serializer_class(self):
+        return OrderIntakeSerializer
+
+    def get(self, request, pk):
+        """
+        Get the status of a queued order, with the id of the order once it is created or the
+        reasons it could not be
+        """
+        intake = get_object_or_404(OrderIntake, pk=pk, buyer=request.user)
+        serializer = self.get_serializer_class()(intake)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class OrderTransition(APIView):
+    """
+    Endpoint for dispatch staff to move many orders to the same status at once.
+    """
+
+    allowed_methods = ['POST']
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    def get_serializer_class(self):
+        return OrderTransitionSerializer
+
+    def post(self, request):
+        """
+        Move a list of `orders` to `status` (packed, shipped, completed or cancelled).
+
+        Orders that do not exist or cannot be moved from their current status are listed as
+        conflicts while the rest are updated.
+        """
+        serializer = self.get_serializer_class()(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        updated, conflicts = bulk_transition(serializer.validated_data["orders"], serializer.validated_data["status"])
+        return Response({"updated": updated, "conflicts": conflicts}, status=status.HTTP_200_OK)
+
+
 class OrderDetail(APIView):
     """
     Retrieve or update a Order.
@@ -73,34 +279,89 @@ class OrderDetail(APIView):
         """
         Get an Order's details
         """
-        order = self.get_object(pk)
-        serializer = self.get_serializer_class()(order)
-        return Response(serializer.data)
+        model, serializer_class, load = Order, self.get_serializer_class(), with_details
+        versions = Order.objects.filter(pk=pk).values("updated_at", "buyer__updated_at").first()
+        products = []
+        if versions is not None:
+            # the items show their products, so their versions count as they do in the order list
+            products = list(
+                OrderItem.objects.filter(order_id=pk).order_by("pk").values_list("product__updated_at", flat=True)
+            )
+        else:
+            # archived orders keep their id, so their details are still served from here, with
+            # the product names they were archived with
+            model, serializer_class, load = ArchivedOrder, ArchivedOrderSerializer, with_archived_details
+            versions = ArchivedOrder.objects.filter(pk=pk).values("updated_at", "buyer__updated_at").first()
+        if versions is None:
+            raise Http404
+        last_modified = max(*versions.values(), *products)
+        etag = make_etag("order", pk, versions["updated_at"], versions["buyer__updated_at"], *products)
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            patch_vary_headers(not_modified, ["Authorization"])
+            return not_modified
+
+        order = get_object_or_404(load(model.objects.all()), pk=pk)
+        self.check_object_permissions(request, order)
+        serializer = serializer_class(order)
+        response = Response(serializer.data)
+        patch_vary_headers(response, ["Authorization"])
+        return set_validators(response, etag, last_modified)
 
     def patch(self, request, pk):
         """
-        Update an Order
+        Move an Order to its next status, or cancel it with `{"status": "cancelled"}`
         """
         order = self.get_object(pk)
-        error_message = ""
-        match order.status:
-            case OrderStatus.PENDING:
-                error_message = "Order is still pending"
-            case OrderStatus.CONFIRMED:
-                order.status = OrderStatus.PACKED
-            case OrderStatus.PACKED:
-                order.status = OrderStatus.SHIPPED
-            case OrderStatus.SHIPPED:
-                order.status = OrderStatus.COMPLETED
-            case OrderStatus.CANCELLED:
-                error_message = "Order is already cancelled"
-            case _:
-                pass
-        order.save()
+        if request.data.get("status", None) == OrderStatus.CANCELLED.value:
+            return self.cancel(order)
+
+        with transaction.atomic():
+            # the row lock makes sure concurrent updates move the order and record the event once
+            previous = Order.objects.select_for_update().values_list("status", flat=True).get(pk=order.pk)
+            current = previous
+            error_message = ""
+            match previous:
+                case OrderStatus.PENDING:
+                    error_message = "Order is still pending"
+                case OrderStatus.CONFIRMED:
+                    current = OrderStatus.PACKED
+                case OrderStatus.PACKED:
+                    current = OrderStatus.SHIPPED
+                case OrderStatus.SHIPPED:
+                    current = OrderStatus.COMPLETED
+                case OrderStatus.CANCELLED:
+                    error_message = "Order is already cancelled"
+                case _:
+                    pass
+            if current != previous:
+                now = timezone.now()
+                Order.objects.filter(pk=order.pk, status=previous).update(status=current, updated_at=now)
+                record_status_changes([(order.pk, previous, current)], at=now)
 
         if len(error_message) > 0:
             return Response({"detail": error_message}, status.HTTP_400_BAD_REQUEST)
-        return Response({"detail": f"Order status set to {order.status.value}"}, status=status.HTTP_200_OK)
+        return Response({"detail": f"Order status set to {current.value}"}, status=status.HTTP_200_OK)
+
+    def cancel(self, order):
+        """
+        Cancel an Order and put its items back into stock
+        """
+        with transaction.atomic():
+            # the row lock makes sure concurrent cancellations release the stock only once
+            previous = Order.objects.select_for_update().values_list("status", flat=True).get(pk=order.pk)
+            cancelled = previous in CANCELLABLE_STATUSES
+            if cancelled:
+                now = timezone.now()
+                Order.objects.filter(pk=order.pk).update(status=OrderStatus.CANCELLED, updated_at=now)
+                release_stock([order.pk])
+                record_status_changes([(order.pk, previous, OrderStatus.CANCELLED)], at=now)
+
+        if not cancelled:
+            return Response(
+                {"detail": f"Order cannot be cancelled once {previous.value}"}, status.HTTP_400_BAD_REQUEST
+            )
+        return Response({"detail": "Order status set to cancelled"}, status=status.HTTP_200_OK)
 
     def delete(self, request, pk):
         """
@@ -109,3 +370,215 @@ class OrderDetail(APIView):
         order = self.get_object(pk)
         order.delete()
         return Response({"detail": "Order deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
+
+
+class OrderTimeline(APIView):
+    """
+    Endpoint for the history of an Order.
+    """
+
+    allowed_methods = ['GET']
+    permission_classes = [IsAuthenticated, IsOrderParty]
+
+    def get_serializer_class(self):
+        return OrderEventSerializer
+
+    def get(self, request, pk):
+        """
+        Get the status and payment changes of an Order, oldest first
+        """
+        order = Order.objects.only("id", "buyer_id", "created_at").filter(pk=pk).first()
+        if order is None:
+            order = get_object_or_404(ArchivedOrder.objects.only("id", "buyer_id", "created_at"), pk=pk)
+        self.check_object_permissions(request, order)
+        serializer = self.get_serializer_class()(timeline(order), many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class OrderLatency(APIView):
+    """
+    Endpoint for staff to see how long orders stay in a status.
+    """
+
+    allowed_methods = ['GET']
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="status",
+                type=OpenApiTypes.STR,
+                required=True,
+                description=f"The status to measure. Options: {', '.join([choice.value for choice in OrderStatus])}"
+            ),
+            OpenApiParameter(
+                name="since",
+                type=OpenApiTypes.DATETIME,
+                required=False,
+                description=f"Only count orders that entered the status at or after this date or datetime "
+                            f"(default {DEFAULT_LATENCY_DAYS} days before `until`)"
+            ),
+            OpenApiParameter(
+                name="until",
+                type=OpenApiTypes.DATETIME,
+                required=False,
+                description="Only count orders that entered the status before this date or datetime (default now)"
+            ),
+        ]
+    )
+    def get(self, request):
+        """
+        Get the percentiles, in seconds, of the time orders spent in a status before moving on
+        """
+        params = request.query_params
+        if params.get('status', None) not in [choice.value for choice in OrderStatus]:
+            return Response(
+                {"detail": f"Choose a status from: {', '.join([choice.value for choice in OrderStatus])}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        until = parse_moment(params.get('until', '')) or timezone.now()
+        since = parse_moment(params.get('since', '')) or until - timedelta(days=DEFAULT_LATENCY_DAYS)
+        if since >= until:
+            return Response({"detail": "`since` must be before `until`"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(status_latency(OrderStatus(params['status']), since, until), status=status.HTTP_200_OK)
+
+
+SALES_PARAMETERS = [
+    OpenApiParameter(
+        name="since",
+        type=OpenApiTypes.DATE,
+        required=False,
+        description=f"First day to include (default {DEFAULT_SALES_DAYS - 1} days before `until`)"
+    ),
+    OpenApiParameter(
+        name="until",
+        type=OpenApiTypes.DATE,
+        required=False,
+        description="Last day to include (default today)"
+    ),
+]
+
+
+class SalesMixin:
+    """
+    Day range handling of the sales dashboards, which only read the daily rollups kept by
+    orders.rollups so that they cost the same whatever the order history.
+    """
+
+    def get_days(self):
+        """
+        The `(since, until)` days asked for, or None when they are not valid.
+        """
+        params = self.request.query_params
+        try:
+            until = parse_date(params['until']) if 'until' in params else timezone.localdate()
+            since = parse_date(params['since']) if 'since' in params else until - timedelta(days=DEFAULT_SALES_DAYS - 1)
+        except (TypeError, ValueError):
+            return None
+        if since is None or until is None or since > until or (until - since).days >= MAX_SALES_DAYS:
+            return None
+        return since, until
+
+    def invalid_days(self):
+        return Response(
+            {"detail": f"`since` and `until` must be dates at most {MAX_SALES_DAYS} days apart, in order"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @staticmethod
+    def totals(rollups):
+        return rollups.aggregate(
+            total_revenue=Coalesce(Sum("revenue"), Decimal("0.00")),
+            total_units=Coalesce(Sum("units"), Decimal("0.000")),
+            total_orders=Coalesce(Sum("orders"), 0),
+        )
+
+
+class SellerSales(SalesMixin, APIView):
+    """
+    Endpoint for a farmer's sales dashboard.
+    """
+
+    allowed_methods = ['GET']
+    permission_classes = [IsAuthenticated, IsFarmer | IsStaff]
+
+    @extend_schema(
+        parameters=SALES_PARAMETERS + [
+            OpenApiParameter(
+                name="seller",
+                type=OpenApiTypes.UUID,
+                required=False,
+                description="Seller to report on, staff only (defaults to the current user)"
+            ),
+        ]
+    )
+    def get(self, request):
+        """
+        Get the revenue, units and orders completed per day, and the best selling products
+        """
+        days = self.get_days()
+        if days is None:
+            return self.invalid_days()
+
+        seller = request.user.pk
+        if request.user.is_staff and 'seller' in request.query_params:
+            seller = request.query_params['seller']
+        elif request.user.role != UserRole.FARMER:
+            return Response({"detail": "Choose a `seller` to report on"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            daily = SellerDailySales.objects.filter(seller_id=seller, day__range=days)
+            totals = self.totals(daily)
+        except DjangoValidationError:
+            return Response({"detail": "`seller` must be a user id"}, status=status.HTTP_400_BAD_REQUEST)
+        products = (
+            ProductDailySales.objects.filter(seller_id=seller, day__range=days)
+            .values("product_id", "product_name")
+            .annotate(total_revenue=Sum("revenue"), total_units=Sum("units"), total_orders=Sum("orders"))
+            .order_by("-total_revenue", "product_id")[:TOP_PRODUCTS]
+        )
+
+        return Response({
+            "since": days[0],
+            "until": days[1],
+            "totals": SalesSerializer(totals).data,
+            "days": DailySalesSerializer(daily.order_by("day"), many=True).data,
+            "products": ProductSalesSerializer(products, many=True).data,
+        }, status=status.HTTP_200_OK)
+
+
+class CategorySales(SalesMixin, APIView):
+    """
+    Endpoint for the staff sales dashboard.
+    """
+
+    allowed_methods = ['GET']
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    @extend_schema(parameters=SALES_PARAMETERS)
+    def get(self, request):
+        """
+        Get the revenue, units and orders completed per product category, in total and per day
+        """
+        days = self.get_days()
+        if days is None:
+            return self.invalid_days()
+
+        daily = CategoryDailySales.objects.filter(day__range=days)
+        categories = (
+            daily.values("category")
+            .annotate(total_revenue=Sum("revenue"), total_units=Sum("units"), total_orders=Sum("orders"))
+            .order_by("-total_revenue", "category")
+        )
+
+        return Response({
+            "since": days[0],
+            "until": days[1],
+            "categories": CategorySalesSerializer(categories, many=True).data,
+            "days": [
+                {"category": row.category, **DailySalesSerializer(row).data}
+                for row in daily.order_by("day", "category")
+            ],
+        }, status=status.HTTP_200_OK)
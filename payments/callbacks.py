@@ -0,0 +1,196 @@
+import logging
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from core.tasks import run_in_background
+from orders.models import Order
+
+from .models import Payment, PaymentCallback, PaymentCallbackStatus, PaymentMethod
+from .references import normalize_reference
+from .services import overpayments, record_payments
+
+logger = logging.getLogger(__name__)
+
+# callbacks still waiting this long were lost with the process that received them
+SWEEP_AFTER = timedelta(minutes=5)
+
+
+@dataclass
+class Confirmation:
+    reference: str
+    order_id: uuid.UUID | None
+    amount: Decimal | None
+    succeeded: bool
+
+
+def parse_mpesa(payload):
+    """
+    M-Pesa C2B confirmation: the customer pays to the paybill with the order id as account number.
+    """
+    return Confirmation(
+        reference=str(payload.get("TransID", "")),
+        order_id=parse_uuid(payload.get("BillRefNumber")),
+        amount=parse_amount(payload.get("TransAmount")),
+        succeeded=True,
+    )
+
+
+def parse_card(payload):
+    return Confirmation(
+        reference=str(payload.get("reference", "")),
+        order_id=parse_uuid(payload.get("order")),
+        amount=parse_amount(payload.get("amount")),
+        succeeded=payload.get("status") == "succeeded",
+    )
+
+
+PARSERS = {PaymentMethod.MPESA: parse_mpesa, PaymentMethod.CARD: parse_card}
+
+
+def parse_uuid(value):
+    try:
+        return uuid.UUID(str(value).strip())
+    except ValueError:
+        return None
+
+
+def parse_amount(value):
+    try:
+        amount = Decimal(str(value).replace(",", ""))
+    except InvalidOperation:
+        return None
+    return amount.quantize(Decimal("0.01")) if amount.is_finite() and amount > 0 else None
+
+
+def receive(method, payload):
+    """
+    Store a callback and schedule it to be applied. Returns False for a delivery of a callback
+    that was already received, which costs one index lookup and nothing else.
+
+    Providers may report a transaction as pending or failed before it succeeds, under the same
+    reference. A success therefore replaces a callback that was rejected as not succeeded.
+
+    Raises ValueError when the payload has no transaction reference to dedupe it on.
+    """
+    confirmation = PARSERS[method](payload)
+    reference = normalize_reference(confirmation.reference)
+    if not reference:
+        raise ValueError("Callback has no transaction reference")
+
+    existing = (
+        PaymentCallback.objects.filter(method=method, reference=reference).only("method", "status", "payload").first()
+    )
+    if existing is not None:
+        if confirmation.succeeded and is_unsucceeded(existing):
+            return retry(existing.pk, payload)
+        return False
+    try:
+        with transaction.atomic():
+            callback = PaymentCallback.objects.create(method=method, reference=reference, payload=payload)
+            run_in_background(apply_callback, callback.pk)
+    except IntegrityError:
+        # a concurrent delivery of the same callback won the insert
+        return False
+    return True
+
+
+def is_unsucceeded(callback):
+    if callback.status != PaymentCallbackStatus.REJECTED:
+        return False
+    return not PARSERS[callback.method](callback.payload).succeeded
+
+
+def retry(callback_id, payload):
+    """
+    Replace the payload of a callback rejected as not succeeded with a later success and
+    schedule it to be applied again. The row lock lets only one of concurrent successes in.
+    """
+    with transaction.atomic():
+        callback = PaymentCallback.objects.select_for_update().get(pk=callback_id)
+        if not is_unsucceeded(callback):
+            return False
+        callback.payload, callback.status, callback.detail, callback.processed_at = (
+            payload, PaymentCallbackStatus.RECEIVED, "", None
+        )
+        callback.save(update_fields=["payload", "status", "detail", "processed_at"])
+        run_in_background(apply_callback, callback.pk)
+    return True
+
+
+def apply_callback(callback_id):
+    """
+    Record the payment of a received callback and update the payment status of its order.
+    The callback row lock makes sure that a callback is applied once even when a sweep picks it
+    up at the same time.
+
+    A payment of more than the order has outstanding is money received all the same, so it is
+    recorded and the overpayment flagged in the callback detail for a refund.
+    """
+    with transaction.atomic():
+        callback = PaymentCallback.objects.select_for_update().filter(
+            pk=callback_id, status=PaymentCallbackStatus.RECEIVED
+        ).first()
+        if callback is None:
+            return
+
+        confirmation = PARSERS[callback.method](callback.payload)
+        # the payment may already be known from a reconciled statement
+        recorded = Payment.objects.filter(method=callback.method, normalized_reference=callback.reference).first()
+        order_found = (
+            recorded is None and confirmation.order_id is not None
+            and Order.objects.filter(pk=confirmation.order_id).exists()
+        )
+
+        payment = None
+        if not confirmation.succeeded:
+            status, detail = PaymentCallbackStatus.REJECTED, "Provider did not report the payment as succeeded."
+        elif confirmation.amount is None:
+            status, detail = PaymentCallbackStatus.REJECTED, "Callback has no valid amount."
+        elif recorded is not None:
+            status, detail, payment = PaymentCallbackStatus.APPLIED, "", recorded
+        elif not order_found:
+            status, detail = PaymentCallbackStatus.REJECTED, "No order matches the callback."
+        else:
+            status, detail = PaymentCallbackStatus.APPLIED, ""
+            payment = Payment(
+                order_id=confirmation.order_id,
+                amount=confirmation.amount,
+                method=callback.method,
+                reference=confirmation.reference,
+            )
+            if record_payments([payment]):
+                overpaid = overpayments([payment]).get(payment.pk)
+                if overpaid:
+                    detail = f"Overpayment of {overpaid} on the order."
+                    logger.warning(f"Payment callback {callback.pk} overpays order {payment.order_id} by {overpaid}")
+            else:
+                # recorded meanwhile by a statement reconciliation
+                payment = Payment.objects.get(method=callback.method, normalized_reference=callback.reference)
+
+        callback.status, callback.detail, callback.payment = status, detail, payment
+        callback.processed_at = timezone.now()
+        callback.save(update_fields=["status", "detail", "payment", "processed_at"])
+
+
+def sweep_callbacks():
+    """
+    Apply the callbacks that were stored but never applied, e.g. because the process that
+    received them stopped. Returns the number of callbacks looked at.
+    """
+    callback_ids = PaymentCallback.objects.filter(
+        status=PaymentCallbackStatus.RECEIVED, received_at__lt=timezone.now() - SWEEP_AFTER
+    ).values_list("id", flat=True)
+
+    count = 0
+    for callback_id in callback_ids.iterator(chunk_size=500):
+        try:
+            apply_callback(callback_id)
+        except Exception:
+            logger.exception(f"Payment callback {callback_id} could not be applied")
+        count += 1
+    return count
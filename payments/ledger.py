@@ -0,0 +1,147 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, F, Q, Sum
+from django.utils import timezone
+
+from orders.models import OrderItem
+
+from .models import LedgerAccount, LedgerEntry, LedgerTransaction, LedgerTransactionKind, Payout, SellerBalance
+
+BATCH_SIZE = 2000
+
+# entries past a seller's snapshot, the tail added onto it to get the current balance
+SINCE_SNAPSHOT = Q(seller__ledger_balance__isnull=True) | Q(created_at__gt=F("seller__ledger_balance__upto"))
+
+
+def credit_completed_orders(order_ids):
+    """
+    Credit the sellers of completed orders with their item totals against the sales account.
+    Call it in the transaction that completes the orders. Orders already credited are skipped.
+    """
+    credited = set(
+        LedgerTransaction.objects.filter(kind=LedgerTransactionKind.SALE, order_id__in=order_ids)
+        .values_list("order_id", flat=True)
+    )
+    lines = (
+        OrderItem.objects.filter(order_id__in=set(order_ids) - credited, seller__isnull=False)
+        .values("order_id", "seller_id")
+        .annotate(amount=Sum(F("unit_price") * F("quantity"), output_field=DecimalField()))
+    )
+    sales = defaultdict(dict)
+    for line in lines:
+        sales[line["order_id"]][line["seller_id"]] = Decimal(line["amount"]).quantize(Decimal("0.01"))
+    if not sales:
+        return
+
+    transactions = LedgerTransaction.objects.bulk_create([
+        LedgerTransaction(kind=LedgerTransactionKind.SALE, order_id=order_id) for order_id in sales
+    ])
+    entries = []
+    for ledger_transaction in transactions:
+        amounts = sales[ledger_transaction.order_id]
+        entries.extend(
+            LedgerEntry(transaction=ledger_transaction, account=LedgerAccount.SELLER, seller_id=seller, amount=amount)
+            for seller, amount in amounts.items()
+        )
+        entries.append(LedgerEntry(
+            transaction=ledger_transaction, account=LedgerAccount.SALES, amount=-sum(amounts.values())
+        ))
+    LedgerEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+
+
+def seller_balance(seller_id):
+    """
+    What a seller is owed: their latest snapshot plus the entries created since.
+    """
+    snapshot = SellerBalance.objects.filter(seller_id=seller_id).first()
+    tail = LedgerEntry.objects.filter(seller_id=seller_id)
+    if snapshot is not None:
+        tail = tail.filter(created_at__gt=snapshot.upto)
+    balance = snapshot.balance if snapshot is not None else Decimal("0.00")
+    return balance + (tail.aggregate(amount=Sum("amount"))["amount"] or Decimal("0.00"))
+
+
+def seller_balances():
+    """
+    What every seller is owed, in one read of the snapshots and one aggregate of their tails.
+    """
+    balances = defaultdict(Decimal, SellerBalance.objects.values_list("seller_id", "balance"))
+    tails = LedgerEntry.objects.filter(SINCE_SNAPSHOT, seller__isnull=False).values("seller_id").annotate(
+        amount=Sum("amount")
+    )
+    for tail in tails:
+        balances[tail["seller_id"]] += tail["amount"]
+    return dict(balances)
+
+
+def take_snapshots():
+    """
+    Move the balance snapshots of the sellers with new entries up to SELLER_BALANCE_LAG ago.
+    Entries younger than that are left in the tail, so that an entry committed late never ends
+    up before a snapshot that missed it. Returns the number of snapshots written.
+
+    Snapshots only ever move forward: a snapshot already past this run's cut-off, taken by a
+    run that held the lock first or on a server whose clock is ahead, is left alone, since
+    moving it back would put entries it already counted back in the tail.
+    """
+    with transaction.atomic():
+        # the lock keeps concurrent runs and payouts from adding the same entries twice
+        snapshots = {
+            snapshot.seller_id: snapshot for snapshot in SellerBalance.objects.select_for_update().order_by("seller")
+        }
+        # taken under the lock, after any run this one waited for has committed
+        upto = timezone.now() - timedelta(seconds=settings.SELLER_BALANCE_LAG)
+        deltas = (
+            LedgerEntry.objects.filter(SINCE_SNAPSHOT, seller__isnull=False, created_at__lte=upto)
+            .values("seller_id").annotate(amount=Sum("amount"))
+        )
+
+        created, updated = [], []
+        for delta in deltas:
+            snapshot = snapshots.get(delta["seller_id"])
+            if snapshot is None:
+                created.append(SellerBalance(seller_id=delta["seller_id"], balance=delta["amount"], upto=upto))
+            elif upto > snapshot.upto:
+                snapshot.balance += delta["amount"]
+                snapshot.upto = upto
+                updated.append(snapshot)
+
+        # a seller snapshotted for the first time by a concurrent run keeps that snapshot
+        SellerBalance.objects.bulk_create(created, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        SellerBalance.objects.bulk_update(updated, ["balance", "upto"], batch_size=BATCH_SIZE)
+    return len(created) + len(updated)
+
+
+def run_payouts(minimum):
+    """
+    Pay out every seller owed at least `minimum`, debiting their account against the payouts
+    account. Balances are computed for all sellers in one pass once the snapshots are locked,
+    so that a concurrent run waits and then sees these payouts.
+
+    Sellers without a snapshot yet are paid by the run after their first snapshot.
+    """
+    minimum = max(minimum, Decimal("0.01"))
+    take_snapshots()
+    with transaction.atomic():
+        sellers = list(SellerBalance.objects.select_for_update().order_by("seller").values_list("seller_id", flat=True))
+        balances = seller_balances()
+        owed = {seller: balances[seller] for seller in sellers if balances.get(seller, 0) >= minimum}
+        if not owed:
+            return []
+
+        transactions = LedgerTransaction.objects.bulk_create([
+            LedgerTransaction(kind=LedgerTransactionKind.PAYOUT) for _ in owed
+        ])
+        entries, payouts = [], []
+        for ledger_transaction, (seller, amount) in zip(transactions, owed.items()):
+            entries.append(LedgerEntry(
+                transaction=ledger_transaction, account=LedgerAccount.SELLER, seller_id=seller, amount=-amount
+            ))
+            entries.append(LedgerEntry(transaction=ledger_transaction, account=LedgerAccount.PAYOUTS, amount=amount))
+            payouts.append(Payout(seller_id=seller, amount=amount, transaction=ledger_transaction))
+        LedgerEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+        return Payout.objects.bulk_create(payouts, batch_size=BATCH_SIZE)
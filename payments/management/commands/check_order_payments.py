@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from payments.services import check_payments
+
+
+class Command(BaseCommand):
+    help = "Compare the amount paid stored on orders with the sum of their payments"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repair", action="store_true", help="Set the drifted orders to the sum of their payments"
+        )
+
+    def handle(self, *args, **options):
+        count, drifted = check_payments(repair=options["repair"])
+        for row in drifted:
+            self.stderr.write(f"Order {row['id']}: stored {row['amount_paid']}, payments sum to {row['paid']}")
+        if not count:
+            self.stdout.write(self.style.SUCCESS("Every order matches its payments"))
+        elif options["repair"]:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {count} orders"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{count} orders do not match their payments, rerun with --repair"))
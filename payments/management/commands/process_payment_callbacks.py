@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from payments.callbacks import sweep_callbacks
+
+
+class Command(BaseCommand):
+    help = "Apply the payment callbacks that were received but never applied"
+
+    def handle(self, *args, **options):
+        count = sweep_callbacks()
+        self.stdout.write(self.style.SUCCESS(f"Processed {count} payment callbacks"))
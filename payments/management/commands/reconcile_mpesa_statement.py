@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+
+from payments.reconciliation import reconcile_statement
+
+
+class Command(BaseCommand):
+    help = "Reconcile an M-Pesa statement CSV export against the recorded payments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path of the statement CSV file")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["path"], "rb") as file:
+                report = reconcile_statement(file)
+        except OSError as e:
+            raise CommandError(f"Cannot read the statement: {e}")
+        except serializers.ValidationError as e:
+            raise CommandError(json.dumps(e.detail))
+
+        data = report.data
+        for issue in data["issues"]:
+            self.stderr.write(f"Row {issue['row']} ({issue['reference']}): {issue['detail']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{data['rows']} rows: {data['matched']} already recorded, {data['created']} payments added, "
+            f"{data['unmatched']} unmatched, {data['skipped']} skipped"
+        ))
@@ -0,0 +1,23 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.ledger import run_payouts
+
+
+class Command(BaseCommand):
+    help = "Record a payout to every seller owed at least the payout minimum"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--minimum",
+            type=Decimal,
+            default=settings.SELLER_PAYOUT_MINIMUM,
+            help="Smallest balance to pay out (defaults to SELLER_PAYOUT_MINIMUM)",
+        )
+
+    def handle(self, *args, **options):
+        payouts = run_payouts(options["minimum"])
+        total = sum((payout.amount for payout in payouts), Decimal("0.00"))
+        self.stdout.write(self.style.SUCCESS(f"Recorded {len(payouts)} payouts totalling {total}"))
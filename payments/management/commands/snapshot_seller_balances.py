@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from payments.ledger import take_snapshots
+
+
+class Command(BaseCommand):
+    help = "Move the seller balance snapshots up to the settled ledger entries"
+
+    def handle(self, *args, **options):
+        count = take_snapshots()
+        self.stdout.write(self.style.SUCCESS(f"Updated {count} seller balance snapshots"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from payments.reconciliation import sweep_reconciliations
+
+
+class Command(BaseCommand):
+    help = "Finish the statement reconciliations whose run stopped"
+
+    def handle(self, *args, **options):
+        count = sweep_reconciliations()
+        self.stdout.write(self.style.SUCCESS(f"Ran {count} reconciliations"))
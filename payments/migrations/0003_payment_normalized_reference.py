@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:41
+
+import re
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+from core.operations import PostgreSQLOnly
+
+
+def populate_normalized_references(apps, schema_editor):
+    Payment = apps.get_model('payments', 'Payment')
+    payments = []
+    for payment in Payment.objects.exclude(reference=None).only('id', 'reference').iterator(chunk_size=2000):
+        payment.normalized_reference = re.sub(r'[^0-9A-Z]', '', payment.reference.upper())
+        payments.append(payment)
+    Payment.objects.bulk_update(payments, ['normalized_reference'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_orderintake'),
+        ('payments', '0002_archivedpayment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='normalized_reference',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_normalized_references, migrations.RunPython.noop),
+        PostgreSQLOnly(
+            migrations.AddIndex(
+                model_name='payment',
+                index=django.contrib.postgres.indexes.HashIndex(fields=['normalized_reference'], name='payments_reference_hash_idx'),
+            ),
+        ),
+    ]
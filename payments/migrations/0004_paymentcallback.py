@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:53
+
+import django.db.models.deletion
+import enumfields.fields
+import payments.models
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_payment_normalized_reference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentCallback',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('method', enumfields.fields.EnumField(enum=payments.models.PaymentMethod, max_length=64)),
+                ('reference', models.CharField(max_length=255)),
+                ('payload', models.JSONField()),
+                ('status', enumfields.fields.EnumField(default='received', enum=payments.models.PaymentCallbackStatus, max_length=64)),
+                ('detail', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='payments.payment')),
+            ],
+            options={
+                'ordering': ['-received_at'],
+                'indexes': [models.Index(fields=['status', 'received_at'], name='payments_pa_status_8d30f0_idx')],
+                'constraints': [models.UniqueConstraint(fields=('method', 'reference'), name='unique_payment_callback')],
+            },
+        ),
+    ]
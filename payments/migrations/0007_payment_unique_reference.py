@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_product_daily_sales_name'),
+        ('payments', '0006_reconciliation'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='payment',
+            constraint=models.UniqueConstraint(condition=models.Q(('normalized_reference', ''), _negated=True), fields=('method', 'normalized_reference'), name='unique_payment_reference'),
+        ),
+    ]
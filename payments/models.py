@@ -3,11 +3,16 @@ from enum import Enum
 from uuid import uuid4
 
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import HashIndex
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 from enumfields import EnumField
 
-from orders.models import Order
+from orders.models import ArchivedOrder, Order
+
+from .references import normalize_reference
 
 User = get_user_model()
 
@@ -21,16 +26,208 @@ class PaymentMethod(Enum):
 class Payment(models.Model):
     """
     Payments applied to an order. supports partial payments.
+
+    Record new payments with payments.services.record_payments, which keeps Order.amount_paid
+    and Order.payment_status in step.
     """
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="payments")
     amount = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(Decimal("0.01"))])
     method = EnumField(PaymentMethod, max_length=64)
     reference = models.CharField(max_length=255, blank=True, null=True)
+    # maintained from reference, see payments.references
+    normalized_reference = models.CharField(max_length=255, blank=True, default="", editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            # a provider transaction is recorded once, whichever of its callback and statement comes first
+            models.UniqueConstraint(
+                fields=["method", "normalized_reference"], condition=~Q(normalized_reference=""),
+                name="unique_payment_reference",
+            ),
+        ]
+        indexes = [
+            HashIndex(fields=["normalized_reference"], name="payments_reference_hash_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.normalized_reference = normalize_reference(self.reference)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Payment {self.amount} ({self.method.value}) for Order {self.order_id}"
+
+
+class ArchivedPayment(models.Model):
+    """
+    Payment of an archived order, moved along with it (see payments.signals).
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="payments")
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    method = EnumField(PaymentMethod, max_length=64)
+    reference = models.CharField(max_length=255, blank=True, null=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Archived payment {self.amount} ({self.method.value}) for Order {self.order_id}"
+
+
+class PaymentCallbackStatus(Enum):
+    RECEIVED = "received"
+    APPLIED = "applied"
+    REJECTED = "rejected"
+
+
+class PaymentCallback(models.Model):
+    """
+    A payment confirmation pushed by a provider, stored as received before it is acknowledged
+    and applied to its order in the background (see payments.callbacks).
+    """
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    method = EnumField(PaymentMethod, max_length=64)
+    # normalized provider transaction reference, see payments.references
+    reference = models.CharField(max_length=255)
+    payload = models.JSONField()
+    status = EnumField(PaymentCallbackStatus, default=PaymentCallbackStatus.RECEIVED, max_length=64)
+    detail = models.TextField(blank=True)
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-received_at"]
+        constraints = [
+            models.UniqueConstraint(fields=["method", "reference"], name="unique_payment_callback"),
+        ]
+        indexes = [
+            models.Index(fields=["status", "received_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.method.value} callback {self.reference} - {self.status.value}"
+
+
+class ReconciliationStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Reconciliation(models.Model):
+    """
+    An uploaded M-Pesa statement, reconciled against the recorded payments by a background
+    worker (see payments.reconciliation). The report is stored once the run is done.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    file = models.FileField(upload_to="statements")
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    status = EnumField(ReconciliationStatus, default=ReconciliationStatus.QUEUED, max_length=64)
+    report = models.JSONField(null=True, blank=True)
+    errors = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "updated_at"]),
+        ]
+
+    def __str__(self):
+        return f"Reconciliation {self.pk} - {self.status.value}"
+
+
+class LedgerAccount(Enum):
+    # owed to a seller, one per seller
+    SELLER = "seller"
+    # collected from buyers for the sellers
+    SALES = "sales"
+    # paid out to sellers
+    PAYOUTS = "payouts"
+
+
+class LedgerTransactionKind(Enum):
+    SALE = "sale"
+    PAYOUT = "payout"
+
+
+class LedgerTransaction(models.Model):
+    """
+    A balanced set of ledger entries: the sellers credited for a completed order, or a payout
+    to a seller (see payments.ledger).
+    """
+    kind = EnumField(LedgerTransactionKind, max_length=64)
+    # not a constraint so that the ledger outlives archived orders
+    order = models.ForeignKey(
+        Order, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name="+"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["order"], condition=models.Q(kind=LedgerTransactionKind.SALE), name="unique_sale_transaction"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind.value} transaction {self.pk}"
+
+
+class LedgerEntry(models.Model):
+    """
+    One side of a ledger transaction. Credits are positive and debits negative, so the entries
+    of a transaction sum to zero and the balance of an account is the sum of its entries.
+    """
+    transaction = models.ForeignKey(LedgerTransaction, on_delete=models.PROTECT, related_name="entries")
+    account = EnumField(LedgerAccount, max_length=64)
+    seller = models.ForeignKey(
+        User, on_delete=models.PROTECT, null=True, blank=True, db_index=False, related_name="ledger_entries"
+    )
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["seller", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.account.value} {self.amount} ({self.transaction_id})"
+
+
+class SellerBalance(models.Model):
+    """
+    Snapshot of what a seller is owed from the ledger entries created up to `upto`. The current
+    balance is the snapshot plus the entries created since.
+    """
+    seller = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="ledger_balance")
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+    upto = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.seller_id} owed {self.balance} as of {self.upto}"
+
+
+class Payout(models.Model):
+    """
+    Money paid out to a seller, recorded in the ledger by its transaction.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    seller = models.ForeignKey(User, on_delete=models.PROTECT, related_name="payouts")
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    transaction = models.OneToOneField(LedgerTransaction, on_delete=models.PROTECT, related_name="payout")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ["-created_at"]
 
     def __str__(self):
-        return f"Payment {self.amount} ({self.method.value}) for Order {self.order.id}"
+        return f"Payout {self.amount} to {self.seller_id}"
@@ -0,0 +1,303 @@
+import csv
+import io
+import logging
+import re
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from core.tasks import run_in_background
+from orders.models import Order
+
+from .models import Payment, PaymentMethod, Reconciliation, ReconciliationStatus
+from .references import normalize_reference
+from .services import overpayments, record_payments
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+
+# runs that have not finished a batch for this long were lost with the process running them
+SWEEP_AFTER = timedelta(minutes=5)
+
+PENDING_STATUSES = (ReconciliationStatus.QUEUED, ReconciliationStatus.RUNNING)
+
+# stop collecting row issues past this point so a bad statement cannot blow up the report
+MAX_REPORTED_ISSUES = 1000
+
+# statement columns by their header reduced to lower case letters, the first one found is used
+COLUMNS = {
+    "reference": ("receiptno", "receipt", "transactionid"),
+    "amount": ("paidin", "amount"),
+    "status": ("transactionstatus", "status"),
+    "account": ("acno", "accountno", "account", "billrefnumber", "accountreference"),
+}
+
+REQUIRED_COLUMNS = ("reference", "amount", "account")
+
+
+@dataclass
+class StatementRow:
+    number: int
+    reference: str
+    normalized_reference: str
+    amount: Decimal
+    order_id: uuid.UUID | None
+
+
+class ReconciliationReport:
+    def __init__(self):
+        self.rows = 0
+        self.matched = 0
+        self.created = 0
+        self.skipped = 0
+        self.unmatched = 0
+        self.issues = []
+        self.issue_count = 0
+
+    def add_issue(self, row, reference, detail):
+        self.issue_count += 1
+        if len(self.issues) < MAX_REPORTED_ISSUES:
+            self.issues.append({"row": row, "reference": reference, "detail": detail})
+
+    @property
+    def data(self):
+        return {
+            "rows": self.rows,
+            "matched": self.matched,
+            "created": self.created,
+            "skipped": self.skipped,
+            "unmatched": self.unmatched,
+            "issues": self.issues,
+            "issues_truncated": self.issue_count > len(self.issues),
+        }
+
+
+def find_columns(header):
+    names = {re.sub(r"[^a-z]", "", (name or "").lower()): index for index, name in enumerate(header)}
+    columns = {}
+    for column, candidates in COLUMNS.items():
+        for candidate in candidates:
+            if candidate in names:
+                columns[column] = names[candidate]
+                break
+
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise serializers.ValidationError({"file": [f"Statement is missing the columns: {', '.join(missing)}"]})
+    return columns
+
+
+def parse_order_id(account):
+    try:
+        return uuid.UUID(account.strip())
+    except (AttributeError, ValueError):
+        return None
+
+
+def read_statement(stream, report):
+    """
+    Yield the completed incoming payments of an M-Pesa statement CSV, one row at a time.
+    """
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        raise serializers.ValidationError({"file": ["Statement is empty"]})
+    columns = find_columns(header)
+
+    def cell(row, column):
+        index = columns.get(column)
+        return row[index].strip() if index is not None and index < len(row) else ""
+
+    for number, row in enumerate(reader, start=1):
+        report.rows += 1
+        status = cell(row, "status")
+        amount = cell(row, "amount").replace(",", "")
+        # withdrawals and failed transactions have nothing to reconcile
+        if (status and status.lower() != "completed") or not amount:
+            report.skipped += 1
+            continue
+
+        reference = cell(row, "reference")
+        normalized = normalize_reference(reference)
+        try:
+            amount = Decimal(amount)
+        except InvalidOperation:
+            amount = None
+        if not normalized or amount is None or not amount.is_finite() or amount <= 0:
+            report.add_issue(number, reference, "Row has no valid receipt number and amount.")
+            continue
+        order_id = parse_order_id(cell(row, "account"))
+        yield StatementRow(number, reference, normalized, amount.quantize(Decimal("0.01")), order_id)
+
+
+def check_statement(file):
+    """
+    Read the whole statement once to make sure it decodes, parses and has the required columns,
+    so that a broken file is refused before any of its payments are recorded.
+    """
+    stream = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        for _ in read_statement(stream, ReconciliationReport()):
+            pass
+    except UnicodeDecodeError:
+        raise serializers.ValidationError({"file": ["Statement is not UTF-8 encoded."]})
+    except csv.Error as e:
+        raise serializers.ValidationError({"file": [f"Statement is not valid CSV: {e}"]})
+    finally:
+        stream.detach()
+        file.seek(0)
+
+
+def reconcile_statement(file, on_batch=None):
+    """
+    Reconcile an M-Pesa statement export against the recorded payments.
+
+    The statement is streamed in batches of BATCH_SIZE rows. Each batch costs one lookup of its
+    receipt numbers on the normalized reference hash index, one lookup of the orders named in
+    the account column and one bulk insert of the payments that were missing, added onto the
+    amount paid of their orders in the same transaction. Every batch commits on its own, after
+    which `on_batch` is called with the report so far, and reruns skip the receipts that are
+    already recorded.
+
+    Raises ValidationError for a file that is not UTF-8, not valid CSV or misses columns.
+    """
+    check_statement(file)
+    stream = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    report = ReconciliationReport()
+    batch = []
+
+    for row in read_statement(stream, report):
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            reconcile_batch(batch, report)
+            batch = []
+            if on_batch is not None:
+                on_batch(report)
+    if batch:
+        reconcile_batch(batch, report)
+
+    stream.detach()
+    return report
+
+
+def reconcile_batch(batch, report):
+    """
+    Record the missing payments of one batch of statement rows. Receipts recorded meanwhile,
+    e.g. by their callback, are left out by the unique reference and count as matched, and
+    overpayments are recorded and reported as issues, the same as for callbacks.
+    """
+    with transaction.atomic():
+        recorded = dict(
+            Payment.objects.filter(
+                method=PaymentMethod.MPESA, normalized_reference__in={row.normalized_reference for row in batch}
+            ).values_list("normalized_reference", "amount")
+        )
+
+        pending = {}
+        for row in batch:
+            if row.normalized_reference in recorded:
+                report.matched += 1
+                if recorded[row.normalized_reference] != row.amount:
+                    report.add_issue(row.number, row.reference, "Amount differs from the recorded payment.")
+            elif row.normalized_reference in pending:
+                report.add_issue(row.number, row.reference, "Receipt is listed more than once.")
+            else:
+                pending[row.normalized_reference] = row
+
+        orders = set(
+            Order.objects.filter(pk__in={row.order_id for row in pending.values() if row.order_id})
+            .values_list("pk", flat=True)
+        )
+        payments, rows = [], {}
+        for row in pending.values():
+            if row.order_id not in orders:
+                report.unmatched += 1
+                report.add_issue(row.number, row.reference, "No order matches the account number.")
+                continue
+            payment = Payment(
+                order_id=row.order_id,
+                amount=row.amount,
+                method=PaymentMethod.MPESA,
+                reference=row.reference,
+            )
+            payments.append(payment)
+            rows[payment.pk] = row
+
+        payments = record_payments(payments)
+        report.created += len(payments)
+        report.matched += len(rows) - len(payments)
+        for payment_id, overpaid in overpayments(payments).items():
+            row = rows[payment_id]
+            report.add_issue(row.number, row.reference, f"Overpayment of {overpaid} on the order.")
+
+
+def start_reconciliation(file, created_by):
+    """
+    Check an uploaded statement, store it and schedule its reconciliation once it commits.
+    """
+    check_statement(file)
+    with transaction.atomic():
+        reconciliation = Reconciliation.objects.create(file=file, created_by=created_by)
+        run_in_background(run_reconciliation, reconciliation.pk)
+    return reconciliation
+
+
+def _claim(reconciliation_id, stale=False):
+    """
+    Mark a pending reconciliation as running and return it, or None when it is done or, unless
+    `stale`, already running. The conditional UPDATE lets only one worker or sweep claim it.
+    """
+    runs = Reconciliation.objects.filter(pk=reconciliation_id)
+    if stale:
+        runs = runs.filter(status__in=PENDING_STATUSES, updated_at__lt=timezone.now() - SWEEP_AFTER)
+    else:
+        runs = runs.filter(status=ReconciliationStatus.QUEUED)
+    if not runs.update(status=ReconciliationStatus.RUNNING, updated_at=timezone.now()):
+        return None
+    return Reconciliation.objects.get(pk=reconciliation_id)
+
+
+def run_reconciliation(reconciliation_id, stale=False):
+    """
+    Reconcile a stored statement and keep its report. The run is touched after every batch, so
+    a sweep only picks up runs that stopped; the batches it had committed are matched, not
+    recorded again, when the sweep reruns the statement.
+    """
+    reconciliation = _claim(reconciliation_id, stale)
+    if reconciliation is None:
+        return
+
+    def touch(report):
+        Reconciliation.objects.filter(pk=reconciliation_id).update(updated_at=timezone.now())
+
+    try:
+        with reconciliation.file.open("rb") as file:
+            report = reconcile_statement(file, on_batch=touch)
+    except serializers.ValidationError as e:
+        outcome = {"status": ReconciliationStatus.FAILED, "errors": e.detail}
+    else:
+        outcome = {"status": ReconciliationStatus.DONE, "report": report.data, "errors": None}
+    Reconciliation.objects.filter(pk=reconciliation_id).update(updated_at=timezone.now(), **outcome)
+
+
+def sweep_reconciliations():
+    """
+    Run the reconciliations whose run stopped, e.g. because the process running them went away.
+    Returns the number of reconciliations looked at.
+    """
+    reconciliation_ids = list(
+        Reconciliation.objects.filter(status__in=PENDING_STATUSES, updated_at__lt=timezone.now() - SWEEP_AFTER)
+        .order_by("created_at").values_list("id", flat=True)
+    )
+    for reconciliation_id in reconciliation_ids:
+        try:
+            run_reconciliation(reconciliation_id, stale=True)
+        except Exception:
+            logger.exception(f"Reconciliation {reconciliation_id} could not be run")
+    return len(reconciliation_ids)
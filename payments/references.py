@@ -0,0 +1,11 @@
+import re
+
+NON_ALPHANUMERIC = re.compile(r"[^0-9A-Z]")
+
+
+def normalize_reference(reference):
+    """
+    Reduce a transaction reference to the form it is matched on: upper case letters and digits
+    only, so that "qjk3l9 xyz1" and "QJK3L9XYZ1" are the same M-Pesa receipt.
+    """
+    return NON_ALPHANUMERIC.sub("", (reference or "").upper())
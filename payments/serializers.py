@@ -0,0 +1,13 @@
+from rest_framework import serializers
+
+from core.serializers import EnumField
+
+from .models import Reconciliation, ReconciliationStatus
+
+
+class ReconciliationSerializer(serializers.ModelSerializer):
+    status = EnumField(enum_class=ReconciliationStatus, read_only=True)
+
+    class Meta:
+        model = Reconciliation
+        fields = ['id', 'status', 'report', 'errors', 'created_at', 'updated_at']
@@ -0,0 +1,147 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+from django.utils import timezone
+
+from orders.events import record_payment_changes
+from orders.models import Order, PaymentStatus
+
+from .models import Payment
+from .references import normalize_reference
+
+CHUNK_SIZE = 500
+
+# stop collecting drifted orders past this point so a broken table cannot blow up the report
+MAX_REPORTED_ORDERS = 1000
+
+
+def payment_status(paid):
+    """
+    The payment status of an order once `paid` has been paid on it: PAID once the payments
+    cover the total, PARTIAL before that. Refunded orders keep their status.
+    """
+    return Case(
+        When(payment_status=PaymentStatus.REFUNDED, then=F("payment_status")),
+        When(LessThanOrEqual(F("total"), paid), then=Value(PaymentStatus.PAID.value)),
+        When(GreaterThan(paid, Value(Decimal("0.00"))), then=Value(PaymentStatus.PARTIAL.value)),
+        default=F("payment_status"),
+        output_field=Order._meta.get_field("payment_status"),
+    )
+
+
+def _update_orders(orders, paid, now):
+    """
+    Set the amount paid of `orders` to the `paid` expression, move their payment status along
+    and record the status changes.
+    """
+    # the lock also orders concurrent writers on the same orders by primary key
+    before = dict(orders.select_for_update().order_by("pk").values_list("pk", "payment_status"))
+    orders.update(amount_paid=paid, payment_status=payment_status(paid), updated_at=now)
+    after = dict(Order.objects.filter(pk__in=before).values_list("pk", "payment_status"))
+    record_payment_changes(
+        [(order_id, before[order_id], after[order_id]) for order_id in before if before[order_id] != after[order_id]],
+        at=now,
+    )
+
+
+def record_payments(payments):
+    """
+    Insert `payments` and add them onto the amount paid of their orders in the same
+    transaction. Returns the payments that were inserted.
+
+    A payment whose provider reference is already recorded, e.g. by a callback and a statement
+    of the same transaction arriving together, is left out by the unique constraint on the
+    reference and not added again.
+
+    The amounts are added with F() increments, a chunk of orders per UPDATE, so the payment
+    table is never summed and concurrent payments on the same order cannot overwrite each
+    other.
+    """
+    for payment in payments:
+        # bulk_create skips Payment.save()
+        payment.normalized_reference = normalize_reference(payment.reference)
+    now = timezone.now()
+
+    with transaction.atomic():
+        Payment.objects.bulk_create(payments, batch_size=CHUNK_SIZE, ignore_conflicts=True)
+        # the ids are generated here, so the rows found under them are the ones this insert added
+        inserted = set()
+        for start in range(0, len(payments), CHUNK_SIZE):
+            chunk = [payment.pk for payment in payments[start:start + CHUNK_SIZE]]
+            inserted.update(Payment.objects.filter(pk__in=chunk).values_list("pk", flat=True))
+        payments = [payment for payment in payments if payment.pk in inserted]
+
+        amounts = defaultdict(Decimal)
+        for payment in payments:
+            amounts[payment.order_id] += payment.amount
+        order_ids = sorted(amounts)
+        for start in range(0, len(order_ids), CHUNK_SIZE):
+            chunk = order_ids[start:start + CHUNK_SIZE]
+            increment = Case(
+                *[When(pk=order_id, then=Value(amounts[order_id])) for order_id in chunk],
+                output_field=Order._meta.get_field("amount_paid"),
+            )
+            _update_orders(Order.objects.filter(pk__in=chunk), F("amount_paid") + increment, now)
+    return payments
+
+
+def overpayments(payments):
+    """
+    How much of each of the just recorded `payments` went beyond the total of its order, by
+    payment id, for the payments that overpaid. The excess of an order is put on its last
+    payments. Must run in the transaction that recorded them, which holds their order locks.
+    """
+    orders = dict(
+        Order.objects.filter(pk__in={payment.order_id for payment in payments})
+        .values_list("pk", F("amount_paid") - F("total"))
+    )
+    excess = {
+        order_id: max(Decimal(over), Decimal("0.00")).quantize(Decimal("0.01")) for order_id, over in orders.items()
+    }
+    overpaid = {}
+    for payment in reversed(payments):
+        part = min(excess[payment.order_id], payment.amount)
+        if part > 0:
+            overpaid[payment.pk] = part
+            excess[payment.order_id] -= part
+    return overpaid
+
+
+def check_payments(repair=False, chunk_size=2000):
+    """
+    Compare the amount paid stored on every order with the sum of its payments, a chunk of
+    orders per query, and with `repair` set the drifted orders to the sums.
+
+    Returns the number of drifted orders and the first MAX_REPORTED_ORDERS of them.
+    """
+    paid = Coalesce(
+        Subquery(
+            Payment.objects.filter(order=OuterRef("pk")).values("order").annotate(paid=Sum("amount")).values("paid")
+        ),
+        Value(Decimal("0.00")),
+    )
+    drifted, count = [], 0
+    last = None
+
+    while True:
+        orders = Order.objects.order_by("pk")
+        if last is not None:
+            orders = orders.filter(pk__gt=last)
+        chunk = list(orders.values_list("pk", flat=True)[:chunk_size])
+        if not chunk:
+            return count, drifted
+        last = chunk[-1]
+
+        rows = list(
+            Order.objects.filter(pk__in=chunk).annotate(paid=paid).filter(~Q(amount_paid=F("paid")))
+            .values("id", "amount_paid", "paid")
+        )
+        count += len(rows)
+        drifted.extend(rows[:MAX_REPORTED_ORDERS - len(drifted)])
+        if repair and rows:
+            with transaction.atomic():
+                _update_orders(Order.objects.filter(pk__in=[row["id"] for row in rows]), paid, timezone.now())
@@ -0,0 +1,28 @@
+from django.dispatch import receiver
+
+from orders.archive import orders_archived
+from orders.events import order_events_recorded
+from orders.models import Order, OrderEvent, OrderEventKind, OrderStatus
+
+from .ledger import credit_completed_orders
+from .models import ArchivedPayment, Payment
+
+
+@receiver(orders_archived, sender=Order)
+def archive_payments(sender, order_ids, **kwargs):
+    # the payments would otherwise be deleted along with their orders
+    ArchivedPayment.objects.bulk_create([
+        ArchivedPayment(**payment) for payment in Payment.objects.filter(order_id__in=order_ids).values(
+            "id", "order_id", "amount", "method", "reference", "created_at"
+        )
+    ])
+
+
+@receiver(order_events_recorded, sender=OrderEvent)
+def credit_sellers(sender, events, **kwargs):
+    completed = [
+        event.order_id for event in events
+        if event.kind == OrderEventKind.STATUS and event.to_status == OrderStatus.COMPLETED.value
+    ]
+    if completed:
+        credit_completed_orders(completed)
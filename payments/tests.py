@@ -1,3 +1,487 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import io
+import json
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import UserRole
+from core.testing import create_order, create_staff, create_user
+from orders.models import Order, OrderEvent, OrderEventKind, OrderItem, OrderStatus, PaymentStatus
+from orders.transitions import bulk_transition
+from products.models import Product
+
+from .ledger import run_payouts, seller_balance, seller_balances, take_snapshots
+from .models import (
+    LedgerEntry, LedgerTransaction, Payment, PaymentCallback, PaymentCallbackStatus, PaymentMethod, Payout,
+    Reconciliation, ReconciliationStatus, SellerBalance,
+)
+from .reconciliation import SWEEP_AFTER, reconcile_statement, sweep_reconciliations
+from .services import check_payments, overpayments, record_payments
+
+
+def complete_sale(buyer, *lines):
+    """
+    Create an order with one item per `(seller, amount)` line and move it to completed.
+    """
+    order = Order.objects.create(buyer=buyer, status=OrderStatus.SHIPPED)
+    for seller, amount in lines:
+        product = Product.objects.create(
+            name="Maize", category="cereals", price=Decimal(amount), stock=Decimal("10"),
+            description="Maize", image="products/test.png", seller=seller,
+        )
+        OrderItem.objects.create(order=order, product=product, seller=seller, unit_price=Decimal(amount), quantity=1)
+    bulk_transition([order.pk], OrderStatus.COMPLETED)
+    return order
+
+
+def owed(seller):
+    """
+    What a seller is owed straight from the ledger, the reference the snapshots are checked against.
+    """
+    return LedgerEntry.objects.filter(seller=seller).aggregate(amount=Sum("amount"))["amount"] or Decimal("0.00")
+
+
+@override_settings(
+    BACKGROUND_TASKS_EAGER=True, CARD_CALLBACK_SECRET="card-secret", MPESA_CALLBACK_TOKEN="mpesa-token",
+    MPESA_CALLBACK_IPS=[],
+)
+class PaymentCallbackTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        self.order = create_order(self.buyer, "100.00")
+
+    def post_card(self, payload, secret="card-secret"):
+        body = json.dumps(payload).encode()
+        signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.generic(
+                "POST", "/api/payments/callbacks/card/", body, content_type="application/json",
+                HTTP_X_SIGNATURE=signature,
+            )
+
+    def post_mpesa(self, payload, token="mpesa-token"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f"/api/payments/callbacks/mpesa/{token}/", payload, format="json")
+
+    def card(self, reference, amount, status="succeeded"):
+        return {"reference": reference, "order": str(self.order.pk), "amount": amount, "status": status}
+
+    def test_unconfigured_provider_is_refused(self):
+        with self.settings(CARD_CALLBACK_SECRET=""):
+            response = self.post_card(self.card("ch_1", "10.00"), secret="")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(PaymentCallback.objects.exists())
+
+    def test_bad_credentials_are_refused(self):
+        self.assertEqual(self.post_card(self.card("ch_1", "10.00"), secret="guess").status_code, 403)
+        self.assertEqual(self.post_mpesa({"TransID": "QA1"}, token="guess").status_code, 403)
+        self.assertEqual(
+            self.client.post("/api/payments/callbacks/mpesa/", {"TransID": "QA1"}, format="json").status_code, 403
+        )
+        with self.settings(MPESA_CALLBACK_IPS=["196.201.214.200"]):
+            self.assertEqual(self.post_mpesa({"TransID": "QA1"}).status_code, 403)
+        self.assertFalse(PaymentCallback.objects.exists())
+
+    def test_repeated_delivery_records_one_payment(self):
+        payload = {"TransID": "qa1 23", "TransAmount": "60.00", "BillRefNumber": str(self.order.pk)}
+        for _ in range(3):
+            response = self.post_mpesa(payload)
+            self.assertEqual(response.json(), {"ResultCode": 0, "ResultDesc": "Accepted"})
+
+        self.assertEqual(Payment.objects.get().normalized_reference, "QA123")
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.amount_paid, Decimal("60.00"))
+        self.assertEqual(self.order.payment_status, PaymentStatus.PARTIAL)
+
+    def test_success_after_failure_is_applied(self):
+        self.post_card(self.card("ch_1", "100.00", status="pending"))
+        self.assertEqual(PaymentCallback.objects.get().status, PaymentCallbackStatus.REJECTED)
+
+        self.post_card(self.card("ch_1", "100.00"))
+        self.post_card(self.card("ch_1", "100.00", status="failed"))
+
+        self.assertEqual(PaymentCallback.objects.get().status, PaymentCallbackStatus.APPLIED)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, PaymentStatus.PAID)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_overpayment_is_recorded_and_flagged(self):
+        self.post_card(self.card("ch_1", "70.00"))
+        with self.assertLogs("payments.callbacks", "WARNING"):
+            self.post_card(self.card("ch_2", "40.00"))
+
+        callback = PaymentCallback.objects.get(reference="CH2")
+        self.assertEqual(callback.status, PaymentCallbackStatus.APPLIED)
+        self.assertEqual(callback.detail, "Overpayment of 10.00 on the order.")
+        self.assertEqual(callback.payment.amount, Decimal("40.00"))
+        self.assertEqual(PaymentCallback.objects.get(reference="CH1").detail, "")
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.amount_paid, self.order.payment_status), (Decimal("110.00"), PaymentStatus.PAID))
+
+    def test_payment_known_from_a_statement_is_not_recorded_again(self):
+        record_payments([
+            Payment(order=self.order, amount=Decimal("60.00"), method=PaymentMethod.MPESA, reference="QA1")
+        ])
+
+        self.post_mpesa({"TransID": "QA1", "TransAmount": "60.00", "BillRefNumber": str(self.order.pk)})
+
+        callback = PaymentCallback.objects.get()
+        self.assertEqual((callback.status, callback.payment), (PaymentCallbackStatus.APPLIED, Payment.objects.get()))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.amount_paid, Decimal("60.00"))
+
+
+def pay(order, amount, reference):
+    return Payment(order=order, amount=Decimal(amount), method=PaymentMethod.MPESA, reference=reference)
+
+
+class AmountPaidTests(TestCase):
+    def setUp(self):
+        buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        self.first, self.second = create_order(buyer, "100.00"), create_order(buyer, "50.00")
+
+    def test_payments_are_added_onto_their_orders(self):
+        record_payments([pay(self.first, "30.00", "QA1"), pay(self.first, "20.00", "QA2")])
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.amount_paid, self.first.payment_status), (Decimal("50.00"), PaymentStatus.PARTIAL))
+
+        record_payments([pay(self.first, "50.00", "QA3"), pay(self.second, "50.00", "QA4")])
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.amount_paid, self.first.payment_status), (Decimal("100.00"), PaymentStatus.PAID))
+        self.assertEqual(self.second.payment_status, PaymentStatus.PAID)
+        self.assertEqual(
+            list(OrderEvent.objects.filter(order_id=self.first.pk, kind=OrderEventKind.PAYMENT)
+                 .order_by("created_at").values_list("to_status", flat=True)),
+            [PaymentStatus.PARTIAL.value, PaymentStatus.PAID.value],
+        )
+
+    def test_recorded_references_are_left_out(self):
+        record_payments([pay(self.first, "30.00", "QA1")])
+
+        inserted = record_payments([pay(self.first, "30.00", "qa 1"), pay(self.first, "20.00", "QA2")])
+
+        self.assertEqual([payment.reference for payment in inserted], ["QA2"])
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.amount_paid, Decimal("50.00"))
+        # payments without a reference are not deduplicated
+        record_payments([
+            Payment(order=self.second, amount=Decimal("10.00"), method=PaymentMethod.CASH) for _ in range(2)
+        ])
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.amount_paid, Decimal("20.00"))
+
+    def test_overpayments_go_on_the_last_payments(self):
+        payments = record_payments([pay(self.first, "60.00", "QA1"), pay(self.first, "60.00", "QA2")])
+
+        self.assertEqual(overpayments(payments), {payments[1].pk: Decimal("20.00")})
+
+    def test_drifted_orders_are_reported_and_repaired(self):
+        record_payments([pay(self.first, "100.00", "QA1"), pay(self.second, "20.00", "QA2")])
+        # payments written around record_payments leave the stored amounts behind
+        Payment.objects.create(order=self.second, amount=Decimal("30.00"), method=PaymentMethod.CASH)
+        Order.objects.filter(pk=self.first.pk).update(amount_paid=Decimal("0.00"))
+
+        count, drifted = check_payments(chunk_size=1)
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            {(row["id"], row["amount_paid"], row["paid"]) for row in drifted},
+            {(self.first.pk, Decimal("0.00"), Decimal("100.00")), (self.second.pk, Decimal("20.00"), Decimal("50.00"))},
+        )
+
+        check_payments(repair=True)
+        self.assertEqual(check_payments(), (0, []))
+        self.second.refresh_from_db()
+        self.assertEqual((self.second.amount_paid, self.second.payment_status), (Decimal("50.00"), PaymentStatus.PAID))
+
+
+@skipIf(connection.vendor == "sqlite", "SQLite serializes all writers, concurrency needs a real database")
+class ConcurrentPaymentTests(TransactionTestCase):
+    PAYMENTS = 10
+
+    def test_concurrent_payments_on_one_order_all_count(self):
+        order = create_order(create_user("buyer@example.com", UserRole.CONSUMER), "100.00")
+        barrier = threading.Barrier(self.PAYMENTS)
+        errors = []
+
+        def run(index):
+            try:
+                barrier.wait()
+                record_payments([pay(order, "10.00", f"QA{index}")])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(self.PAYMENTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        order.refresh_from_db()
+        self.assertEqual((order.amount_paid, order.payment_status), (Decimal("100.00"), PaymentStatus.PAID))
+        self.assertEqual(check_payments(), (0, []))
+        self.assertEqual(OrderEvent.objects.filter(kind=OrderEventKind.PAYMENT, to_status="paid").count(), 1)
+
+    def test_concurrent_recordings_of_one_reference_count_once(self):
+        order = create_order(create_user("buyer@example.com", UserRole.CONSUMER), "100.00")
+        barrier = threading.Barrier(self.PAYMENTS)
+        inserted = []
+        errors = []
+
+        def run():
+            try:
+                barrier.wait()
+                # a callback and statement reconciliations of the same transaction
+                inserted.extend(record_payments([pay(order, "10.00", "QA1")]))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run) for _ in range(self.PAYMENTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(inserted), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+        order.refresh_from_db()
+        self.assertEqual(order.amount_paid, Decimal("10.00"))
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class StatementReconciliationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.enterClassContext(override_settings(MEDIA_ROOT=cls.media_root))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(create_staff("staff@example.com"))
+        self.order = create_order(create_user("buyer@example.com", UserRole.CONSUMER), "100.00")
+
+    def statement(self, *rows):
+        lines = ["Receipt No.,Transaction Status,Paid In,A/C No."]
+        lines += [f"{reference},Completed,{amount},{account}" for reference, amount, account in rows]
+        return "\n".join(lines).encode()
+
+    def upload(self, content):
+        file = SimpleUploadedFile("statement.csv", content, content_type="text/csv")
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post("/api/payments/reconcile/", {"file": file}, format="multipart")
+
+    def test_statement_is_reconciled_in_the_background(self):
+        content = self.statement(("QA1", "60.00", self.order.pk), ("QA2", "10.00", "unknown"))
+
+        response = self.upload(content)
+
+        self.assertEqual(response.status_code, 202, response.content)
+        report = self.client.get(response.headers["Location"]).json()
+        self.assertEqual(report["status"], "done")
+        self.assertEqual(
+            {key: report["report"][key] for key in ("rows", "created", "matched", "unmatched")},
+            {"rows": 2, "created": 1, "matched": 0, "unmatched": 1},
+        )
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.amount_paid, Decimal("60.00"))
+
+        # a rerun of the same statement matches what the first one recorded
+        report = self.client.get(self.upload(content).headers["Location"]).json()["report"]
+        self.assertEqual((report["created"], report["matched"]), (0, 1))
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_overpayment_is_recorded_and_reported(self):
+        content = self.statement(("QA1", "80.00", self.order.pk), ("QA2", "50.00", self.order.pk))
+
+        report = self.client.get(self.upload(content).headers["Location"]).json()["report"]
+
+        self.assertEqual(report["created"], 2)
+        self.assertEqual(report["issues"], [
+            {"row": 2, "reference": "QA2", "detail": "Overpayment of 30.00 on the order."},
+        ])
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.amount_paid, self.order.payment_status), (Decimal("130.00"), PaymentStatus.PAID))
+
+    def test_broken_statement_is_refused_up_front(self):
+        self.assertEqual(self.upload("Receipt No.,Paid In,A/C No.\nCaf\u00e9,1,x\n".encode("latin-1")).json(), {
+            "file": ["Statement is not UTF-8 encoded."]
+        })
+        response = self.upload(f"Receipt No.,Paid In,A/C No.\nQA1,1,{'x' * 200000}\n".encode())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.upload(b"Receipt,Amount\nQA1,1\n").status_code, 400)
+        self.assertFalse(Reconciliation.objects.exists())
+
+    def test_stopped_run_is_swept(self):
+        reconciliation = Reconciliation.objects.create(status=ReconciliationStatus.RUNNING)
+        reconciliation.file.save("statement.csv", ContentFile(self.statement(("QA1", "60.00", self.order.pk))))
+        Reconciliation.objects.update(updated_at=timezone.now() - SWEEP_AFTER - timedelta(minutes=1))
+
+        self.assertEqual(sweep_reconciliations(), 1)
+
+        reconciliation.refresh_from_db()
+        self.assertEqual(reconciliation.status, ReconciliationStatus.DONE)
+        self.assertEqual(reconciliation.report["created"], 1)
+        self.assertEqual(sweep_reconciliations(), 0)
+
+
+@skipIf(connection.vendor == "sqlite", "SQLite serializes all writers, concurrency needs a real database")
+class ConcurrentReconciliationTests(TransactionTestCase):
+    RUNS = 4
+
+    def test_overlapping_runs_record_each_receipt_once(self):
+        orders = [create_order(create_user("buyer@example.com", UserRole.CONSUMER), "100.00")]
+        orders += [create_order(orders[0].buyer, "100.00") for _ in range(9)]
+        content = "Receipt No.,Transaction Status,Paid In,A/C No.\n" + "".join(
+            f"QA{index},Completed,40.00,{order.pk}\n" for index, order in enumerate(orders)
+        )
+        barrier = threading.Barrier(self.RUNS)
+        reports = []
+        errors = []
+
+        def run():
+            try:
+                barrier.wait()
+                reports.append(reconcile_statement(io.BytesIO(content.encode())))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run) for _ in range(self.RUNS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(report.created for report in reports), len(orders))
+        self.assertEqual(sum(report.matched for report in reports), len(orders) * (self.RUNS - 1))
+        self.assertEqual(Payment.objects.count(), len(orders))
+        self.assertEqual(check_payments(), (0, []))
+
+
+@override_settings(SELLER_BALANCE_LAG=0)
+class SellerLedgerTests(TestCase):
+    def setUp(self):
+        self.buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        self.maize = create_user("maize@example.com", UserRole.FARMER)
+        self.beans = create_user("beans@example.com", UserRole.FARMER)
+
+    def test_completed_order_credits_each_seller_once(self):
+        order = complete_sale(self.buyer, (self.maize, "300.00"), (self.beans, "200.00"))
+        bulk_transition([order.pk], OrderStatus.COMPLETED)
+
+        self.assertEqual(seller_balance(self.maize.pk), Decimal("300.00"))
+        self.assertEqual(seller_balance(self.beans.pk), Decimal("200.00"))
+        self.assertEqual(LedgerTransaction.objects.count(), 1)
+        # double entry: the sales account is debited what the sellers are credited
+        self.assertEqual(LedgerEntry.objects.aggregate(amount=Sum("amount"))["amount"], 0)
+
+    def test_balance_is_snapshot_plus_tail(self):
+        complete_sale(self.buyer, (self.maize, "300.00"))
+        self.assertEqual(take_snapshots(), 1)
+        complete_sale(self.buyer, (self.maize, "50.00"))
+
+        with self.assertNumQueries(2):
+            self.assertEqual(seller_balance(self.maize.pk), Decimal("350.00"))
+        self.assertEqual(seller_balances(), {self.maize.pk: Decimal("350.00")})
+
+    def test_payout_run_pays_sellers_over_the_minimum(self):
+        complete_sale(self.buyer, (self.maize, "300.00"), (self.beans, "50.00"))
+
+        payouts = run_payouts(Decimal("100.00"))
+
+        self.assertEqual(
+            [(payout.seller_id, payout.amount) for payout in payouts], [(self.maize.pk, Decimal("300.00"))]
+        )
+        self.assertEqual(seller_balances(), {self.maize.pk: Decimal("0.00"), self.beans.pk: Decimal("50.00")})
+        self.assertEqual(run_payouts(Decimal("100.00")), [])
+        self.assertEqual(LedgerEntry.objects.aggregate(amount=Sum("amount"))["amount"], 0)
+
+    def test_snapshot_never_moves_back(self):
+        complete_sale(self.buyer, (self.maize, "300.00"))
+        take_snapshots()
+        complete_sale(self.buyer, (self.maize, "50.00"))
+        upto = SellerBalance.objects.get().upto
+
+        # a server whose clock is behind takes the next snapshot
+        with mock.patch("django.utils.timezone.now", return_value=timezone.now() - timedelta(minutes=10)):
+            self.assertEqual(take_snapshots(), 0)
+
+        self.assertEqual(SellerBalance.objects.get().upto, upto)
+        self.assertEqual(seller_balance(self.maize.pk), owed(self.maize))
+        self.assertEqual(run_payouts(Decimal("1.00"))[0].amount, Decimal("350.00"))
+        self.assertEqual(owed(self.maize), 0)
+
+@skipIf(connection.vendor == "sqlite", "SQLite serializes all writers, concurrency needs a real database")
+@override_settings(SELLER_BALANCE_LAG=60)
+class ConcurrentPayoutTests(TransactionTestCase):
+    RUNS = 6
+
+    def setUp(self):
+        self.buyer = create_user("buyer@example.com", UserRole.CONSUMER)
+        self.sellers = [create_user(f"seller{index}@example.com", UserRole.FARMER) for index in range(4)]
+
+    def test_overlapping_snapshots_and_payouts_never_overpay(self):
+        for seller in self.sellers:
+            complete_sale(self.buyer, (seller, "100.00"))
+        # old enough to be snapshotted, what arrives during the runs stays in the tail
+        LedgerEntry.objects.update(created_at=timezone.now() - timedelta(hours=1))
+        barrier = threading.Barrier(self.RUNS * 2)
+        errors = []
+
+        def run(index):
+            try:
+                barrier.wait()
+                # sales keep coming in while snapshots and payouts overlap
+                complete_sale(self.buyer, (self.sellers[index % len(self.sellers)], "10.00"))
+                if index % 2:
+                    run_payouts(Decimal("1.00"))
+                else:
+                    take_snapshots()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(self.RUNS * 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        credited = Decimal("100.00") * len(self.sellers) + Decimal("10.00") * self.RUNS * 2
+        paid = Payout.objects.aggregate(amount=Sum("amount"))["amount"]
+        balances = seller_balances()
+        self.assertEqual(paid + sum(balances.values()), credited)
+        for seller in self.sellers:
+            self.assertEqual(balances[seller.pk], owed(seller))
+            self.assertGreaterEqual(owed(seller), 0)
@@ -0,0 +1,14 @@
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    # payment providers
+    path('callbacks/<str:method>/', views.PaymentCallbackReceiver.as_view()),
+    path('callbacks/<str:method>/<str:token>/', views.PaymentCallbackReceiver.as_view()),
+    # farmers
+    path('balance/', views.SellerBalanceView.as_view()),
+    # staff
+    path('reconcile/', views.StatementReconciliation.as_view()),
+    path('reconcile/<uuid:pk>/', views.StatementReconciliationDetail.as_view()),
+]
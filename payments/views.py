@@ -1,3 +1,197 @@
-from django.shortcuts import render
+import hashlib
+import hmac
 
-# Create your views here.
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.shortcuts import get_object_or_404
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from rest_framework import status
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from accounts.models import UserRole
+from authentication.permissions import IsFarmer, IsStaff
+
+from .callbacks import receive
+from .ledger import seller_balance
+from .models import PaymentMethod, Reconciliation
+from .reconciliation import start_reconciliation
+from .serializers import ReconciliationSerializer
+
+# what each provider expects back once a callback is safely stored
+ACKNOWLEDGEMENTS = {
+    PaymentMethod.MPESA: {"ResultCode": 0, "ResultDesc": "Accepted"},
+    PaymentMethod.CARD: {"received": True},
+}
+
+
+def verify_mpesa(request, token):
+    """
+    Daraja cannot sign or add headers to callbacks, so the registered URL ends in a secret
+    token, optionally combined with an allowlist of Safaricom addresses.
+    """
+    secret = settings.MPESA_CALLBACK_TOKEN
+    if settings.MPESA_CALLBACK_IPS and request.META.get("REMOTE_ADDR") not in settings.MPESA_CALLBACK_IPS:
+        return False
+    return hmac.compare_digest(token.encode(), secret.encode())
+
+
+def verify_card(request, token):
+    """
+    The card provider signs the raw body with the shared secret, hex HMAC-SHA256 in X-Signature.
+    """
+    secret = settings.CARD_CALLBACK_SECRET
+    signature = hmac.new(secret.encode(), request.body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(request.headers.get("X-Signature", "").lower().encode(), signature.encode())
+
+
+# setting holding the secret of each provider and how its callbacks are authenticated with it
+VERIFIERS = {
+    PaymentMethod.MPESA: ("MPESA_CALLBACK_TOKEN", verify_mpesa),
+    PaymentMethod.CARD: ("CARD_CALLBACK_SECRET", verify_card),
+}
+
+
+class StatementReconciliation(APIView):
+    """
+    Endpoint for finance staff to reconcile an M-Pesa statement against the recorded payments.
+    """
+
+    allowed_methods = ['POST']
+    parser_classes = [MultiPartParser]
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    def get_serializer_class(self):
+        return ReconciliationSerializer
+
+    @extend_schema(
+        request={
+            'multipart/form-data': {
+                'type': 'object',
+                'properties': {'file': {'type': 'string', 'format': 'binary'}},
+                'required': ['file'],
+            }
+        },
+    )
+    def post(self, request):
+        """
+        Queue the reconciliation of an uploaded M-Pesa statement `.csv` export.
+
+        Completed incoming transactions whose receipt number is not recorded yet are added as
+        payments of the order given in the account number column, and the payment status of
+        those orders is updated. The statement is reconciled in the background, the report,
+        listing the rows that cannot be matched, is found at the returned Location.
+        """
+        file = request.FILES.get('file', None)
+        if file is None:
+            return Response({"detail": "No file was uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+
+        reconciliation = start_reconciliation(file, request.user)
+        response = Response(self.get_serializer_class()(reconciliation).data, status=status.HTTP_202_ACCEPTED)
+        response.headers["Location"] = request.build_absolute_uri(f"{reconciliation.pk}/")
+        return response
+
+
+class StatementReconciliationDetail(APIView):
+    """
+    Endpoint to follow a statement reconciliation.
+    """
+
+    allowed_methods = ['GET']
+    permission_classes = [IsAuthenticated, IsStaff]
+
+    def get_serializer_class(self):
+        return ReconciliationSerializer
+
+    def get(self, request, pk):
+        """
+        Get the status of a statement reconciliation, with its report once it is done
+        """
+        reconciliation = get_object_or_404(Reconciliation, pk=pk)
+        serializer = self.get_serializer_class()(reconciliation)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class PaymentCallbackReceiver(APIView):
+    """
+    Webhook for payment providers to confirm MPESA and CARD payments.
+    """
+
+    allowed_methods = ['POST']
+    authentication_classes = []
+    parser_classes = [JSONParser]
+    permission_classes = [AllowAny]
+
+    @extend_schema(request={'application/json': {'type': 'object'}})
+    def post(self, request, method, token=""):
+        """
+        Store a payment confirmation and acknowledge it right away, the payment is applied to
+        its order in the background. Repeated deliveries of a confirmation are acknowledged
+        without doing anything.
+
+        M-Pesa callbacks are posted to `callbacks/mpesa/<token>/`, card callbacks carry an
+        `X-Signature` of their body. Callbacks of a provider whose secret is not configured are
+        refused.
+        """
+        try:
+            method = PaymentMethod(method)
+        except ValueError:
+            method = None
+        if method not in VERIFIERS:
+            return Response({"detail": "Unsupported payment method"}, status=status.HTTP_404_NOT_FOUND)
+
+        setting, verify = VERIFIERS[method]
+        if not getattr(settings, setting):
+            return Response(
+                {"detail": "Callbacks of this payment method are not configured"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        # before anything reads request.data, which consumes the raw body
+        if not verify(request, token):
+            return Response({"detail": "Invalid callback credentials"}, status=status.HTTP_403_FORBIDDEN)
+        if not isinstance(request.data, dict):
+            return Response({"detail": "Expected a JSON object"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            receive(method, request.data)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(ACKNOWLEDGEMENTS[method], status=status.HTTP_200_OK)
+
+
+class SellerBalanceView(APIView):
+    """
+    Endpoint for a farmer to see what they are owed.
+    """
+
+    allowed_methods = ['GET']
+    permission_classes = [IsAuthenticated, IsFarmer | IsStaff]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="seller",
+                type=OpenApiTypes.UUID,
+                required=False,
+                description="Seller to report on, staff only (defaults to the current user)"
+            ),
+        ]
+    )
+    def get(self, request):
+        """
+        Get the balance of completed sales not paid out yet
+        """
+        seller = request.user.pk
+        if request.user.is_staff and 'seller' in request.query_params:
+            seller = request.query_params['seller']
+        elif request.user.role != UserRole.FARMER:
+            return Response({"detail": "Choose a `seller` to report on"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            balance = seller_balance(seller)
+        except DjangoValidationError:
+            return Response({"detail": "`seller` must be a user id"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"seller": seller, "balance": f"{balance:.2f}"}, status=status.HTTP_200_OK)
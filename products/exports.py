@@ -0,0 +1,89 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Product
+
+CSV = "csv"
+NDJSON = "ndjson"
+
+CONTENT_TYPES = {CSV: "text/csv", NDJSON: "application/x-ndjson"}
+
+# (output column, model column) pairs of the export
+COLUMNS = [
+    ("id", "id"),
+    ("name", "name"),
+    ("category", "category"),
+    ("price", "price"),
+    ("stock", "stock"),
+    ("unit", "unit"),
+    ("min_order", "min_order"),
+    ("description", "description"),
+    ("image_thumbnail", "image_thumbnail"),
+    ("image_medium", "image_medium"),
+    ("farmer_id", "seller_id"),
+    ("farmer_name", "seller__name"),
+    ("farmer_location", "seller__location"),
+    ("created_at", "created_at"),
+    ("updated_at", "updated_at"),
+]
+
+CHUNK_SIZE = 2000
+
+# rows are joined into chunks of roughly this many bytes before being handed to the server
+BUFFER_SIZE = 64 * 1024
+
+
+def export_rows():
+    """
+    Every product as a tuple of column values, read through a server-side cursor so that only
+    one chunk of rows is held in memory at a time.
+    """
+    rows = Product.objects.order_by("created_at", "id").values_list(*[column for _, column in COLUMNS])
+    unit = [name for name, _ in COLUMNS].index("unit")
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        row = list(row)
+        row[unit] = row[unit].value
+        yield row
+
+
+def buffered(lines):
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+class _Echo:
+    """
+    File-like object for csv.writer that hands back each line instead of storing it.
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines():
+    writer = csv.writer(_Echo())
+    yield writer.writerow([name for name, _ in COLUMNS])
+    for row in export_rows():
+        yield writer.writerow(row)
+
+
+def ndjson_lines():
+    names = [name for name, _ in COLUMNS]
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for row in export_rows():
+        yield encoder.encode(dict(zip(names, row))) + "\n"
+
+
+def stream_export(output):
+    lines = csv_lines() if output == CSV else ndjson_lines()
+    # send the first line on its own so the client gets a response straight away
+    first = next(lines, "")
+    yield first
+    yield from buffered(lines)
@@ -0,0 +1,107 @@
+import random
+from collections import Counter
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import Product, ProductFacet
+
+CATEGORY = "category"
+UNIT = "unit"
+LOCATION = "location"
+PRICE = "price"
+IN_STOCK = "in_stock"
+
+DIMENSIONS = (CATEGORY, UNIT, LOCATION, PRICE, IN_STOCK)
+
+# rows the count of each value is spread over, see ProductFacet
+SHARDS = 8
+
+# upper bounds of the price bands shown as filter chips, the last band is open ended
+PRICE_BANDS = (Decimal("100"), Decimal("500"), Decimal("1000"), Decimal("5000"), Decimal("10000"))
+
+
+def price_band(price):
+    lower = Decimal("0")
+    for upper in PRICE_BANDS:
+        if price < upper:
+            return f"{lower}-{upper}"
+        lower = upper
+    return f"{lower}+"
+
+
+def facet_values(category, unit, price, stock, location):
+    """
+    The (dimension, value) pairs a single product is counted under.
+    """
+    values = {
+        (UNIT, getattr(unit, "value", unit)),
+        (PRICE, price_band(Decimal(price))),
+        (IN_STOCK, "true" if Decimal(stock) > 0 else "false"),
+    }
+    if category:
+        values.add((CATEGORY, category))
+    if location:
+        values.add((LOCATION, location))
+    return values
+
+
+def diff(before, after):
+    """
+    Count deltas for a product moving from one set of facet values to another.
+    """
+    deltas = Counter()
+    for key in before - after:
+        deltas[key] -= 1
+    for key in after - before:
+        deltas[key] += 1
+    return deltas
+
+
+def apply_deltas(deltas):
+    """
+    Increment the stored counts in place on a randomly picked shard, creating missing facet rows
+    on the fly. Rows are updated in key order so that concurrent writers cannot deadlock.
+    """
+    shard = random.randrange(SHARDS)
+    with transaction.atomic():
+        for (dimension, value), delta in sorted(deltas.items()):
+            if delta == 0:
+                continue
+            facets = ProductFacet.objects.filter(dimension=dimension, value=value, shard=shard)
+            if not facets.update(count=F("count") + delta):
+                ProductFacet.objects.bulk_create(
+                    [ProductFacet(dimension=dimension, value=value, shard=shard)], ignore_conflicts=True
+                )
+                facets.update(count=F("count") + delta)
+
+
+def get_facet_counts():
+    counts = {dimension: {} for dimension in DIMENSIONS}
+    rows = (
+        ProductFacet.objects.order_by().values("dimension", "value").annotate(total=Sum("count"))
+        .filter(total__gt=0).values_list("dimension", "value", "total")
+    )
+    for dimension, value, count in rows:
+        counts.setdefault(dimension, {})[value] = count
+    return counts
+
+
+def rebuild():
+    """
+    Recount every facet from the products table, repairing any drift. The counts start over on
+    a single shard.
+    """
+    deltas = Counter()
+    rows = Product.objects.values_list("category", "unit", "price", "stock", "seller__location")
+    for row in rows.iterator(chunk_size=2000):
+        deltas.update(facet_values(*row))
+
+    with transaction.atomic():
+        ProductFacet.objects.all().delete()
+        ProductFacet.objects.bulk_create(
+            [ProductFacet(dimension=dimension, value=value, count=count)
+             for (dimension, value), count in deltas.items()],
+            batch_size=1000,
+        )
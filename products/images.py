@@ -0,0 +1,78 @@
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from core.tasks import run_in_background
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# bounding boxes of the derivatives, the aspect ratio of the original is kept
+DERIVATIVE_SIZES = {
+    "image_thumbnail": (320, 320),
+    "image_medium": (1024, 1024),
+}
+
+FORMAT_EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg"}
+
+SAVE_OPTIONS = {
+    "WEBP": {"quality": 80, "method": 4},
+    "JPEG": {"quality": 80, "optimize": True, "progressive": True},
+}
+
+
+def schedule_derivatives(product):
+    """
+    Queue the resizing of a freshly uploaded product image on the background worker pool.
+    """
+    run_in_background(generate_derivatives, product.pk)
+
+
+def render(image, size, image_format):
+    copy = image.copy()
+    copy.thumbnail(size, Image.Resampling.LANCZOS)
+    if image_format == "JPEG" or copy.mode not in ("RGB", "RGBA"):
+        copy = copy.convert("RGB")
+
+    buffer = BytesIO()
+    copy.save(buffer, image_format, **SAVE_OPTIONS[image_format])
+    return ContentFile(buffer.getvalue())
+
+
+def generate_derivatives(product_id):
+    product = Product.objects.filter(pk=product_id).only("id", "image", "image_thumbnail", "image_medium").first()
+    if product is None or not product.image:
+        return
+
+    image_format = settings.PRODUCT_IMAGE_FORMAT
+    extension = FORMAT_EXTENSIONS[image_format]
+    largest = max(DERIVATIVE_SIZES.values())
+
+    with product.image.open("rb") as file:
+        image = Image.open(file)
+        # let the JPEG decoder downscale while decoding instead of loading full resolution
+        image.draft("RGB", largest)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    stale = [getattr(product, field).name for field in DERIVATIVE_SIZES if getattr(product, field)]
+    names = {}
+    for field, size in DERIVATIVE_SIZES.items():
+        derivative = getattr(product, field)
+        derivative.save(f"{product.pk}_{size[0]}.{extension}", render(image, size, image_format), save=False)
+        names[field] = derivative.name
+
+    # only attach the derivatives if the image was not replaced while they were being made
+    updated = Product.objects.filter(pk=product.pk, image=product.image.name).update(
+        **names, updated_at=timezone.now()
+    )
+    storage = product.image.storage
+    for name in stale if updated else names.values():
+        storage.delete(name)
+    if not updated:
+        logger.info(f"Product {product.pk} image changed during resizing, derivatives discarded")
@@ -0,0 +1,138 @@
+import csv
+import io
+import json
+
+from django.db import transaction
+from rest_framework import serializers
+
+from .models import Product
+from .serializers import ProductImportSerializer
+from .signals import products_bulk_created
+
+BATCH_SIZE = 500
+
+# stop collecting row errors past this point so a bad file cannot blow up the report
+MAX_REPORTED_ERRORS = 1000
+
+CSV = "csv"
+NDJSON = "ndjson"
+
+FORMATS_BY_EXTENSION = {".csv": CSV, ".ndjson": NDJSON, ".jsonl": NDJSON}
+FORMATS_BY_CONTENT_TYPE = {
+    "text/csv": CSV,
+    "application/x-ndjson": NDJSON,
+    "application/jsonl": NDJSON,
+}
+
+
+def detect_format(file):
+    name = (file.name or "").lower()
+    for extension, file_format in FORMATS_BY_EXTENSION.items():
+        if name.endswith(extension):
+            return file_format
+    return FORMATS_BY_CONTENT_TYPE.get((file.content_type or "").split(";")[0].strip())
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        # treat empty cells as missing so optional columns fall back to their defaults
+        yield {key: value for key, value in row.items() if key and value not in ("", None)}
+
+
+def read_ndjson(stream):
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            yield None
+            continue
+        yield row if isinstance(row, dict) else None
+
+
+READERS = {CSV: read_csv, NDJSON: read_ndjson}
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, row, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "errors": errors})
+
+    @property
+    def data(self):
+        return {
+            "created": self.created,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def check_file(file, file_format):
+    """
+    Read the whole upload once to make sure it decodes and, for CSV, parses, so that a broken
+    file is refused before any of its rows are imported.
+    """
+    stream = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        for _ in csv.reader(stream) if file_format == CSV else stream:
+            pass
+    except UnicodeDecodeError:
+        raise serializers.ValidationError({"file": ["File is not UTF-8 encoded."]})
+    except csv.Error as e:
+        raise serializers.ValidationError({"file": [f"File is not valid CSV: {e}"]})
+    finally:
+        stream.detach()
+        file.seek(0)
+
+
+def import_products(file, file_format, seller):
+    """
+    Validate an uploaded CSV or NDJSON file row by row and insert the valid rows in batches.
+
+    Rows are streamed from the (disk backed) upload, so only one batch is held in memory. Each
+    batch commits on its own, so that an import never holds locks for longer than one batch.
+    Rows are numbered from 1, excluding the CSV header.
+
+    Raises ValidationError for a file that is not UTF-8 or not valid CSV.
+    """
+    check_file(file, file_format)
+    stream = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    validator = ProductImportSerializer()
+    report = ImportReport()
+    batch = []
+
+    for number, row in enumerate(READERS[file_format](stream), start=1):
+        if row is None:
+            report.add_error(number, {"non_field_errors": ["Row is not a valid JSON object."]})
+            continue
+        try:
+            data = validator.run_validation(row)
+        except serializers.ValidationError as e:
+            report.add_error(number, e.detail)
+            continue
+
+        batch.append(Product(seller=seller, **data))
+        if len(batch) >= BATCH_SIZE:
+            report.created += save_batch(batch)
+            batch = []
+
+    if batch:
+        report.created += save_batch(batch)
+
+    stream.detach()
+    return report
+
+
+def save_batch(batch):
+    with transaction.atomic():
+        products = Product.objects.bulk_create(batch)
+        products_bulk_created.send(sender=Product, products=products)
+    return len(products)
@@ -0,0 +1,73 @@
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import facets
+from .models import Product
+from .serializers import ProductInventorySerializer
+
+MAX_ENTRIES = 1000
+
+
+def update_inventory(seller, entries):
+    """
+    Apply many price and stock changes of one seller with a single ownership query and a single
+    bulk UPDATE. Entries that cannot be applied are reported back instead of failing the batch.
+
+    Returns the ids of the updated products and a list of conflicts.
+    """
+    validator = ProductInventorySerializer()
+    conflicts = []
+    changes = {}
+
+    for index, entry in enumerate(entries):
+        try:
+            data = validator.run_validation(entry)
+        except serializers.ValidationError as e:
+            conflicts.append({"index": index, "id": entry.get("id") if isinstance(entry, dict) else None,
+                              "detail": e.detail})
+            continue
+        if data["id"] in changes:
+            conflicts.append({"index": index, "id": data["id"], "detail": "Product is listed more than once."})
+            continue
+        changes[data["id"]] = (index, data)
+
+    now = timezone.now()
+    updated = []
+    deltas = Counter()
+
+    with transaction.atomic():
+        products = Product.objects.select_for_update().filter(pk__in=changes).only(
+            "id", "seller_id", "category", "unit", "price", "stock", "updated_at"
+        )
+        found = {product.pk: product for product in products}
+
+        for product_id, (index, data) in changes.items():
+            product = found.get(product_id)
+            if product is None:
+                conflicts.append({"index": index, "id": product_id, "detail": "Product not found."})
+                continue
+            if product.seller_id != seller.id:
+                conflicts.append({"index": index, "id": product_id, "detail": "You do not sell this product."})
+                continue
+            if "updated_at" in data and data["updated_at"] != product.updated_at:
+                conflicts.append({"index": index, "id": product_id, "detail": "Product was modified since."})
+                continue
+
+            before = facets.facet_values(product.category, product.unit, product.price, product.stock, None)
+            product.price = data.get("price", product.price)
+            product.stock = data.get("stock", product.stock)
+            product.updated_at = now
+            deltas.update(facets.diff(
+                before, facets.facet_values(product.category, product.unit, product.price, product.stock, None)
+            ))
+            updated.append(product)
+
+        if updated:
+            Product.objects.bulk_update(updated, ["price", "stock", "updated_at"])
+            facets.apply_deltas(deltas)
+
+    conflicts.sort(key=lambda conflict: conflict["index"])
+    return [product.pk for product in updated], conflicts
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from products.images import generate_derivatives
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Generate the resized images of products that are missing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Regenerate the images of every product")
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image="")
+        if not options["all"]:
+            products = products.filter(image_thumbnail="")
+
+        count = 0
+        for product_id in products.values_list("id", flat=True).iterator(chunk_size=500):
+            generate_derivatives(product_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Generated images for {count} products"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from products import facets
+
+
+class Command(BaseCommand):
+    help = "Recount the cached catalog facet counts from the products table"
+
+    def handle(self, *args, **options):
+        facets.rebuild()
+        self.stdout.write(self.style.SUCCESS("Product facets rebuilt"))
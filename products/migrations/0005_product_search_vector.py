@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:10
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+from core.operations import PostgreSQLOnly
+
+
+def populate_search_vectors(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(
+        search_vector=(
+            django.contrib.postgres.search.SearchVector('name', weight='A', config='english')
+            + django.contrib.postgres.search.SearchVector('category', weight='B', config='english')
+            + django.contrib.postgres.search.SearchVector('description', weight='C', config='english')
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_created_at_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        PostgreSQLOnly(
+            migrations.AddIndex(
+                model_name='product',
+                index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='products_search_vector_idx'),
+            ),
+        ),
+        PostgreSQLOnly(
+            migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+        ),
+    ]
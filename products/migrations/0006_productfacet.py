@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:11
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def populate_facets(apps, schema_editor):
+    from products.facets import facet_values
+
+    Product = apps.get_model('products', 'Product')
+    ProductFacet = apps.get_model('products', 'ProductFacet')
+
+    counts = Counter()
+    rows = Product.objects.values_list('category', 'unit', 'price', 'stock', 'seller__location')
+    for row in rows.iterator(chunk_size=2000):
+        counts.update(facet_values(*row))
+
+    ProductFacet.objects.bulk_create(
+        [ProductFacet(dimension=dimension, value=value, count=count) for (dimension, value), count in counts.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(max_length=32)),
+                ('value', models.CharField(max_length=255)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['dimension', '-count', 'value'],
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'value'), name='unique_product_facet_value')],
+            },
+        ),
+        migrations.RunPython(populate_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_medium',
+            field=models.ImageField(blank=True, editable=False, upload_to='products/derivatives'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='products/derivatives'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='productfacet',
+            name='unique_product_facet_value',
+        ),
+        migrations.AddField(
+            model_name='productfacet',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='productfacet',
+            constraint=models.UniqueConstraint(fields=('dimension', 'value', 'shard'), name='unique_product_facet_shard'),
+        ),
+    ]
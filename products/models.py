@@ -3,6 +3,8 @@ from enum import Enum
 from uuid import uuid4
 
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
 from enumfields import EnumField
@@ -35,11 +37,43 @@ class Product(models.Model):
     min_order = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
     description = models.TextField()
     image = models.ImageField(upload_to="products")
+    # resized copies of the image, generated in the background after upload (see products.images)
+    image_thumbnail = models.ImageField(upload_to="products/derivatives", blank=True, editable=False)
+    image_medium = models.ImageField(upload_to="products/derivatives", blank=True, editable=False)
     seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name="products")
+    # maintained from name, category and description, see products.search
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         indexes = [
-            models.Index(fields=["name", "category"])
+            models.Index(fields=["name", "category"]),
+            models.Index(fields=["-created_at", "-id"]),
+            models.Index(fields=["updated_at"]),
+            GinIndex(fields=["search_vector"], name="products_search_vector_idx"),
         ]
+
+
+class ProductFacet(models.Model):
+    """
+    Running count of products per filter value, kept up to date on every product write so that
+    the catalog can show its filter options without grouping the whole table on each request.
+
+    The count of a value is split over a few shard rows that writers pick at random, so that
+    checkouts and edits touching a popular value do not all queue up on a single row lock. The
+    count of a value is the sum of its shards.
+    """
+    dimension = models.CharField(max_length=32)
+    value = models.CharField(max_length=255)
+    shard = models.PositiveSmallIntegerField(default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ["dimension", "-count", "value"]
+        constraints = [
+            models.UniqueConstraint(fields=["dimension", "value", "shard"], name="unique_product_facet_shard"),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension}={self.value}#{self.shard} ({self.count})"
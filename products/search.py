@@ -0,0 +1,73 @@
+from functools import reduce
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+
+from .models import Product
+
+SEARCH_CONFIG = "english"
+
+# the stored vector weights matches on the product name above its category and description
+SEARCH_VECTOR = (
+    SearchVector("name", weight="A", config=SEARCH_CONFIG)
+    + SearchVector("category", weight="B", config=SEARCH_CONFIG)
+    + SearchVector("description", weight="C", config=SEARCH_CONFIG)
+)
+
+
+class PostgresSearchEngine:
+    """
+    Ranked full-text search over the stored, GIN indexed `search_vector` column.
+    """
+
+    def search(self, queryset, term):
+        query = SearchQuery(term, search_type="websearch", config=SEARCH_CONFIG)
+        # ts_rank returns a real; widen it so the value round-trips exactly through a page cursor
+        rank = Cast(SearchRank(F("search_vector"), query), FloatField())
+        return queryset.filter(search_vector=query).annotate(rank=rank)
+
+    def update_vectors(self, ids):
+        Product.objects.filter(pk__in=ids).update(search_vector=SEARCH_VECTOR)
+
+
+class BasicSearchEngine:
+    """
+    Fallback for databases without full-text search (e.g. SQLite in tests).
+
+    Every word has to appear in the name, category or description, and the rank mirrors the
+    weights of the PostgreSQL vector.
+    """
+
+    def search(self, queryset, term):
+        words = term.split()
+        if not words:
+            return queryset.none()
+
+        matches = [
+            Q(name__icontains=word) | Q(category__icontains=word) | Q(description__icontains=word)
+            for word in words
+        ]
+        rank = sum(
+            (
+                Case(
+                    When(name__icontains=word, then=Value(1.0)),
+                    When(category__icontains=word, then=Value(0.4)),
+                    default=Value(0.1),
+                    output_field=FloatField(),
+                )
+                for word in words
+            ),
+            Value(0.0, output_field=FloatField()),
+        )
+        return queryset.filter(reduce(lambda left, right: left & right, matches)).annotate(rank=rank)
+
+    def update_vectors(self, ids):
+        pass
+
+
+def get_search_engine():
+    if connection.vendor == "postgresql":
+        return PostgresSearchEngine()
+    return BasicSearchEngine()
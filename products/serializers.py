@@ -1,15 +1,17 @@
+from decimal import Decimal
+
 from django.db import transaction
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
-from core.serializers import EnumField
+from core.serializers import DynamicFieldsMixin, EnumField
 
 from .models import MeasurementUnit, Product
 
 User = get_user_model()
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for reading Product objects
     """
@@ -26,8 +28,28 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = [ 
             "id", "name", "category", "price", "stock", "unit", "min_order", "description", "image",
-            "farmer", "created_at", "updated_at",
+            "image_thumbnail", "image_medium", "farmer", "created_at", "updated_at",
         ]
+        # named field selections that clients can request through `?fields=`
+        projections = {
+            "card": ["id", "name", "price", "unit", "image_thumbnail"],
+        }
+        # the model columns each serializer field reads, for fields that are not plain columns
+        columns = {
+            "farmer": ["seller__id", "seller__name", "seller__location", "seller__updated_at"],
+        }
+
+
+class ProductListSerializer(ProductSerializer):
+    """
+    Serializer for product lists, which only link the resized images and never the original upload
+    """
+    # only present on "near me" lists
+    distance = serializers.FloatField(read_only=True, help_text="Distance to the seller in km")
+
+    class Meta(ProductSerializer.Meta):
+        fields = [field for field in ProductSerializer.Meta.fields if field != "image"] + ["distance"]
+        columns = {**ProductSerializer.Meta.columns, "distance": []}
 
 
 class ProductCreateSerializer(serializers.ModelSerializer):
@@ -41,6 +63,34 @@ class ProductCreateSerializer(serializers.ModelSerializer):
         fields = ["name", "category", "price", "stock", "unit", "min_order", "description", "image"]
     
 
+class ProductImportSerializer(serializers.ModelSerializer):
+    """
+    Serializer for validating the rows of a bulk product import, which carry no image
+    """
+    unit = serializers.ChoiceField(choices=[item.value for item in MeasurementUnit], required=False)
+
+    class Meta:
+        model = Product
+        fields = ["name", "category", "price", "stock", "unit", "min_order", "description"]
+
+
+class ProductInventorySerializer(serializers.Serializer):
+    """
+    Serializer for one entry of a bulk price and stock update
+    """
+    id = serializers.UUIDField()
+    price = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal("0.01"), required=False)
+    stock = serializers.DecimalField(max_digits=13, decimal_places=3, min_value=Decimal("0.000"), required=False)
+    updated_at = serializers.DateTimeField(
+        required=False, help_text="When given, the change is rejected if the product was modified since"
+    )
+
+    def validate(self, attrs):
+        if "price" not in attrs and "stock" not in attrs:
+            raise serializers.ValidationError("Provide a price, a stock or both.")
+        return attrs
+
+
 class ProductUpdateSerializer(serializers.ModelSerializer):
     """
     Serializer for updating Product objects
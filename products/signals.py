@@ -0,0 +1,145 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from . import facets
+from .models import Product
+from .search import get_search_engine
+from .suggest import suggestions
+
+User = get_user_model()
+
+# sent with the list of `products` after a bulk_create, which bypasses the model signals
+products_bulk_created = Signal()
+
+
+@receiver(post_save, sender=Product)
+def update_search_vector(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {"name", "category", "description"} & set(update_fields):
+        return
+    get_search_engine().update_vectors([instance.pk])
+
+
+@receiver(products_bulk_created, sender=Product)
+def update_bulk_search_vectors(sender, products, **kwargs):
+    get_search_engine().update_vectors([product.pk for product in products])
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_product(sender, instance, raw=False, **kwargs):
+    """
+    Keep the stored state of an updated product around for the receivers that index it.
+    """
+    instance._previous_facets = set()
+    instance._previous_seller_location = None
+    instance._previous_suggestions = []
+    if raw or instance._state.adding:
+        return
+
+    previous = Product.objects.filter(pk=instance.pk).values(
+        "name", "category", "unit", "price", "stock", "seller_id", "seller__location"
+    ).first()
+    if previous is not None:
+        instance._previous_suggestions = [previous["name"], previous["category"]]
+        location = previous["seller__location"]
+        instance._previous_facets = facets.facet_values(
+            previous["category"], previous["unit"], previous["price"], previous["stock"], location
+        )
+        if previous["seller_id"] == instance.seller_id:
+            instance._previous_seller_location = location
+
+
+@receiver(post_save, sender=Product)
+def update_product_facets(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    location = getattr(instance, "_previous_seller_location", None)
+    if location is None:
+        location = User.objects.filter(pk=instance.seller_id).values_list("location", flat=True).first()
+    current = facets.facet_values(instance.category, instance.unit, instance.price, instance.stock, location)
+    facets.apply_deltas(facets.diff(getattr(instance, "_previous_facets", set()), current))
+
+
+@receiver(products_bulk_created, sender=Product)
+def update_bulk_product_facets(sender, products, **kwargs):
+    locations = dict(
+        User.objects.filter(pk__in={product.seller_id for product in products}).values_list("id", "location")
+    )
+    deltas = Counter()
+    for product in products:
+        deltas.update(facets.facet_values(
+            product.category, product.unit, product.price, product.stock, locations.get(product.seller_id)
+        ))
+    facets.apply_deltas(deltas)
+
+
+@receiver(post_save, sender=Product)
+def update_suggestions(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    removed = getattr(instance, "_previous_suggestions", [])
+    added = [instance.name, instance.category]
+    if removed != added:
+        transaction.on_commit(lambda: suggestions.update(removed=removed, added=added))
+
+
+@receiver(products_bulk_created, sender=Product)
+def update_bulk_suggestions(sender, products, **kwargs):
+    added = [text for product in products for text in (product.name, product.category)]
+    transaction.on_commit(lambda: suggestions.update(added=added))
+
+
+@receiver(post_delete, sender=Product)
+def remove_suggestions(sender, instance, **kwargs):
+    removed = [instance.name, instance.category]
+    transaction.on_commit(lambda: suggestions.update(removed=removed))
+
+
+@receiver(pre_delete, sender=Product)
+def remember_deleted_product_facets(sender, instance, **kwargs):
+    # the seller may be removed in the same cascade, so read its location before anything is deleted
+    location = User.objects.filter(pk=instance.seller_id).values_list("location", flat=True).first()
+    instance._previous_facets = facets.facet_values(
+        instance.category, instance.unit, instance.price, instance.stock, location
+    )
+
+
+@receiver(post_delete, sender=Product)
+def update_deleted_product_facets(sender, instance, **kwargs):
+    facets.apply_deltas(facets.diff(getattr(instance, "_previous_facets", set()), set()))
+
+
+@receiver(post_init, sender=User)
+def remember_seller_location(sender, instance, **kwargs):
+    """
+    Keep the location a user was loaded with, so that saving it only reads anything back when
+    the location was deferred.
+    """
+    instance._previous_location = instance.__dict__.get("location")
+
+
+@receiver(pre_save, sender=User)
+def load_seller_location(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding or instance._previous_location is not None:
+        return
+    instance._previous_location = User.objects.filter(pk=instance.pk).values_list("location", flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def move_seller_location_facet(sender, instance, created=False, raw=False, **kwargs):
+    previous, instance._previous_location = instance._previous_location, instance.location
+    if raw or created or previous is None or previous == instance.location:
+        return
+
+    count = Product.objects.filter(seller_id=instance.pk).count()
+    if count:
+        deltas = Counter()
+        if previous:
+            deltas[(facets.LOCATION, previous)] -= count
+        if instance.location:
+            deltas[(facets.LOCATION, instance.location)] += count
+        facets.apply_deltas(deltas)
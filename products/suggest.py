@@ -0,0 +1,143 @@
+import heapq
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+from core.tasks import run_in_background
+
+from .models import Product
+
+# candidates looked at per lookup, bounds the cost of one-letter prefixes on a large catalog
+MAX_SCAN = 500
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.casefold().split())
+
+
+class PrefixIndex:
+    """
+    In-memory typeahead index over product names and categories.
+
+    Every suggestion is stored under each of its word suffixes ("white maize" is also found by
+    "maize") in a sorted list, so a lookup is a binary search plus a short forward scan. The
+    index is kept current by the product signals of this process and rebuilt from the database
+    every PRODUCT_SUGGEST_REFRESH seconds to pick up writes made by other processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # held for the first build, so that the requests arriving before it wait for that one
+        # instead of each reading the whole catalog
+        self._build_lock = threading.Lock()
+        self._keys = []
+        self._entries = {}
+        self._built_at = None
+        self._rebuilding = False
+
+    @staticmethod
+    def _suffixes(normalized):
+        words = normalized.split(" ")
+        return [" ".join(words[index:]) for index in range(len(words))]
+
+    def _add(self, text):
+        normalized = normalize(text)
+        if not normalized:
+            return
+        entry = self._entries.get(normalized)
+        if entry is not None:
+            entry[1] += 1
+            return
+        self._entries[normalized] = [text.strip(), 1]
+        for key in self._suffixes(normalized):
+            insort(self._keys, (key, normalized))
+
+    def _remove(self, text):
+        normalized = normalize(text)
+        entry = self._entries.get(normalized)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del self._entries[normalized]
+        for key in self._suffixes(normalized):
+            index = bisect_left(self._keys, (key, normalized))
+            if index < len(self._keys) and self._keys[index] == (key, normalized):
+                del self._keys[index]
+
+    def update(self, removed=(), added=()):
+        with self._lock:
+            if self._built_at is None:
+                return
+            for text in removed:
+                self._remove(text)
+            for text in added:
+                self._add(text)
+
+    def build(self):
+        keys, entries = [], {}
+        rows = Product.objects.values_list("name", "category")
+        for name, category in rows.iterator(chunk_size=5000):
+            for text in (name, category):
+                normalized = normalize(text)
+                if not normalized:
+                    continue
+                if normalized in entries:
+                    entries[normalized][1] += 1
+                else:
+                    entries[normalized] = [text.strip(), 1]
+                    keys.extend((key, normalized) for key in self._suffixes(normalized))
+        keys.sort()
+
+        with self._lock:
+            self._keys, self._entries = keys, entries
+            self._built_at = time.monotonic()
+
+    def _refresh(self):
+        try:
+            self.build()
+        finally:
+            self._rebuilding = False
+
+    def ensure_fresh(self):
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self.build()
+            return
+
+        with self._lock:
+            stale = time.monotonic() - self._built_at > settings.PRODUCT_SUGGEST_REFRESH
+            if not stale or self._rebuilding:
+                return
+            self._rebuilding = True
+        # keep answering from the current index while the new one is built
+        run_in_background(self._refresh)
+
+    def search(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        self.ensure_fresh()
+        with self._lock:
+            matches = {}
+            index = bisect_left(self._keys, (prefix,))
+            while index < len(self._keys) and len(matches) < MAX_SCAN:
+                key, normalized = self._keys[index]
+                if not key.startswith(prefix):
+                    break
+                matches[normalized] = self._entries[normalized]
+                index += 1
+
+            best = heapq.nsmallest(limit, matches.items(), key=lambda item: (-item[1][1], item[0]))
+            return [{"text": text, "count": count} for _, (text, count) in best]
+
+
+suggestions = PrefixIndex()
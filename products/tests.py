@@ -1,3 +1,574 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+
+from accounts.models import User, UserRole
+from core.testing import create_product, create_user
+
+from . import facets
+from .images import generate_derivatives, render
+from .models import Product, ProductFacet
+from .suggest import PrefixIndex
+
+
+class ProductListValidatorTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.farmer = create_user("farmer@example.com", UserRole.FARMER)
+        self.maize = create_product(self.farmer, "Maize", "10")
+
+    def revalidate(self, etag):
+        return self.client.get("/api/products/", HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_page_is_not_modified(self):
+        etag = self.client.get("/api/products/").headers["ETag"]
+
+        self.assertEqual(self.revalidate(etag).status_code, 304)
+
+    def test_seller_change_invalidates_the_page(self):
+        etag = self.client.get("/api/products/").headers["ETag"]
+        self.farmer.location = "Eldoret"
+        self.farmer.save()
+
+        response = self.revalidate(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["farmer"]["location"], "Eldoret")
+
+    def test_product_change_invalidates_the_page(self):
+        etag = self.client.get("/api/products/").headers["ETag"]
+        self.maize.price = Decimal("120.00")
+        self.maize.save()
+
+        self.assertEqual(self.revalidate(etag).status_code, 200)
+
+
+class ProductPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        farmer = create_user("farmer@example.com", UserRole.FARMER)
+        self.products = [create_product(farmer, f"Product {index}", "10") for index in range(7)]
+        # ties on created_at are broken by the id
+        Product.objects.filter(pk__in=[product.pk for product in self.products[2:5]]).update(
+            created_at=self.products[2].created_at
+        )
+
+    def walk(self, url):
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            names += [product["name"] for product in response.json()["results"]]
+            url = response.json()["next"]
+        return names
+
+    def test_pages_cover_the_list_newest_first(self):
+        newest_first = Product.objects.order_by("-created_at", "-id").values_list("name", flat=True)
+
+        self.assertEqual(self.walk("/api/products/?page_size=2"), list(newest_first))
+
+    def test_products_added_while_paging_do_not_shift_later_pages(self):
+        first = self.client.get("/api/products/?page_size=3").json()
+        create_product(self.products[0].seller, "Latecomer", "10")
+
+        rest = self.walk(first["next"])
+
+        names = [product["name"] for product in first["results"]] + rest
+        self.assertEqual(len(names), 7)
+        self.assertNotIn("Latecomer", names)
+
+    def test_pages_deep_in_the_list_take_as_many_queries(self):
+        url = "/api/products/?page_size=1"
+        for _ in range(5):
+            url = self.client.get(url).json()["next"]
+
+        with self.assertNumQueries(2):
+            self.client.get("/api/products/?page_size=1")
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get("/api/products/?cursor=bm90IGEgY3Vyc29y").status_code, 404)
+        self.assertEqual(self.client.get("/api/products/?cursor=!!").status_code, 404)
+
+
+class ProductFieldsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.maize = create_product(create_user("farmer@example.com", UserRole.FARMER), "Maize", "10")
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        product_query = next(query["sql"] for query in queries if '"products_product"' in query["sql"])
+        return response.json(), product_query
+
+    def test_card_projection_reads_only_its_columns(self):
+        data, sql = self.get("/api/products/?fields=card")
+
+        self.assertEqual(set(data["results"][0]), {"id", "name", "price", "unit", "image_thumbnail"})
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn("accounts_user", sql)
+
+    def test_farmer_field_joins_the_seller(self):
+        data, sql = self.get("/api/products/?fields=name,farmer,unknown")
+
+        self.assertEqual(data["results"][0], {"name": "Maize", "farmer": {
+            "id": str(self.maize.seller_id), "name": self.maize.seller.name, "location": "Nakuru",
+        }})
+        self.assertIn("accounts_user", sql)
+        self.assertNotIn('"price"', sql)
+
+    def test_detail_takes_the_same_fields(self):
+        data, sql = self.get(f"/api/products/{self.maize.pk}/?fields=name,stock")
+
+        self.assertEqual(data, {"name": "Maize", "stock": "10.000"})
+        self.assertNotIn('"description"', sql)
+
+    def test_unknown_fields_alone_return_everything(self):
+        data, _ = self.get("/api/products/?fields=unknown")
+
+        self.assertIn("description", data["results"][0])
+        self.assertNotIn("image", data["results"][0])
+
+
+class ProductSearchTests(TestCase):
+    """
+    Runs against the search engine of the database under test, full-text search on PostgreSQL
+    and the fallback elsewhere.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        farmer = create_user("farmer@example.com", UserRole.FARMER)
+        for name, category, description in (
+            ("Beans", "legumes", "Grown between the maize"),
+            ("Unga", "maize", "Milled flour"),
+            ("White maize", "cereals", "Dried white maize"),
+            ("Rice", "cereals", "Long grain"),
+        ):
+            create_product(farmer, name, "10", category=category, description=description)
+
+    def search(self, query):
+        response = self.client.get(f"/api/products/?{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return [product["name"] for product in response.json()["results"]]
+
+    def test_name_matches_rank_above_category_and_description(self):
+        self.assertEqual(self.search("q=maize"), ["White maize", "Unga", "Beans"])
+
+    def test_every_word_has_to_match(self):
+        self.assertEqual(self.search("q=white+maize"), ["White maize"])
+        self.assertEqual(self.search("q=wheat"), [])
+
+    def test_filters_apply_to_the_matches(self):
+        self.assertEqual(self.search("q=maize&category=cereals"), ["White maize"])
+        self.assertEqual(self.search("q=maize&in_stock=true&fields=name"), ["White maize", "Unga", "Beans"])
+
+    def test_pages_follow_the_ranking(self):
+        names, url = [], "/api/products/?q=maize&page_size=1"
+        while url:
+            page = self.client.get(url).json()
+            names += [product["name"] for product in page["results"]]
+            url = page["next"]
+
+        self.assertEqual(names, ["White maize", "Unga", "Beans"])
+
+    def test_renamed_product_is_found_by_its_new_name(self):
+        product = Product.objects.get(name="Rice")
+        product.name = "Pishori rice"
+        product.save()
+
+        self.assertEqual(self.search("q=pishori"), ["Pishori rice"])
+
+
+class NearbyProductTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        # (name, latitude, longitude) of sellers around Nakuru, about 16, 6 and 35 km away
+        for name, latitude, longitude in (
+            ("Njoro", -0.3300, 35.9400), ("Lanet", -0.2900, 36.1300), ("Gilgil", -0.4970, 36.3230),
+        ):
+            seller = create_user(f"{name.lower()}@example.com", UserRole.FARMER)
+            seller.latitude, seller.longitude = latitude, longitude
+            seller.save()
+            create_product(seller, f"{name} maize", "10")
+        create_product(create_user("unknown@example.com", UserRole.FARMER), "Unplaced maize", "10")
+
+    def get(self, query):
+        return self.client.get(f"/api/products/?{query}")
+
+    def test_products_within_the_radius_come_nearest_first(self):
+        response = self.get("near=-0.3031,36.0800&radius=20&fields=name,distance")
+
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()["results"]
+        self.assertEqual([product["name"] for product in results], ["Lanet maize", "Njoro maize"])
+        self.assertAlmostEqual(results[0]["distance"], 5.75, places=2)
+        self.assertAlmostEqual(results[1]["distance"], 15.85, places=2)
+
+        names = [product["name"] for product in self.get("near=-0.3031,36.0800&radius=100").json()["results"]]
+        self.assertEqual(names, ["Lanet maize", "Njoro maize", "Gilgil maize"])
+
+    def test_invalid_location_is_refused(self):
+        for query, field in (
+            ("near=91,0", "near"), ("near=0,181", "near"), ("near=nakuru", "near"), ("near=1,2,3", "near"),
+            ("near=nan,0", "near"), ("near=0,0&radius=-5", "radius"), ("near=0,0&radius=far", "radius"),
+            ("radius=10", "radius"), ("fields=name,distance", "fields"),
+        ):
+            with self.subTest(query=query):
+                response = self.get(query)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(list(response.json()), [field])
+
+
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.nakuru = create_user("nakuru@example.com", UserRole.FARMER)
+        self.eldoret = create_user("eldoret@example.com", UserRole.FARMER, location="Eldoret")
+        self.maize = create_product(self.nakuru, "Maize", "10")
+        create_product(self.nakuru, "Beans", "0")
+        create_product(self.eldoret, "Millet", "5")
+
+    def get_facets(self, query=""):
+        return self.client.get(f"/api/products/{query}").json()["facets"]
+
+    def test_counts_cover_the_catalog(self):
+        counts = self.get_facets()
+
+        self.assertEqual(counts["category"], {"cereals": 3})
+        self.assertEqual(counts["location"], {"Nakuru": 2, "Eldoret": 1})
+        self.assertEqual(counts["in_stock"], {"true": 2, "false": 1})
+        self.assertEqual(counts["price"], {"100-500": 3})
+        # the filter options do not narrow down with the active filters
+        self.assertEqual(self.get_facets("?location=Nakuru"), counts)
+
+    def test_counts_follow_product_writes(self):
+        self.maize.stock = Decimal("0")
+        self.maize.price = Decimal("600.00")
+        self.maize.save()
+        Product.objects.get(name="Millet").delete()
+
+        counts = self.get_facets()
+        self.assertEqual(counts["location"], {"Nakuru": 2})
+        self.assertEqual(counts["in_stock"], {"false": 2})
+        self.assertEqual(counts["price"], {"100-500": 1, "500-1000": 1})
+
+    def test_counts_follow_the_seller_location(self):
+        seller = User.objects.get(pk=self.nakuru.pk)
+        seller.location = "Naivasha"
+        seller.save()
+        # saved again without a change
+        seller.save()
+
+        self.assertEqual(self.get_facets()["location"], {"Naivasha": 2, "Eldoret": 1})
+
+    def test_seller_update_does_not_read_back_the_location(self):
+        seller = User.objects.get(pk=self.nakuru.pk)
+        seller.name = "Nakuru Farm"
+
+        with self.assertNumQueries(1):
+            seller.save()
+
+    def test_deferred_location_is_read_back(self):
+        seller = User.objects.only("id").get(pk=self.nakuru.pk)
+        seller.location = "Naivasha"
+        seller.save()
+
+        self.assertEqual(self.get_facets()["location"], {"Naivasha": 2, "Eldoret": 1})
+
+    def test_counts_are_summed_over_their_shards(self):
+        counts = facets.get_facet_counts()
+        for shard in range(facets.SHARDS):
+            with mock.patch("products.facets.random.randrange", return_value=shard):
+                facets.apply_deltas({(facets.CATEGORY, "legumes"): 1})
+
+        self.assertEqual(ProductFacet.objects.filter(value="legumes").count(), facets.SHARDS)
+        self.assertEqual(facets.get_facet_counts()["category"], {"cereals": 3, "legumes": facets.SHARDS})
+
+        # the rebuild drops the drift and folds the shards
+        facets.rebuild()
+        self.assertEqual(facets.get_facet_counts(), counts)
+        self.assertEqual(set(ProductFacet.objects.values_list("shard", flat=True)), {0})
+
+
+@skipIf(connection.vendor == "sqlite", "SQLite serializes all writers, concurrency needs a real database")
+class ConcurrentProductFacetTests(TransactionTestCase):
+    WRITERS = 20
+
+    def test_concurrent_sell_outs_keep_the_counts(self):
+        farmer = create_user("farmer@example.com", UserRole.FARMER)
+        products = [create_product(farmer, f"Product {index}", "10") for index in range(self.WRITERS)]
+        barrier = threading.Barrier(self.WRITERS)
+        errors = []
+
+        def sell_out(product):
+            try:
+                barrier.wait()
+                # every writer moves the same two in-stock values
+                product.stock = Decimal("0")
+                product.save()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=sell_out, args=(product,)) for product in products]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        counts = facets.get_facet_counts()
+        self.assertEqual(counts["in_stock"], {"false": self.WRITERS})
+        facets.rebuild()
+        self.assertEqual(facets.get_facet_counts(), counts)
+
+
+class PrefixIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = PrefixIndex()
+        with mock.patch.object(Product.objects, "values_list") as rows:
+            rows.return_value.iterator.return_value = [
+                ("White maize", "Cereals"), ("Maize flour", "Flour"), ("Yellow maize", "Cereals"),
+                ("Mango", "Fruits"),
+            ]
+            self.index.build()
+
+    def texts(self, prefix):
+        return [result["text"] for result in self.index.search(prefix)]
+
+    def test_prefix_matches_any_word_most_listed_first(self):
+        self.assertEqual(self.texts("ma"), ["Maize flour", "Mango", "White maize", "Yellow maize"])
+        self.assertEqual(self.texts("  MAÏZE f"), ["Maize flour"])
+        self.assertEqual(self.texts("cer"), ["Cereals"])
+        self.assertEqual(self.index.search("cer"), [{"text": "Cereals", "count": 2}])
+        self.assertEqual(self.texts("aize"), [])
+        self.assertEqual(self.texts(" "), [])
+
+    def test_updates_count_repeated_texts(self):
+        self.index.update(added=["Mango", "Green mango"])
+        self.assertEqual(
+            self.index.search("mango"), [{"text": "Mango", "count": 2}, {"text": "Green mango", "count": 1}]
+        )
+
+        self.index.update(removed=["mango", "Green mango"])
+        self.assertEqual(self.index.search("mango"), [{"text": "Mango", "count": 1}])
+        self.assertEqual(self.texts("green"), [])
+
+        self.index.update(removed=["Mango", "Mango", "Unknown"])
+        self.assertEqual(self.texts("man"), [])
+        self.assertNotIn("mango", {normalized for _, normalized in self.index._keys})
+
+    def test_cold_index_is_built_once_for_concurrent_lookups(self):
+        index = PrefixIndex()
+        builds = []
+        barrier = threading.Barrier(8)
+
+        def build():
+            builds.append(1)
+            time.sleep(0.05)
+            index._built_at = time.monotonic()
+
+        def search():
+            barrier.wait()
+            index.search("maize")
+
+        with mock.patch.object(index, "build", side_effect=build):
+            threads = [threading.Thread(target=search) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(builds), 1)
+
+
+class ProductSuggestTests(TestCase):
+    def setUp(self):
+        index = PrefixIndex()
+        for target in ("products.views.suggestions", "products.signals.suggestions"):
+            patcher = mock.patch(target, index)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.maize = create_product(create_user("farmer@example.com", UserRole.FARMER), "White maize", "10")
+
+    def suggest(self, prefix):
+        response = self.client.get(f"/api/products/suggest/?prefix={prefix}")
+        return [result["text"] for result in response.json()["results"]]
+
+    def test_suggestions_follow_product_writes(self):
+        self.assertEqual(self.suggest("mai"), ["White maize"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.maize.name = "Yellow maize"
+            self.maize.save()
+        self.assertEqual(self.suggest("mai"), ["Yellow maize"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.maize.delete()
+        self.assertEqual(self.suggest("mai"), [])
+        self.assertEqual(self.suggest("cer"), [])
+
+
+class ProductInventoryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.farmer = create_user("farmer@example.com", UserRole.FARMER)
+        self.client.force_authenticate(self.farmer)
+        self.maize = create_product(self.farmer, "Maize", "10")
+        self.beans = create_product(self.farmer, "Beans", "10")
+
+    def patch(self, entries):
+        return self.client.patch("/api/products/inventory/", entries, format="json")
+
+    def test_changes_are_applied_and_conflicts_reported(self):
+        other = create_product(create_user("other@example.com", UserRole.FARMER), "Rice", "10")
+        version = self.beans.updated_at.isoformat()
+        self.beans.save()
+
+        response = self.patch([
+            {"id": str(self.maize.pk), "price": "120.00", "stock": "0"},
+            {"id": str(self.beans.pk), "stock": "5", "updated_at": version},
+            {"id": str(other.pk), "stock": "0"},
+            {"id": str(self.maize.pk), "stock": "1"},
+            {"id": "00000000-0000-0000-0000-000000000000", "stock": "1"},
+            {"id": str(self.maize.pk)},
+        ])
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()["updated"], [str(self.maize.pk)])
+        self.assertEqual([conflict["index"] for conflict in response.json()["conflicts"]], [1, 2, 3, 4, 5])
+        self.maize.refresh_from_db()
+        self.assertEqual((self.maize.price, self.maize.stock), (Decimal("120.00"), Decimal("0.000")))
+        for product in (self.beans, other):
+            product.refresh_from_db()
+            self.assertEqual(product.stock, Decimal("10.000"))
+
+    def test_facet_counts_follow_the_changes(self):
+        self.patch([{"id": str(self.maize.pk), "stock": "0"}, {"id": str(self.beans.pk), "price": "600"}])
+
+        counts = facets.get_facet_counts()
+        self.assertEqual(counts["in_stock"], {"true": 1, "false": 1})
+        self.assertEqual(counts["price"], {"100-500": 1, "500-1000": 1})
+
+    @mock.patch("products.facets.random.randrange", return_value=0)
+    def test_changes_take_a_fixed_number_of_queries(self, randrange):
+        # every count row the changes touch already exists, on the one shard in use
+        create_product(self.farmer, "Sold out", "0")
+        entries = [{"id": str(create_product(self.farmer, f"Product {index}", "10").pk), "stock": "0"}
+                   for index in range(20)]
+
+        for size in (1, 20):
+            with self.subTest(size=size), self.assertNumQueries(8):
+                self.patch(entries[:size])
+
+    def test_empty_or_oversized_batches_are_refused(self):
+        self.assertEqual(self.patch([]).status_code, 400)
+        self.assertEqual(self.patch([{"id": str(self.maize.pk), "stock": "1"}] * 1001).status_code, 400)
+
+
+def jpeg(size):
+    buffer = BytesIO()
+    Image.new("RGB", size, "green").save(buffer, "JPEG")
+    return SimpleUploadedFile("maize.jpg", buffer.getvalue(), content_type="image/jpeg")
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True, PRODUCT_IMAGE_FORMAT="WEBP")
+class ProductImageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.enterClassContext(override_settings(MEDIA_ROOT=cls.media_root))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(create_user("farmer@example.com", UserRole.FARMER))
+
+    def create(self):
+        data = {
+            "name": "Maize", "category": "cereals", "price": "100.00", "stock": "10", "unit": "kg",
+            "description": "Dry maize", "image": jpeg((2000, 1000)),
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/products/", data, format="multipart")
+        self.assertEqual(response.status_code, 201, response.content)
+        return Product.objects.get()
+
+    def test_upload_gets_resized_copies_in_the_background(self):
+        product = self.create()
+
+        for field, bounds in (("image_thumbnail", (320, 160)), ("image_medium", (1024, 512))):
+            with getattr(product, field).open("rb") as file, Image.open(file) as image:
+                self.assertEqual((image.format, image.size), ("WEBP", bounds))
+
+        listed = self.client.get("/api/products/").json()["results"][0]
+        self.assertTrue(listed["image_thumbnail"].endswith(".webp"))
+        self.assertNotIn("image", listed)
+
+    def test_copies_of_a_replaced_image_are_discarded(self):
+        product = self.create()
+        copies = sorted([product.image_thumbnail.name, product.image_medium.name])
+
+        def replace_then_render(*args):
+            Product.objects.filter(pk=product.pk).update(image="products/other.jpg")
+            return render(*args)
+
+        with mock.patch("products.images.render", side_effect=replace_then_render):
+            generate_derivatives(product.pk)
+
+        product.refresh_from_db()
+        self.assertEqual(sorted([product.image_thumbnail.name, product.image_medium.name]), copies)
+        _, files = product.image.storage.listdir("products/derivatives")
+        self.assertEqual(sorted(f"products/derivatives/{name}" for name in files), copies)
+
+
+class ProductImportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(create_user("farmer@example.com", UserRole.FARMER))
+
+    def upload(self, content):
+        file = SimpleUploadedFile("products.csv", content, content_type="text/csv")
+        return self.client.post("/api/products/import/", {"file": file}, format="multipart")
+
+    def test_valid_rows_are_created_in_batches(self):
+        rows = "".join(f"Maize {index},cereals,100,{index},kg,1,Dry maize\n" for index in range(1200))
+        response = self.upload(f"name,category,price,stock,unit,min_order,description\n{rows}".encode())
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()["created"], 1200)
+        self.assertEqual(Product.objects.count(), 1200)
+
+    def test_file_that_is_not_utf8_is_refused(self):
+        response = self.upload("name,category\nCaf\u00e9,cereals\n".encode("latin-1"))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"file": ["File is not UTF-8 encoded."]})
+
+    def test_malformed_csv_is_refused_before_anything_is_imported(self):
+        content = f"name,category,price,stock,description\nMaize,cereals,100,1,Dry\nBeans,x,1,1,{'x' * 200000}\n"
+        response = self.upload(content.encode())
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("file", response.json())
+        self.assertFalse(Product.objects.exists())
@@ -4,5 +4,9 @@ from . import views
 
 urlpatterns = [
     path('', views.ProductList.as_view()),
+    path('export/', views.ProductExport.as_view()),
+    path('import/', views.ProductImport.as_view()),
+    path('suggest/', views.ProductSuggest.as_view()),
+    path('inventory/', views.ProductInventory.as_view()),
     path('<uuid:pk>/', views.ProductDetail.as_view()),
 ]
@@ -1,23 +1,80 @@
+from decimal import Decimal, InvalidOperation
+
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import status
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from rest_framework import serializers, status
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from accounts.geo import cells_within, distance_km
 from authentication.permissions import IsSeller, IsFarmer
+from core.conditional import conditional_response, make_etag, set_validators
+from core.pagination import KeysetPagination
+
+from .exports import CONTENT_TYPES, NDJSON, stream_export
+from .facets import get_facet_counts
+from .images import schedule_derivatives
+from .imports import detect_format, import_products
+from .inventory import MAX_ENTRIES, update_inventory
+from .models import MeasurementUnit, Product
+from .search import get_search_engine
+from .serializers import (
+    ProductSerializer, ProductCreateSerializer, ProductInventorySerializer, ProductListSerializer,
+    ProductUpdateSerializer,
+)
+from .suggest import suggestions
+
+
+DEFAULT_RADIUS_KM = 25
+
+MAX_RADIUS_KM = 100
+
+
+class ProductFieldsMixin:
+    """
+    Support for `?fields=` on product views: a comma separated list of fields, or the name of a
+    projection such as `card`, that limits both the response and the columns that are queried.
+    """
+
+    def get_requested_fields(self):
+        serializer_class = self.get_serializer_class()
+        requested = self.request.query_params.get('fields', '')
+        meta = serializer_class.Meta
 
-from .models import Product
-from .serializers import ProductSerializer, ProductCreateSerializer, ProductUpdateSerializer
+        if requested in meta.projections:
+            return meta.projections[requested]
 
+        fields = [field for field in requested.split(',') if field in meta.fields]
+        return fields or None
 
-class ProductList(APIView):
+    def project(self, products, fields, required=()):
+        """
+        Restrict the queryset to the columns the requested fields need, joining the seller only
+        when the `farmer` field is part of them.
+        """
+        if fields is None:
+            return products.select_related("seller").defer("search_vector")
+
+        columns = {"id", *required}
+        for field in fields:
+            columns.update(self.get_serializer_class().Meta.columns.get(field, [field]))
+        if "farmer" in fields:
+            products = products.select_related("seller")
+        return products.only(*columns)
+
+
+class ProductList(ProductFieldsMixin, APIView):
     """
     Endpoint to handle both fetching all products and creating a new product.
     """
 
     allowed_methods = ['GET', 'POST']
     parser_classes = [FormParser, MultiPartParser]
+    pagination_class = KeysetPagination
 
     def get_permissions(self):
         if self.request.method == 'POST':
@@ -27,15 +84,195 @@ class ProductList(APIView):
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return ProductCreateSerializer
-        return ProductSerializer
+        return ProductListSerializer
 
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="q",
+                type=OpenApiTypes.STR,
+                required=False,
+                description="Search products by name, category and description, best matches first"
+            ),
+            OpenApiParameter(
+                name="category",
+                type=OpenApiTypes.STR,
+                required=False,
+                description="Filter products by category"
+            ),
+            OpenApiParameter(
+                name="min_price",
+                type=OpenApiTypes.DECIMAL,
+                required=False,
+                description="Only include products priced at or above this amount"
+            ),
+            OpenApiParameter(
+                name="max_price",
+                type=OpenApiTypes.DECIMAL,
+                required=False,
+                description="Only include products priced below this amount"
+            ),
+            OpenApiParameter(
+                name="unit",
+                type=OpenApiTypes.STR,
+                required=False,
+                description=f"Filter products by unit. Options: {', '.join([unit.value for unit in MeasurementUnit])}"
+            ),
+            OpenApiParameter(
+                name="location",
+                type=OpenApiTypes.STR,
+                required=False,
+                description="Filter products by the seller's location"
+            ),
+            OpenApiParameter(
+                name="in_stock",
+                type=OpenApiTypes.BOOL,
+                required=False,
+                description="Only include products that are in stock (true/false)"
+            ),
+            OpenApiParameter(
+                name="near",
+                type=OpenApiTypes.STR,
+                required=False,
+                description="`latitude,longitude` of the buyer, lists products of sellers within `radius` nearest first"
+            ),
+            OpenApiParameter(
+                name="radius",
+                type=OpenApiTypes.NUMBER,
+                required=False,
+                description=f"Search radius in km for `near` (default {DEFAULT_RADIUS_KM}, max {MAX_RADIUS_KM})"
+            ),
+            OpenApiParameter(
+                name="fields",
+                type=OpenApiTypes.STR,
+                required=False,
+                description="Comma separated list of fields to include, or `card` for the fields of a product tile"
+            ),
+            OpenApiParameter(
+                name="cursor",
+                type=OpenApiTypes.STR,
+                required=False,
+                description="Opaque cursor taken from the `next` link of the previous page"
+            ),
+            OpenApiParameter(
+                name="page_size",
+                type=OpenApiTypes.INT,
+                required=False,
+                description=f"Number of products per page (max {KeysetPagination.max_page_size})"
+            ),
+        ]
+    )
     def get(self, request):
         """
-        Get the product list
+        Get a page of the product list, newest first or by relevance when searching,
+        along with the product counts for every filter option
+        """
+        fields = self.get_requested_fields()
+        paginator = self.pagination_class()
+
+        # keep the cursor and version columns loaded whatever fields were asked for
+        products = self.project(Product.objects.all(), fields, required=["created_at", "updated_at"])
+        products = self.filter_queryset(products)
+
+        query = request.query_params.get('q', '').strip()
+        if query:
+            products = get_search_engine().search(products, query)
+            paginator = self.pagination_class(ordering=("-rank", "-id"))
+
+        near = self.get_location()
+        if near is None and fields and "distance" in fields:
+            raise serializers.ValidationError({"fields": ["`distance` is only available together with `near`."]})
+        if near is not None:
+            products = self.filter_nearby(products, *near)
+            paginator = self.pagination_class(ordering=("distance", "id"))
+
+        page = paginator.paginate_queryset(products, request, view=self)
+        facets = get_facet_counts()
+
+        # the version of exactly what is returned: the page rows, their sellers and the facets
+        etag = make_etag("products", request.get_full_path(), facets, *[
+            (product.pk, product.updated_at, product.seller.updated_at if Product.seller.is_cached(product) else None)
+            for product in page
+        ])
+        not_modified = conditional_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        serializer = self.get_serializer_class()(page, many=True, fields=fields)
+        response = paginator.get_paginated_response(serializer.data)
+        response.data["facets"] = facets
+        return set_validators(response, etag)
+
+    def get_location(self):
+        """
+        The `(latitude, longitude, radius)` of a "near me" request, or None without `near`.
+        Raises ValidationError for a `near` or `radius` that is not a coordinate or distance, rather
+        than serving the whole catalog in their place.
+        """
+        params = self.request.query_params
+        if 'near' not in params:
+            if 'radius' in params:
+                raise serializers.ValidationError({"radius": ["`radius` is only used together with `near`."]})
+            return None
+
+        try:
+            latitude, longitude = (float(value) for value in params['near'].split(','))
+        except ValueError:
+            raise serializers.ValidationError({"near": ["Expected `latitude,longitude` in degrees."]})
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise serializers.ValidationError(
+                {"near": ["Latitude must be between -90 and 90, longitude between -180 and 180."]}
+            )
+
+        try:
+            radius = float(params.get('radius', DEFAULT_RADIUS_KM))
+        except ValueError:
+            radius = None
+        if radius is None or not radius > 0:
+            raise serializers.ValidationError({"radius": ["Expected a distance in km greater than 0."]})
+        return latitude, longitude, min(radius, MAX_RADIUS_KM)
+
+    def filter_nearby(self, products, latitude, longitude, radius):
         """
-        products = Product.objects.all()
-        serializer = self.get_serializer_class()(products, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        Narrow the products down to sellers in the grid cells around the point through the
+        indexed cell column, then compute exact distances for that small set only.
+        """
+        distance = distance_km("seller__latitude", "seller__longitude", latitude, longitude)
+        return (
+            products.filter(seller__geocell__in=cells_within(latitude, longitude, radius))
+            .annotate(distance=distance)
+            .filter(distance__lte=radius)
+        )
+
+    def filter_queryset(self, products):
+        params = self.request.query_params
+
+        category = params.get('category', None)
+        if category:
+            products = products.filter(category=category)
+
+        # Filter by price range if provided, ignoring values that are not numbers
+        for param, lookup in (('min_price', 'price__gte'), ('max_price', 'price__lt')):
+            try:
+                price = Decimal(params.get(param, ''))
+            except InvalidOperation:
+                continue
+            if price.is_finite():
+                products = products.filter(**{lookup: price})
+
+        unit = params.get('unit', None)
+        if unit is not None and unit in [choice.value for choice in MeasurementUnit]:
+            products = products.filter(unit=MeasurementUnit(unit))
+
+        location = params.get('location', None)
+        if location:
+            products = products.filter(seller__location=location)
+
+        in_stock = params.get('in_stock', None)
+        if in_stock is not None and in_stock.lower() in ["true", "1", "yes"]:
+            products = products.filter(stock__gt=0)
+
+        return products
 
     def post(self, request):
         """
@@ -43,12 +280,155 @@ class ProductList(APIView):
         """
         serializer = self.get_serializer_class()(data=request.data)
         if serializer.is_valid():
-            serializer.save(seller_id=request.user.id)
+            product = serializer.save(seller_id=request.user.id)
+            schedule_derivatives(product)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 
-class ProductDetail(APIView):
+class ProductSuggest(APIView):
+    """
+    Endpoint for search box autocompletion.
+    """
+
+    allowed_methods = ['GET']
+    permission_classes = [AllowAny]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="prefix",
+                type=OpenApiTypes.STR,
+                required=True,
+                description="What the user has typed so far"
+            ),
+            OpenApiParameter(
+                name="limit",
+                type=OpenApiTypes.INT,
+                required=False,
+                description="Number of suggestions to return (default 10, max 25)"
+            ),
+        ]
+    )
+    def get(self, request):
+        """
+        Get the product names and categories starting with a prefix, most listed first
+        """
+        prefix = request.query_params.get('prefix', '')
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 25))
+        except ValueError:
+            limit = 10
+        return Response({"results": suggestions.search(prefix, limit)}, status=status.HTTP_200_OK)
+
+
+class ProductExport(APIView):
+    """
+    Endpoint for aggregators and analytics jobs to download the whole catalog.
+    """
+
+    allowed_methods = ['GET']
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="output",
+                type=OpenApiTypes.STR,
+                required=False,
+                description="Export format. Options: ndjson (default), csv"
+            ),
+        ],
+        responses={(200, content_type): OpenApiTypes.BINARY for content_type in CONTENT_TYPES.values()},
+    )
+    def get(self, request):
+        """
+        Stream every product, oldest first, as NDJSON or CSV
+        """
+        output = request.query_params.get('output', NDJSON)
+        if output not in CONTENT_TYPES:
+            return Response(
+                {"detail": f"Unsupported output, choose one of: {', '.join(CONTENT_TYPES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = StreamingHttpResponse(stream_export(output), content_type=CONTENT_TYPES[output])
+        response.headers["Content-Disposition"] = f'attachment; filename="products.{output}"'
+        return response
+
+
+class ProductImport(APIView):
+    """
+    Endpoint for sellers to create many products at once from a CSV or NDJSON file.
+    """
+
+    allowed_methods = ['POST']
+    parser_classes = [MultiPartParser]
+    permission_classes = [IsAuthenticated, IsFarmer]
+
+    @extend_schema(
+        request={
+            'multipart/form-data': {
+                'type': 'object',
+                'properties': {'file': {'type': 'string', 'format': 'binary'}},
+                'required': ['file'],
+            }
+        },
+    )
+    def post(self, request):
+        """
+        Import products from an uploaded UTF-8 `.csv`, `.ndjson` or `.jsonl` file with the
+        columns name, category, price, stock, unit, min_order and description.
+
+        Valid rows are created and invalid ones are listed by row number in the report. Imported
+        products have no image yet, upload one for each of them with a PATCH of the product.
+        """
+        file = request.FILES.get('file', None)
+        if file is None:
+            return Response({"detail": "No file was uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = detect_format(file)
+        if file_format is None:
+            return Response(
+                {"detail": "Unsupported file type, upload a .csv, .ndjson or .jsonl file"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        report = import_products(file, file_format, request.user)
+        if report.created == 0 and report.failed > 0:
+            return Response(report.data, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.data, status=status.HTTP_201_CREATED)
+
+
+class ProductInventory(APIView):
+    """
+    Endpoint for sellers to change the price and stock of many of their products at once.
+    """
+
+    allowed_methods = ['PATCH']
+    permission_classes = [IsAuthenticated, IsFarmer]
+
+    @extend_schema(request=ProductInventorySerializer(many=True))
+    def patch(self, request):
+        """
+        Apply a list of `{id, price, stock}` changes.
+
+        Changes to products that do not exist, are not yours, are invalid or were modified since
+        the given `updated_at` are listed as conflicts while the rest are applied.
+        """
+        entries = request.data
+        if not isinstance(entries, list) or len(entries) == 0:
+            return Response({"detail": "Expected a non-empty list of changes"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(entries) > MAX_ENTRIES:
+            return Response(
+                {"detail": f"At most {MAX_ENTRIES} changes can be sent at once"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        updated, conflicts = update_inventory(request.user, entries)
+        return Response({"updated": updated, "conflicts": conflicts}, status=status.HTTP_200_OK)
+
+
+class ProductDetail(ProductFieldsMixin, APIView):
     """
     Retrieve, update, or delete a product.
     """
@@ -73,13 +453,36 @@ class ProductDetail(APIView):
         self.check_object_permissions(self.request, obj)
         return obj
 
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="fields",
+                type=OpenApiTypes.STR,
+                required=False,
+                description="Comma separated list of fields to include, or `card` for the fields of a product tile"
+            ),
+        ]
+    )
     def get(self, request, pk):
         """
         Get a Product's details
         """
-        product = self.get_object(pk)
-        serializer = self.get_serializer_class()(product)
-        return Response(serializer.data)
+        versions = Product.objects.filter(pk=pk).values("updated_at", "seller__updated_at").first()
+        if versions is None:
+            raise Http404
+        last_modified = max(versions.values())
+        etag = make_etag(
+            "product", request.get_full_path(), versions["updated_at"], versions["seller__updated_at"]
+        )
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        fields = self.get_requested_fields()
+        product = get_object_or_404(self.project(Product.objects.all(), fields), pk=pk)
+        self.check_object_permissions(request, product)
+        serializer = self.get_serializer_class()(product, fields=fields)
+        return set_validators(Response(serializer.data), etag, last_modified)
 
     def put(self, request, pk):
         """
@@ -89,6 +492,8 @@ class ProductDetail(APIView):
         serializer = self.get_serializer_class()(product, data=request.data)
         if serializer.is_valid():
             serializer.save()
+            if "image" in serializer.validated_data:
+                schedule_derivatives(product)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 